@@ -0,0 +1,212 @@
+from model import Field
+from util import prepare_response_dict
+from async_service import AsyncClassService, AsyncEnrollmentService, AsyncProfileService
+from async_pool import AsyncConnectionPool
+from config import DatabaseConfig, WriteConfig
+from jobs import WriteQueue
+from repository import CLASS_KEY_COLUMNS, ENROLLMENT_ORDER
+from conditional import not_modified, validators
+from pagination import async_page_response, decode_cursor, lookahead_limit
+from transfer import EXPORT_TABLES, IMPORT_TABLES, MEDIA_TYPES, async_export_rows, async_import_spooled, spool_request, validate_transfer
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from constant import Message, DatabaseColumn, Pagination
+
+log = logging.getLogger()
+
+config = DatabaseConfig.from_environment()
+pool = AsyncConnectionPool(config)
+write_config = WriteConfig.from_environment()
+write_queue = WriteQueue(config, write_config) if write_config.mode == "queue" else None
+
+write_services = {
+    "class": lambda conn: AsyncClassService(conn, "class", "instructor", log),
+    "enrollment": lambda conn: AsyncEnrollmentService(conn, "enrollment", "class", log),
+    "student": lambda conn: AsyncProfileService(conn, "student", log),
+    "instructor": lambda conn: AsyncProfileService(conn, "instructor", log),
+}
+
+async def write(service: str, method: str, *arguments):
+    # In queue mode the command runs on the elected writer, which may be another worker
+    if write_queue is not None:
+        return await write_queue.async_call(service, method, *arguments)
+    return await pool.submit(lambda conn: getattr(write_services[service](conn), method)(*arguments))
+
+async def reader_connection():
+    # Held until the response has been sent so streamed rows can still be read from it
+    async with pool.reader() as conn:
+        yield conn
+
+router = APIRouter()
+
+@router.post("/registrar/student")
+async def add_student(field: Field):
+    log.info("Adding new student. Student name: %s %s", field.firstName, field.lastName)
+    response_dict = await write("student", "add_profile", field)
+    log.info("Student added successfully. Student ID: %s", response_dict[DatabaseColumn.ID])
+    return prepare_response_dict(response_dict)
+
+@router.put("/registrar/student")
+async def update_student(field: Field):
+    log.info("Updating student. Student ID: %s", field.id)
+    response = prepare_response_dict(await write("student", "update_profile", field))
+    log.info("Student updated sucessfully")
+    return response
+
+@router.get("/registrar/student/{id}")
+async def get_student(id: str, request: Request, response: Response):
+    log.info("Searching student. Student ID: %s", id)
+    async with pool.reader() as conn:
+        student_service = AsyncProfileService(conn, "student", log)
+        headers = validators(await student_service.table_version())
+        cached = not_modified(request, headers)
+        if cached is not None:
+            return cached
+        response_dict = prepare_response_dict(await student_service.get_profile(id))
+    response.headers.update(headers)
+    return response_dict
+
+@router.delete("/registrar/student/{id}")
+async def delete_student(id: str):
+    log.info("Deleting student. Student ID: %s", id)
+    await write("student", "delete_profile", id)
+    log.info(Message.STUDENT_DELETE_SUCCESSFULLY)
+    return {"msg": Message.STUDENT_DELETE_SUCCESSFULLY}
+
+@router.post("/registrar/instructor")
+async def add_instructor(field: Field):
+    log.info("Adding new instructor. Instructor name: %s %s", field.firstName, field.lastName)
+    response_dict = await write("instructor", "add_profile", field)
+    log.info("Instructor added successfully. Instructor ID: %s", response_dict[DatabaseColumn.ID])
+    return prepare_response_dict(response_dict)
+
+@router.put("/registrar/instructor")
+async def update_instructor_profile(field: Field):
+    log.info("Updating instructor. Instructor ID: %s", field.id)
+    response = prepare_response_dict(await write("instructor", "update_profile", field))
+    log.info("Instructor updated successfully")
+    return response
+
+@router.get("/registrar/instructor/{id}")
+async def get_instructor(id: str, request: Request, response: Response):
+    log.info("Searching instructor. Instructor ID: %s", id)
+    async with pool.reader() as conn:
+        instructor_service = AsyncProfileService(conn, "instructor", log)
+        headers = validators(await instructor_service.table_version())
+        cached = not_modified(request, headers)
+        if cached is not None:
+            return cached
+        response_dict = prepare_response_dict(await instructor_service.get_profile(id))
+    response.headers.update(headers)
+    return response_dict
+
+@router.delete("/registrar/instructor/{id}")
+async def delete_instructor(id: str):
+    log.info("Deleting instructor. Instructor ID: %s", id)
+    await write("instructor", "delete_profile", id)
+    log.info(Message.INSTRUCTOR_DELETE_SUCCESSFULLY)
+    return {"msg": "Instructor deleted successfully"}
+
+@router.post("/registrar/class")
+async def add_class(field: Field):
+    log.info("Adding new class")
+    response_dict = await write("class", "add_class", field)
+    log.info("Class added successfully. Class ID: %s", response_dict[DatabaseColumn.ID])
+    return prepare_response_dict(response_dict)
+
+@router.delete("/registrar/class/{id}")
+async def delete_class(id: str):
+    log.info("Deleting class. Class ID: %s", id)
+    await write("class", "delete_class", id)
+    log.info("Class delete sucessfully")
+    return {"msg": "Class deleted successfully"}
+
+@router.put("/registrar/class/{id}/{instructor_id}")
+async def update_instructor(id: str, instructor_id: str):
+    log.info("Updating class instructor. Class Id: %s. Instructor ID: %s", id, instructor_id)
+    await write("class", "update_instructor", id, instructor_id)
+    log.info(Message.CLASS_INSTRUCTOR_UPDATED_SUCCESSFULLY)
+    return {"msg": Message.CLASS_INSTRUCTOR_UPDATED_SUCCESSFULLY}
+
+
+@router.post("/registrar/import/{table_name}")
+async def import_table(table_name: str, request: Request, format: str = "csv"):
+    validate_transfer(table_name, format, IMPORT_TABLES)
+    if write_queue is not None:
+        # An import commits large chunks of its own and would contend with the elected writer for the write lock
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.IMPORT_WRITES_QUEUED)
+    log.info("Importing %s from %s", table_name, format)
+    body = await spool_request(request)
+    # Runs on the pool's single writer, so other writes queue behind the import's chunk transactions
+    # instead of contending with them for the database lock
+    return await pool.submit(lambda conn: async_import_spooled(conn, write_services[table_name](conn), table_name, format, body, log))
+
+@router.get("/registrar/export/{table_name}")
+async def export_table(table_name: str, format: str = "csv"):
+    validate_transfer(table_name, format, EXPORT_TABLES)
+    log.info("Exporting %s as %s", table_name, format)
+
+    async def stream():
+        async with pool.reader() as conn:
+            async for chunk in async_export_rows(conn, table_name, format, log):
+                yield chunk
+    return StreamingResponse(stream(), media_type=MEDIA_TYPES[format])
+
+
+@router.get("/student/class")
+async def available_classes(request: Request, department: str = None, courseCode: str = None, frozen: bool = None, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), conn = Depends(reader_connection)):
+    class_service = AsyncClassService(conn, "class", "instructor", log)
+    if department is None and courseCode is None and frozen is None and after is None and limit is None:
+        snapshot = await class_service.available_classes()
+        headers = validators(snapshot.version())
+        cached = not_modified(request, headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers) if cached is None else cached
+    headers = validators(await class_service.table_version())
+    cached = not_modified(request, headers)
+    if cached is not None:
+        return cached
+    rows = class_service.iter_available_classes(department, courseCode, frozen, decode_cursor(after, CLASS_KEY_COLUMNS), lookahead_limit(limit))
+    return await async_page_response(rows, limit, CLASS_KEY_COLUMNS, headers)
+
+@router.post("/student/class")
+async def enroll(field: Field):
+    await write("enrollment", "enroll", field)
+    return {"msg": "Enrolled successfully"}
+
+@router.post("/student/class/bulk")
+async def bulk_enroll(fields: list[Field]):
+    log.info("Bulk enrolling %s students", len(fields))
+    return await write("enrollment", "bulk_enroll", fields)
+
+@router.delete("/student/class")
+async def drop_enrollment(field: Field):
+    await write("enrollment", "drop_enrollment", field)
+    return {"msg": "Enrollment dropped successfully"}
+
+@router.get("/student/class/waitinglist")
+async def waitinglist_position(field: Field):
+    async with pool.reader() as conn:
+        position = await AsyncEnrollmentService(conn, "enrollment", "class", log).waiting_list_position(field)
+    return {"msg": f"Current position in waiting list: {position}"}
+
+
+@router.get("/instructor/waitinglist")
+async def waiting_list(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), conn = Depends(reader_connection)):
+    rows = await AsyncEnrollmentService(conn, "enrollment", "class", log).iter_class_enrollment(field, True, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return await async_page_response(rows, limit, ENROLLMENT_ORDER)
+
+@router.get("/instructor/class")
+async def current_enrollment(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), conn = Depends(reader_connection)):
+    rows = await AsyncEnrollmentService(conn, "enrollment", "class", log).iter_class_enrollment(field, False, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return await async_page_response(rows, limit, ENROLLMENT_ORDER)
+
+@router.get("/instructor/class/dropped")
+async def dropped_student(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), conn = Depends(reader_connection)):
+    rows = await AsyncEnrollmentService(conn, "enrollment", "class", log).iter_dropped_student(field, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return await async_page_response(rows, limit, ENROLLMENT_ORDER)
+
+@router.delete("/instructor/class")
+async def drop_student(field: Field):
+    await write("enrollment", "drop_enrollment", field)
+    return {"msg": "Student dropped successfully"}
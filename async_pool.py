@@ -0,0 +1,132 @@
+import aiosqlite
+from asyncio import CancelledError, Lock, Queue, get_running_loop, wait_for, TimeoutError
+from contextlib import asynccontextmanager
+from sqlite3 import Row
+from time import perf_counter
+from config import DatabaseConfig
+from pool import PoolExhaustedError
+
+
+class AsyncConnectionPool:
+
+    def __init__(self, config: DatabaseConfig):
+        self._config = config
+        self._timeout = config.pool_timeout
+        self._idle_readers = None
+        self._reader_count = 0
+        self._writes = None
+        self._writer_task = None
+        self._start_lock = Lock()
+        self._checkouts = 0
+        self._in_use = 0
+        self._exhausted = 0
+        self._queued_writes = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    @asynccontextmanager
+    async def reader(self):
+        await self._start()
+        start = perf_counter()
+        if self._idle_readers.empty() and self._reader_count < self._config.max_readers:
+            self._reader_count += 1
+            try:
+                conn = await self._connect()
+            except Exception:
+                self._reader_count -= 1
+                raise
+        else:
+            try:
+                conn = await wait_for(self._idle_readers.get(), self._timeout)
+            except TimeoutError:
+                self._exhausted += 1
+                raise PoolExhaustedError("Timed out waiting for a reader connection")
+        self._record_checkout(perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._in_use -= 1
+            self._idle_readers.put_nowait(conn)
+
+    async def submit(self, operation):
+        # Every write runs on the single writer task, one operation at a time
+        await self._start()
+        future = get_running_loop().create_future()
+        self._queued_writes += 1
+        await self._writes.put((operation, future, perf_counter()))
+        return await future
+
+    def stats(self):
+        return {
+            "checkouts": self._checkouts,
+            "in_use": self._in_use,
+            "idle_readers": 0 if self._idle_readers is None else self._idle_readers.qsize(),
+            "reader_connections": self._reader_count,
+            "max_readers": self._config.max_readers,
+            "exhausted": self._exhausted,
+            "queued_writes": self._queued_writes,
+            "wait_time_total": self._wait_time_total,
+            "wait_time_max": self._wait_time_max,
+        }
+
+    async def close(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except CancelledError:
+                pass
+            self._writer_task = None
+        if self._idle_readers is not None:
+            while not self._idle_readers.empty():
+                await self._idle_readers.get_nowait().close()
+                self._reader_count -= 1
+
+    async def _start(self):
+        if self._writer_task is not None:
+            return
+        async with self._start_lock:
+            if self._writer_task is None:
+                self._idle_readers = Queue()
+                self._writes = Queue()
+                writer = await self._connect()
+                self._writer_task = get_running_loop().create_task(self._run_writer(writer))
+
+    async def _run_writer(self, conn: aiosqlite.Connection):
+        try:
+            while True:
+                operation, future, queued_on = await self._writes.get()
+                self._queued_writes -= 1
+                self._record_checkout(perf_counter() - queued_on)
+                try:
+                    result = await operation(conn)
+                except Exception as e:
+                    if conn.in_transaction:
+                        await conn.rollback()
+                    if not future.cancelled():
+                        # Drop the writer frame from the traceback so callers cannot clear it while it is running
+                        future.set_exception(e.with_traceback(e.__traceback__.tb_next))
+                else:
+                    if conn.in_transaction:
+                        await conn.rollback()
+                    if not future.cancelled():
+                        future.set_result(result)
+                finally:
+                    self._in_use -= 1
+        finally:
+            await conn.close()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self._config.database, cached_statements=self._config.cached_statements)
+        for statement in self._config.pragma_statements():
+            await conn.execute(statement)
+        conn.row_factory = Row
+        return conn
+
+    def _record_checkout(self, wait_time: float):
+        self._checkouts += 1
+        self._in_use += 1
+        self._wait_time_total += wait_time
+        self._wait_time_max = max(self._wait_time_max, wait_time)
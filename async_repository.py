@@ -0,0 +1,223 @@
+from aiosqlite import Connection
+from logging import Logger
+from uuid import uuid4
+from time import perf_counter
+from repository import BasicRepository, ClassRepository, EnrollmentRepository, ProfileRepository, query_log, traced
+from records import row_factory
+from constant import Batch, DatabaseColumn
+
+
+class AsyncBasicRepository(BasicRepository):
+
+    def __init__(self, conn: Connection, table_name: str, log: Logger):
+        super().__init__(conn, table_name, log)
+
+    @traced
+    async def save(self, data_dict: dict):
+        query_log.debug("Data dict: %s", data_dict)
+        if DatabaseColumn.ID in data_dict.keys() and await self.exists_by_attribute({DatabaseColumn.ID: data_dict[DatabaseColumn.ID]}):
+            query, argument = self._prepare_update(data_dict)
+        else:
+            query, argument = self._prepare_insert(data_dict)
+        await self._execute(query, argument)
+        return data_dict
+
+    @traced
+    async def save_all(self, data_list: list):
+        inserts = {}
+        for data in data_list:
+            if DatabaseColumn.ID in data.keys():
+                await self.save(data)
+            else:
+                data[DatabaseColumn.ID] = str(uuid4())
+                inserts.setdefault(tuple(data.keys()), []).append(list(data.values()))
+        for keys, arguments in inserts.items():
+            await self._executemany(self._generate_save_query(keys), arguments)
+        return data_list
+
+    @traced
+    async def find_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND, wild_card = None):
+        query, argument = self._prepare_find(pairs, separator, wild_card)
+        data = await self._fetchone(query, argument)
+        return None if data is None else dict(data)
+
+    @traced
+    async def exists_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
+        query, argument = self._prepare_exists(pairs, separator)
+        entity_exists = (await self._fetchone(query, argument))[0]
+        return True if entity_exists == 1 else False
+
+    @traced
+    async def delete_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
+        query, argument = self._prepare_delete(pairs, separator)
+        await self._execute(query, argument)
+
+    @traced
+    async def find_all_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
+        query, argument = self._prepare_find_all(pairs, separator)
+        return [dict(x) for x in await self._fetchall(query, argument)]
+
+    @traced
+    async def iter_by_attribute(self, pairs: dict = {}, separator: str = DatabaseColumn.AND, batch_size: int = Batch.FETCH_SIZE):
+        query, argument = self._prepare_find_all(pairs, separator)
+        async for row in self._iter_query(query, argument, batch_size):
+            yield row
+
+    @traced
+    async def iter_page(self, pairs: dict, order_by: tuple, after: tuple = None, limit: int = None, condition: str = "", batch_size: int = Batch.FETCH_SIZE, columns: str = "*"):
+        query, argument = self._prepare_page(pairs, order_by, after, limit, condition, columns)
+        async for row in self._iter_query(query, argument, batch_size):
+            yield row
+
+    async def _iter_query(self, query: str, argument: list, batch_size: int):
+        start = perf_counter()
+        elapsed = 0.0
+        count = 0
+        try:
+            async with self._conn.cursor() as cursor:
+                cursor.row_factory = None
+                await cursor.execute(query, argument)
+                elapsed += perf_counter() - start
+                make = row_factory(self._table_name, cursor.description)
+                while True:
+                    start = perf_counter()
+                    rows = await cursor.fetchmany(batch_size)
+                    elapsed += perf_counter() - start
+                    if len(rows) == 0:
+                        break
+                    count += len(rows)
+                    for row in rows:
+                        yield make(row)
+        finally:
+            self._record(query, elapsed, count)
+
+    @traced
+    async def find_all_in(self, columns: tuple, values: list):
+        data = []
+        for query, argument in self._prepare_find_all_in(columns, values):
+            data.extend([dict(x) for x in await self._fetchall(query, argument)])
+        return data
+
+    @traced
+    async def compare_and_set(self, entity_id: str, expected: dict, changes: dict):
+        query, argument = self._prepare_compare_and_set(entity_id, expected, changes)
+        return await self._execute(query, argument) == 1
+
+    @traced
+    async def count_by_attribute(self, pairs: dict = {}, separator: str = DatabaseColumn.AND):
+        query, argument = self._prepare_count(pairs, separator)
+        return (await self._fetchone(query, argument))[0]
+
+    @traced
+    async def table_version(self):
+        row = await self._fetchone(self._prepare_table_version(), [self._table_name])
+        return None if row is None else tuple(row)
+
+    async def _execute(self, query: str, argument: list):
+        # Returns the row count, since an aiosqlite cursor is closed once the statement has run
+        start = perf_counter()
+        async with self._conn.execute(query, argument) as cursor:
+            rowcount = cursor.rowcount
+        self._record(query, perf_counter() - start, rowcount)
+        return rowcount
+
+    async def _executemany(self, query: str, arguments: list):
+        start = perf_counter()
+        async with self._conn.executemany(query, arguments) as cursor:
+            rowcount = cursor.rowcount
+        self._record(query, perf_counter() - start, rowcount)
+        return rowcount
+
+    async def _fetchone(self, query: str, argument: list):
+        start = perf_counter()
+        async with self._conn.execute(query, argument) as cursor:
+            row = await cursor.fetchone()
+        self._record(query, perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    async def _fetchall(self, query: str, argument: list):
+        start = perf_counter()
+        async with self._conn.execute(query, argument) as cursor:
+            rows = await cursor.fetchall()
+        self._record(query, perf_counter() - start, len(rows))
+        return rows
+
+
+class AsyncClassRepository (AsyncBasicRepository, ClassRepository):
+
+    def __init__(self, conn: Connection, table_name: str, log: Logger):
+        super().__init__(conn, table_name, log)
+
+    @traced
+    async def compareEnrollment(self, class_data: dict):
+        query, argument = self._prepare_compare_enrollment(class_data)
+        return await self._execute(query, argument) == 1
+
+    @traced
+    async def compareEnrollments(self, classes: list):
+        query, arguments = self._prepare_compare_enrollments(classes)
+        return await self._executemany(query, arguments) == len(arguments)
+
+    @traced
+    async def findEnrollmentDrift(self, enrollment_table_name: str):
+        return [tuple(x) for x in await self._fetchall(self._prepare_enrollment_drift(enrollment_table_name), [])]
+
+    @traced
+    async def reconcileEnrollments(self, enrollment_table_name: str, class_ids: list):
+        query, arguments = self._prepare_reconcile_enrollments(enrollment_table_name, class_ids)
+        return await self._executemany(query, arguments)
+
+    @traced
+    async def findAvailableClasses(self, enrollment_table_name: str, class_ids: list = None):
+        if class_ids is None:
+            return [dict(x) for x in await self._fetchall(self._prepare_available_classes(enrollment_table_name), [])]
+        data = []
+        for query, argument in self._prepare_available_classes_in(enrollment_table_name, class_ids):
+            data.extend([dict(x) for x in await self._fetchall(query, argument)])
+        return data
+
+    @traced
+    async def latestChange(self):
+        row = await self._fetchone(self._prepare_latest_change(), [])
+        return None if row is None else tuple(row)
+
+    @traced
+    async def firstChange(self):
+        return (await self._fetchone(self._prepare_first_change(), []))[0]
+
+    @traced
+    async def findChangedClasses(self, after: int, until: int):
+        return [x[0] for x in await self._fetchall(self._prepare_changed_classes(), [after, until])]
+
+
+class AsyncEnrollmentRepository (AsyncBasicRepository, EnrollmentRepository):
+
+    def __init__(self, conn: Connection, table_name: str, log: Logger):
+        super().__init__(conn, table_name, log)
+
+    @traced
+    async def countWaitingListByStudent(self, student_ids: list):
+        counts = {}
+        for query, argument in self._prepare_count_waiting_list_by_student(student_ids):
+            counts.update({x[0]: x[1] for x in await self._fetchall(query, argument)})
+        return counts
+
+    @traced
+    async def waitingListPosition(self, class_id: str, student_id: str):
+        query, argument = self._prepare_waiting_list_position(class_id, student_id)
+        data = await self._fetchone(query, argument)
+        return None if data is None else data[0]
+
+    @traced
+    async def waitingListPositions(self, class_id: str):
+        query, argument = self._prepare_waiting_list_positions(class_id)
+        positions = {}
+        for student_id, position in await self._fetchall(query, argument):
+            positions.setdefault(student_id, position)
+        return positions
+
+
+class AsyncProfileRepository (AsyncBasicRepository, ProfileRepository):
+
+    def __init__(self, conn: Connection, table_name: str, log: Logger):
+        super().__init__(conn, table_name, log)
@@ -0,0 +1,239 @@
+from async_repository import AsyncClassRepository, AsyncEnrollmentRepository, AsyncProfileRepository
+from cache import available_snapshot, class_cache, waiting_list_index
+from service import PROMOTION_ORDER, ClassService, EnrollmentService, ProfileService, cache_class, require_class
+from repository import CLASS_KEY_COLUMNS, ENROLLMENT_ORDER
+from model import Field, get_find_class_dict, parse_import_records
+from aiosqlite import Connection
+from logging import Logger
+from constant import Concurrency, DatabaseColumn, Message
+from starlette import status
+from starlette.exceptions import HTTPException
+
+
+class AsyncClassService(ClassService):
+
+    def __init__(self, conn: Connection, class_table_name: str, instructor_table_name: str, log: Logger, enrollment_table_name: str = "enrollment"):
+        self._conn = conn
+        self._log = log
+        self._enrollment_table_name = enrollment_table_name
+        self._class_repository = AsyncClassRepository(conn, class_table_name, log)
+        self._instructor_repository = AsyncProfileRepository(conn, instructor_table_name, log)
+
+    async def add_class(self, field: Field):
+        self._require_instructor(field, await self._instructor_repository.exists_by_attribute({DatabaseColumn.ID: field.instructorId}))
+        class_data = self._new_class(field, await self._class_repository.exists_by_attribute(get_find_class_dict(field)))
+        saved_class_data = await self._class_repository.save(class_data)
+        await self._conn.commit()
+        class_cache.put(saved_class_data)
+        return saved_class_data
+
+    async def delete_class(self, id: str):
+        id_dict = {DatabaseColumn.ID: id}
+        require_class(await self._class_repository.exists_by_attribute(id_dict))
+        await self._class_repository.delete_by_attribute(id_dict)
+        await self._conn.commit()
+        self._deleted(id)
+
+    async def update_instructor(self, id: str, instructor_id: str):
+        require_class(await self._class_repository.find_by_attribute({DatabaseColumn.ID: id}))
+        await self._class_repository.save({DatabaseColumn.ID: id, DatabaseColumn.INSTRUCTOR_ID: instructor_id})
+        await self._conn.commit()
+        class_cache.invalidate(id)
+
+    async def available_classes(self):
+        snapshot = available_snapshot.get()
+        seq, changed_on = await self._class_repository.latestChange() or (0, None)
+        if snapshot is not None and snapshot.seq == seq:
+            return snapshot
+        class_ids = None
+        if snapshot is not None and snapshot.seq < seq and await self._class_repository.firstChange() <= snapshot.seq + 1:
+            class_ids = await self._class_repository.findChangedClasses(snapshot.seq, seq)
+        if self._reloads_snapshot(snapshot, seq, class_ids):
+            return available_snapshot.replace(seq, changed_on, await self._class_repository.findAvailableClasses(self._enrollment_table_name))
+        return available_snapshot.apply(seq, changed_on, class_ids, await self._class_repository.findAvailableClasses(self._enrollment_table_name, class_ids))
+
+    async def table_version(self):
+        return await self._class_repository.table_version()
+
+    async def import_chunk(self, records: list):
+        rejected = []
+        fields = list(parse_import_records(records, rejected))
+        instructor_keys, class_keys = self._import_keys(fields)
+        instructors = await self._instructor_repository.find_all_in((DatabaseColumn.ID,), instructor_keys)
+        classes = self._import_rows(fields, instructors, await self._class_repository.find_all_in(CLASS_KEY_COLUMNS, class_keys), rejected)
+        await self._class_repository.save_all(classes)
+        class_cache.invalidate()
+        return len(classes), rejected
+
+
+class AsyncEnrollmentService(EnrollmentService):
+
+    def __init__(self, conn: Connection, enrollment_table_name: str, class_table_name: str, log: Logger, student_table_name: str = "student"):
+        self._conn = conn
+        self._enrollment_table_name = enrollment_table_name
+        self._class_repository = AsyncClassRepository(conn, class_table_name, log)
+        self._enrollment_repository = AsyncEnrollmentRepository(conn, enrollment_table_name, log)
+        self._student_repository = AsyncProfileRepository(conn, student_table_name, log)
+
+    async def enroll(self, field: Field):
+        for attempt in range(Concurrency.MAX_RETRIES):
+            class_data = await self._find_class(field, attempt == 0)
+            if attempt == 0 and self._enrollment_error(class_data) is not None:
+                # Only the stored row can reject an enrollment; the cached one may predate a drop made elsewhere
+                class_data = await self._find_class(field, False)
+            self._validate_enrollment(class_data)
+            self._validate_waiting_lists(await self._enrollment_repository.count_by_attribute(self._student_waiting_list_dict(field)))
+            enrollment_data = self._new_enrollment(field, class_data)
+            try:
+                if await self._class_repository.compareEnrollment(class_data):
+                    await self._enrollment_repository.save(enrollment_data)
+                    await self._conn.commit()
+                    self._enrolled([(class_data, 1)], [enrollment_data])
+                    return enrollment_data
+                await self._conn.rollback()
+                self._conflicted([class_data])
+            except Exception:
+                await self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    async def drop_enrollment(self, field: Field):
+        for attempt in range(Concurrency.MAX_RETRIES):
+            class_data = await self._get_class_data(field, attempt == 0)
+            enrollment_data = self._require_enrollment(await self._enrollment_repository.find_by_attribute(self._student_enrollment_dict(field, class_data)))
+            migrate_enrollment = None
+            if self._promotes_waiting_list(class_data, enrollment_data):
+                migrate_enrollment = await self._enrollment_repository.find_by_attribute(self._waiting_list_dict(class_data), wild_card=PROMOTION_ORDER)
+            try:
+                if (await self._class_repository.compareEnrollment(class_data)
+                        and await self._enrollment_repository.compare_and_set(*self._drop_change(enrollment_data))
+                        and (migrate_enrollment is None or await self._enrollment_repository.compare_and_set(*self._promote_change(migrate_enrollment)))):
+                    await self._conn.commit()
+                    self._dropped(class_data, enrollment_data, migrate_enrollment)
+                    return migrate_enrollment
+                await self._conn.rollback()
+                self._conflicted([class_data])
+            except Exception:
+                await self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    async def bulk_enroll(self, fields: list):
+        student_keys, class_keys = self._bulk_keys(fields)
+        for _ in range(Concurrency.MAX_RETRIES):
+            classes = await self._class_repository.find_all_in(CLASS_KEY_COLUMNS, class_keys)
+            student_ids = {x[DatabaseColumn.ID] for x in await self._student_repository.find_all_in((DatabaseColumn.ID,), student_keys)}
+            waiting_list_counts = await self._enrollment_repository.countWaitingListByStudent([x[0] for x in student_keys])
+            results, enrollments, class_deltas = self._place_enrollments(fields, classes, student_ids, waiting_list_counts)
+            try:
+                if await self._class_repository.compareEnrollments([x for x, _ in class_deltas]):
+                    await self._enrollment_repository.save_all(enrollments)
+                    await self._conn.commit()
+                    self._enrolled(class_deltas, enrollments)
+                    return results
+                await self._conn.rollback()
+                self._conflicted([x for x, _ in class_deltas])
+            except Exception:
+                await self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    async def waiting_list_position(self, field: Field):
+        class_data = await self._get_class_data(field)
+        await self._follow_waiting_lists()
+        position = waiting_list_index.position(class_data[DatabaseColumn.ID], field.id)
+        if position is None:
+            version = waiting_list_index.version(class_data[DatabaseColumn.ID])
+            position = self._index_waiting_list(class_data, [x async for x in self._enrollment_repository.iter_page(self._waiting_list_dict(class_data), ENROLLMENT_ORDER)], version, field.id)
+        return self._require_position(position)
+
+    async def check_waiting_list_positions(self):
+        await self._follow_waiting_lists()
+        mismatches = []
+        for class_id, positions in waiting_list_index.snapshot().items():
+            self._compare_positions(class_id, positions, await self._enrollment_repository.waitingListPositions(class_id), mismatches)
+        return mismatches
+
+    async def reconcile_enrollment_counts(self, repair: bool = False):
+        drift = [{"classId": x[0], "stored": x[1], "actual": x[2]} for x in await self._class_repository.findEnrollmentDrift(self._enrollment_table_name)]
+        if repair and len(drift) != 0:
+            try:
+                await self._class_repository.reconcileEnrollments(self._enrollment_table_name, [x["classId"] for x in drift])
+                await self._conn.commit()
+            except Exception:
+                await self._conn.rollback()
+                raise
+            self._reconciled(drift)
+        return drift
+
+    async def class_enrollment(self, field: Field, on_waiting_list: bool):
+        return [x async for x in await self.iter_class_enrollment(field, on_waiting_list)]
+
+    async def dropped_student(self, field: Field):
+        return [x async for x in await self.iter_dropped_student(field)]
+
+    async def iter_class_enrollment(self, field: Field, on_waiting_list: bool, after: tuple = None, limit: int = None):
+        class_data = await self._get_class_data(field)
+        return self._enrollment_repository.iter_page(self._class_enrollment_dict(class_data, on_waiting_list), ENROLLMENT_ORDER, after, limit)
+
+    async def iter_dropped_student(self, field: Field, after: tuple = None, limit: int = None):
+        class_data = await self._get_class_data(field)
+        return self._enrollment_repository.iter_page(self._dropped_student_dict(class_data), ENROLLMENT_ORDER, after, limit)
+
+    async def _get_class_data(self, field: Field, cached: bool = True):
+        return require_class(await self._find_class(field, cached))
+
+    async def _follow_waiting_lists(self):
+        seq = (await self._class_repository.latestChange() or (0, None))[0]
+        after = waiting_list_index.seq
+        if seq > after and await self._class_repository.firstChange() <= after + 1:
+            waiting_list_index.advance(seq, await self._class_repository.findChangedClasses(after, seq))
+        elif seq != after:
+            waiting_list_index.advance(seq)
+
+    async def _find_class(self, field: Field, cached: bool = True):
+        class_data = class_cache.get_by_key((field.department, field.courseCode, field.sectionNumber)) if cached else None
+        if class_data is None:
+            generation = class_cache.generation
+            class_data = cache_class(await self._class_repository.find_by_attribute(get_find_class_dict(field)), generation)
+        return class_data
+
+
+class AsyncProfileService(ProfileService):
+
+    def __init__(self, conn: Connection, table_name: str, log: Logger):
+        self._conn = conn
+        self._log = log
+        self._profile_repository = AsyncProfileRepository(conn, table_name, log)
+
+    async def add_profile(self, field: Field):
+        student = self._validate_details(field)
+        saved_student = await self._profile_repository.save(student)
+        await self._conn.commit()
+        return saved_student
+
+    async def get_profile(self, id: str):
+        return self._require_profile(await self._profile_repository.find_by_attribute({DatabaseColumn.ID: id}))
+
+    async def table_version(self):
+        return await self._profile_repository.table_version()
+
+    async def update_profile(self, field: Field):
+        profile = self._require_profile(await self._profile_repository.find_by_attribute({DatabaseColumn.ID: field.id}))
+        self._validate_details(field)
+        saved_profile = await self._profile_repository.save(profile | {DatabaseColumn.ID: field.id} | self._profile_dict(field))
+        await self._conn.commit()
+        return saved_profile
+
+    async def delete_profile(self, id: str):
+        profile_id_dict = {DatabaseColumn.ID: id}
+        self._require_profile(await self._profile_repository.find_by_attribute(profile_id_dict))
+        await self._profile_repository.delete_by_attribute(profile_id_dict)
+        await self._conn.commit()
+
+    async def import_chunk(self, records: list):
+        rejected = []
+        fields = list(parse_import_records(records, rejected))
+        profiles = self._import_rows(fields, await self._profile_repository.find_all_in((DatabaseColumn.ID,), self._import_keys(fields)), rejected)
+        await self._profile_repository.save_all(profiles)
+        return len(profiles), rejected
@@ -0,0 +1,499 @@
+#!/bin/python3
+
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import environ, path
+from statistics import mean, quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from timeit import repeat
+from uuid import uuid4
+from config import DatabaseConfig, WriteConfig
+from repository import BasicRepository
+from records import EnrollmentRecord, encode_rows
+from serialization import CODECS, use_codec
+from schema import create_database
+from constant import DatabaseColumn
+
+log = logging.getLogger("benchmark")
+
+DEPARTMENTS = ("CPSC", "MATH", "PHYS", "CHEM", "BIOL", "ENGL", "HIST", "ECON")
+
+# Runs in a fresh interpreter, so every phase pays what a newly started worker pays
+COLD_START_SCRIPT = """
+import json
+from time import perf_counter
+started = perf_counter()
+import controller
+imported = perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(controller.app)
+starting = perf_counter()
+with client:
+    ready = perf_counter()
+    status_code = client.get("/student/class").status_code
+    answered = perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "startup_ms": (ready - starting) * 1000, "first_request_ms": (answered - ready) * 1000, "status": status_code}))
+"""
+
+
+class Scenario:
+
+    def __init__(self, route: str, build, record = None, iterations = None):
+        self.route = route
+        self.build = build
+        self.record = record
+        self.iterations = iterations
+
+
+class BenchmarkState:
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.students = []
+        self.instructors = []
+        self.classes = []
+        self.class_weights = []
+        self.enrolled = []
+        self.created_students = []
+        self.created_instructors = []
+        self.created_classes = []
+
+    def student(self):
+        return self.random.choice(self.students)
+
+    def popular_class(self):
+        return self.random.choices(self.classes, weights=self.class_weights)[0]
+
+    def enrollment_body(self, student_id: str, class_data: dict):
+        return {
+            "id": student_id,
+            "department": class_data[DatabaseColumn.DEPARTMENT],
+            "courseCode": class_data[DatabaseColumn.COURSE_CODE],
+            "sectionNumber": class_data[DatabaseColumn.SECTION_NUMBER],
+        }
+
+
+def generate_data(conn: sqlite3.Connection, state: BenchmarkState, students: int, classes: int, skew: float):
+    # Class popularity follows a Zipf-like curve so a few sections receive most of the enrollment demand
+    instructors = [profile(state, x) for x in range(max(1, classes // 4))]
+    BasicRepository(conn, "instructor", log).save_all(instructors)
+    state.instructors = [x[DatabaseColumn.ID] for x in instructors]
+    class_rows = []
+    for index in range(classes):
+        class_rows.append({
+            DatabaseColumn.INSTRUCTOR_ID: state.random.choice(state.instructors),
+            DatabaseColumn.DEPARTMENT: DEPARTMENTS[index % len(DEPARTMENTS)],
+            DatabaseColumn.COURSE_CODE: str(100 + index // len(DEPARTMENTS)),
+            DatabaseColumn.SECTION_NUMBER: 1,
+            DatabaseColumn.CLASS_NAME: f"Class {index}",
+            DatabaseColumn.CURRENT_ENROLLMENT: 0,
+            DatabaseColumn.MAX_ENROLLMENT: state.random.randint(10, 60),
+            DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN: state.random.random() < 0.05,
+        })
+    BasicRepository(conn, "class", log).save_all(class_rows)
+    state.classes = class_rows
+    state.class_weights = [1 / (rank + 1) ** skew for rank in range(classes)]
+    student_rows = [profile(state, x) for x in range(students)]
+    BasicRepository(conn, "student", log).save_all(student_rows)
+    state.students = [x[DatabaseColumn.ID] for x in student_rows]
+    conn.commit()
+
+
+def profile(state: BenchmarkState, index: int):
+    return {
+        DatabaseColumn.FIRST_NAME: f"First{index}",
+        DatabaseColumn.LAST_NAME: f"Last{index}",
+        DatabaseColumn.AGE: state.random.randint(17, 70),
+    }
+
+
+def profile_body(state: BenchmarkState, id: str = None):
+    body = {"firstName": "Bench", "lastName": f"Mark{state.random.randint(0, 10 ** 6)}", "age": state.random.randint(17, 70)}
+    if id is not None:
+        body["id"] = id
+    return body
+
+
+def import_body(state: BenchmarkState, rows: int):
+    lines = ["firstName,lastName,age"]
+    lines.extend([f"Import,Row{x},{state.random.randint(17, 70)}" for x in range(rows)])
+    return "\n".join(lines) + "\n"
+
+
+def scenarios(state: BenchmarkState, requests: int):
+    def created(target: list):
+        def record(request, response):
+            if response.status_code == 200:
+                target.append(response.json()["id"])
+        return record
+
+    def enrolled(request, response):
+        if response.status_code == 200:
+            state.enrolled.append(request[2]["json"])
+
+    def bulk_enrolled(request, response):
+        if response.status_code == 200:
+            state.enrolled.extend([x for x in response.json() if x["status"] != "rejected"])
+
+    def new_class(i):
+        return {
+            "instructorId": state.random.choice(state.instructors),
+            "department": "BENCH",
+            "courseCode": str(i),
+            "sectionNumber": 1,
+            "className": f"Benchmark {i}",
+            "maxEnrollment": 30,
+        }
+
+    def class_body():
+        class_data = state.popular_class()
+        return {"department": class_data[DatabaseColumn.DEPARTMENT], "courseCode": class_data[DatabaseColumn.COURSE_CODE], "sectionNumber": class_data[DatabaseColumn.SECTION_NUMBER]}
+
+    def take(created: list):
+        return created.pop() if len(created) != 0 else "missing"
+
+    def class_id():
+        return state.random.choice(state.created_classes) if len(state.created_classes) != 0 else state.random.choice(state.classes)[DatabaseColumn.ID]
+
+    def drop():
+        return state.enrolled.pop(state.random.randrange(len(state.enrolled))) if len(state.enrolled) != 0 else state.enrollment_body(state.student(), state.popular_class())
+
+    bulk_size = 50
+    transfer_iterations = max(1, requests // 20)
+    return [
+        Scenario("POST /registrar/student", lambda i: ("POST", "/registrar/student", {"json": profile_body(state)}), created(state.created_students)),
+        Scenario("GET /registrar/student/{id}", lambda i: ("GET", f"/registrar/student/{state.random.choice(state.created_students or state.students)}", {})),
+        Scenario("PUT /registrar/student", lambda i: ("PUT", "/registrar/student", {"json": profile_body(state, state.random.choice(state.created_students or state.students))})),
+        Scenario("POST /registrar/instructor", lambda i: ("POST", "/registrar/instructor", {"json": profile_body(state)}), created(state.created_instructors)),
+        Scenario("GET /registrar/instructor/{id}", lambda i: ("GET", f"/registrar/instructor/{state.random.choice(state.created_instructors or state.instructors)}", {})),
+        Scenario("PUT /registrar/instructor", lambda i: ("PUT", "/registrar/instructor", {"json": profile_body(state, state.random.choice(state.created_instructors or state.instructors))})),
+        Scenario("POST /registrar/class", lambda i: ("POST", "/registrar/class", {"json": new_class(i)}), created(state.created_classes)),
+        Scenario("PUT /registrar/class/{id}/{instructor_id}", lambda i: ("PUT", f"/registrar/class/{class_id()}/{state.random.choice(state.instructors)}", {})),
+        Scenario("GET /student/class", lambda i: ("GET", "/student/class", {})),
+        Scenario("GET /student/class?limit", lambda i: ("GET", "/student/class", {"params": {"department": state.random.choice(DEPARTMENTS), "limit": 20}})),
+        Scenario("POST /student/class", lambda i: ("POST", "/student/class", {"json": state.enrollment_body(state.student(), state.popular_class())}), enrolled),
+        Scenario("POST /student/class/bulk", lambda i: ("POST", "/student/class/bulk", {"json": [state.enrollment_body(state.student(), state.popular_class()) for _ in range(bulk_size)]}), bulk_enrolled, max(1, requests // 10)),
+        Scenario("GET /student/class/waitinglist", lambda i: ("GET", "/student/class/waitinglist", {"json": state.random.choice(state.enrolled) if state.enrolled else class_body()})),
+        Scenario("GET /instructor/class", lambda i: ("GET", "/instructor/class", {"json": class_body()})),
+        Scenario("GET /instructor/waitinglist", lambda i: ("GET", "/instructor/waitinglist", {"json": class_body()})),
+        Scenario("GET /instructor/class/dropped", lambda i: ("GET", "/instructor/class/dropped", {"json": class_body()})),
+        Scenario("DELETE /student/class", lambda i: ("DELETE", "/student/class", {"json": drop()})),
+        Scenario("DELETE /instructor/class", lambda i: ("DELETE", "/instructor/class", {"json": drop()})),
+        Scenario("GET /registrar/export/{table_name}", lambda i: ("GET", "/registrar/export/enrollment", {"params": {"format": "ndjson"}}), iterations=transfer_iterations),
+        Scenario("POST /registrar/import/{table_name}", lambda i: ("POST", "/registrar/import/student", {"params": {"format": "csv"}, "content": import_body(state, 500)}), iterations=transfer_iterations),
+        Scenario("DELETE /registrar/class/{id}", lambda i: ("DELETE", f"/registrar/class/{take(state.created_classes)}", {})),
+        Scenario("DELETE /registrar/student/{id}", lambda i: ("DELETE", f"/registrar/student/{take(state.created_students)}", {})),
+        Scenario("DELETE /registrar/instructor/{id}", lambda i: ("DELETE", f"/registrar/instructor/{take(state.created_instructors)}", {})),
+        Scenario("GET /stats", lambda i: ("GET", "/stats", {})),
+    ]
+
+
+def run_scenario(client, scenario: Scenario, iterations: int, concurrency: int):
+    # Requests are built up front so that timing only covers the application
+    requests = [scenario.build(i) for i in range(iterations)]
+
+    def send(request):
+        method, url, kwargs = request
+        start = perf_counter()
+        response = client.request(method, url, **kwargs)
+        return perf_counter() - start, response
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, requests))
+    elapsed = perf_counter() - start
+    if scenario.record is not None:
+        for request, (_, response) in zip(requests, results):
+            scenario.record(request, response)
+    return summarize([x[0] for x in results], [x[1].status_code for x in results], elapsed)
+
+
+def summarize(latencies: list, status_codes: list, elapsed: float):
+    cuts = quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    statuses = {}
+    for code in status_codes:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    return {
+        "requests": len(latencies),
+        "errors": len([x for x in status_codes if x >= 500]),
+        "status": statuses,
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": mean(latencies) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def compare_serializers(state: BenchmarkState, sizes: tuple, repetitions: int = 20):
+    # Roster bodies through FastAPI's default jsonable_encoder path and through each encoder encode_rows can use
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    import serialization
+    paths = {"default": lambda rows: JSONResponse(jsonable_encoder([dict(x.items()) for x in rows])).body}
+    for name in CODECS:
+        paths[name] = lambda rows, name=name: use_codec(name) and encode_rows(rows)
+    codec = serialization.codec
+    results = {}
+    try:
+        for size in sizes:
+            class_id = str(uuid4())
+            rows = [EnrollmentRecord(str(uuid4()), state.random.choice(state.students) if state.students else str(uuid4()), class_id, datetime.now().isoformat(" "), False, index >= size // 2) for index in range(size)]
+            results[str(size)] = {name: min(repeat(lambda: path(rows), number=1, repeat=repetitions)) * 1000 for name, path in paths.items()}
+    finally:
+        use_codec(codec)
+    return results
+
+
+def write_worker(database: str, mode: str, bodies: list, barrier, results):
+    # One worker process: enrollments on its own connection, or submitted to the shared write queue
+    from starlette.exceptions import HTTPException
+    from jobs import WriteQueue
+    from service import EnrollmentService
+    from model import Field
+    config = DatabaseConfig(database)
+    if mode == "queue":
+        queue = WriteQueue(config, WriteConfig())
+        enroll = lambda field: queue.call("enrollment", "enroll", field)
+    else:
+        conn = config.connect()
+        service = EnrollmentService(conn, "enrollment", "class", log)
+        enroll = service.enroll
+    latencies = []
+    status_codes = []
+    barrier.wait()
+    for body in bodies:
+        start = perf_counter()
+        try:
+            enroll(Field(**body))
+            status_codes.append(200)
+        except HTTPException as e:
+            status_codes.append(e.status_code)
+        latencies.append(perf_counter() - start)
+    results.put((latencies, status_codes))
+
+
+def compare_write_workers(config: DatabaseConfig, state: BenchmarkState, worker_counts: tuple, requests: int, directory: str, batch_size: int = 32):
+    # Enrollment throughput with every worker writing directly against one elected writer draining the queue,
+    # committing each job or group committing up to batch_size. Each run starts from a copy of the generated database.
+    from jobs import JobWriter
+    context = multiprocessing.get_context("spawn")
+    source = config.connect()
+    results = {}
+    try:
+        for mode, write_config in (("direct", None), ("queue", WriteConfig()), ("group", WriteConfig(batch_size=batch_size))):
+            results[mode] = {}
+            for workers in worker_counts:
+                database = path.join(directory, f"writes-{mode}-{workers}.db")
+                target = sqlite3.connect(database)
+                source.backup(target)
+                target.close()
+                writer = None if write_config is None else JobWriter(DatabaseConfig(database), write_config, log).start()
+                barrier = context.Barrier(workers + 1)
+                queue = context.Queue()
+                processes = [context.Process(target=write_worker, args=(database, "direct" if write_config is None else "queue", [state.enrollment_body(state.student(), state.popular_class()) for _ in range(requests)], barrier, queue)) for _ in range(workers)]
+                for process in processes:
+                    process.start()
+                barrier.wait()
+                start = perf_counter()
+                outcomes = [queue.get() for _ in processes]
+                elapsed = perf_counter() - start
+                for process in processes:
+                    process.join()
+                if writer is not None:
+                    writer.stop()
+                results[mode][str(workers)] = summarize([x for latencies, _ in outcomes for x in latencies], [x for _, codes in outcomes for x in codes], elapsed)
+    finally:
+        source.close()
+    return results
+
+
+def import_breakdown(output: str, top: int = 8):
+    # Self time of each -X importtime line summed by top-level package, so the shares add up to the whole import
+    totals = {}
+    for line in output.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(fields[0]) / 1000
+    ranked = sorted(totals.items(), key=lambda x: -x[1])
+    breakdown = dict(ranked[:top])
+    if len(ranked) > top:
+        breakdown["other"] = sum(x for _, x in ranked[top:])
+    return breakdown
+
+
+def measure_cold_start(repetitions: int = 3, top: int = 8):
+    # Each run starts a new interpreter against the database in the environment; the fastest run is kept per phase
+    directory = path.dirname(path.abspath(__file__))
+    env = environ | {"LOG_LEVEL": "WARNING"}
+    runs = []
+    for _ in range(repetitions):
+        start = perf_counter()
+        completed = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=directory, env=env, capture_output=True, text=True, check=True)
+        runs.append(json.loads(completed.stdout.splitlines()[-1]) | {"process_ms": (perf_counter() - start) * 1000})
+    result = {x: min(run[x] for run in runs) for x in ("import_ms", "startup_ms", "first_request_ms", "process_ms")}
+    result["total_ms"] = result["import_ms"] + result["startup_ms"] + result["first_request_ms"]
+    result["status"] = runs[-1]["status"]
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import controller"], cwd=directory, env=env, capture_output=True, text=True, check=True)
+    result["imports_ms"] = import_breakdown(completed.stderr, top)
+    return result
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float):
+    # A route regresses when its p95 latency grows by more than the tolerance over the baseline run
+    regressions = []
+    for route, result in current["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None or previous["p95_ms"] == 0:
+            continue
+        ratio = result["p95_ms"] / previous["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append({"route": route, "baseline_p95_ms": previous["p95_ms"], "p95_ms": result["p95_ms"], "ratio": ratio})
+    # Workers are started on demand, so a slower cold start counts as a regression too
+    previous = (baseline.get("cold_start") or {}).get("total_ms")
+    if current.get("cold_start") is not None and previous:
+        ratio = current["cold_start"]["total_ms"] / previous
+        if ratio > 1 + tolerance:
+            regressions.append({"route": "cold start", "baseline_ms": previous, "ms": current["cold_start"]["total_ms"], "ratio": ratio})
+    return regressions
+
+
+def print_report(results: dict, regressions: list):
+    columns = ("requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms")
+    width = max(len(x) for x in results["routes"])
+    print(f"{'route':<{width}}  " + "  ".join(f"{x:>10}" for x in columns))
+    for route, result in results["routes"].items():
+        values = [f"{result[x]:>10.2f}" if isinstance(result[x], float) else f"{result[x]:>10}" for x in columns]
+        print(f"{route:<{width}}  " + "  ".join(values))
+    if "serialization" in results:
+        names = list(next(iter(results["serialization"].values())).keys())
+        print()
+        print(f"{'roster rows':<{width}}  " + "  ".join(f"{x + '_ms':>10}" for x in names))
+        for size, timings in results["serialization"].items():
+            print(f"{size:<{width}}  " + "  ".join(f"{timings[x]:>10.3f}" for x in names))
+    if "writes" in results:
+        print()
+        print(f"{'enrollment writers':<{width}}  " + "  ".join(f"{x:>10}" for x in ("requests", "rps", "p95_ms", "conflicts")))
+        for mode, runs in results["writes"].items():
+            for workers, result in runs.items():
+                print(f"{mode + ' x' + workers:<{width}}  {result['requests']:>10}  {result['rps']:>10.2f}  {result['p95_ms']:>10.2f}  {result['status'].get('409', 0):>10}")
+    if results.get("cold_start") is not None:
+        cold_start = results["cold_start"]
+        print()
+        print(f"{'cold start':<{width}}  " + "  ".join(f"{x:>10}" for x in ("import_ms", "startup_ms", "first_ms", "total_ms", "process_ms")))
+        print(f"{'':<{width}}  " + "  ".join(f"{cold_start[x]:>10.2f}" for x in ("import_ms", "startup_ms", "first_request_ms", "total_ms", "process_ms")))
+        print()
+        print(f"{'import time by package':<{width}}  {'self_ms':>10}")
+        for package, milliseconds in cold_start["imports_ms"].items():
+            print(f"{package:<{width}}  {milliseconds:>10.2f}")
+    for regression in regressions:
+        if "p95_ms" in regression:
+            print(f"REGRESSION {regression['route']}: p95 {regression['baseline_p95_ms']:.2f}ms -> {regression['p95_ms']:.2f}ms ({regression['ratio']:.2f}x)")
+        else:
+            print(f"REGRESSION {regression['route']}: {regression['baseline_ms']:.2f}ms -> {regression['ms']:.2f}ms ({regression['ratio']:.2f}x)")
+
+
+def run_benchmark(arguments):
+    with TemporaryDirectory() as directory:
+        # The controller reads its database settings on import, so the environment is set first
+        environ["DATABASE_PATH"] = path.join(directory, "benchmark.db")
+        environ["API_MODE"] = arguments.mode
+        environ["JSON_ENCODER"] = arguments.json_encoder
+        config = DatabaseConfig.from_environment()
+        create_database(config)
+        state = BenchmarkState(arguments.seed)
+        conn = config.connect()
+        try:
+            generate_data(conn, state, arguments.students, arguments.classes, arguments.skew)
+        finally:
+            conn.close()
+
+        # Measured before this process imports the controller; the database is already migrated, as for a worker added under load
+        cold_start = measure_cold_start(arguments.cold_starts) if arguments.cold_starts > 0 else None
+
+        from fastapi.testclient import TestClient
+        import controller
+
+        routes = {}
+        with TestClient(controller.app) as client:
+            # The lifespan configures logging when the client starts the app
+            logging.getLogger().setLevel(arguments.log_level)
+            for scenario in scenarios(state, arguments.requests):
+                iterations = scenario.iterations or arguments.requests
+                routes[scenario.route] = run_scenario(client, scenario, iterations, arguments.concurrency)
+                log.info("%s: %s", scenario.route, routes[scenario.route])
+        serialization = compare_serializers(state, tuple(int(x) for x in arguments.roster_sizes.split(",")))
+        worker_counts = tuple(int(x) for x in arguments.write_workers.split(",") if x != "")
+        writes = compare_write_workers(config, state, worker_counts, arguments.requests, directory, arguments.write_batch_size) if len(worker_counts) != 0 else {}
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "mode": arguments.mode,
+            "json_encoder": controller.json_codec,
+            "students": arguments.students,
+            "classes": arguments.classes,
+            "requests": arguments.requests,
+            "concurrency": arguments.concurrency,
+            "skew": arguments.skew,
+            "seed": arguments.seed,
+        },
+        "routes": routes,
+        "serialization": serialization,
+        "writes": writes,
+        "cold_start": cold_start,
+    }
+
+
+def run():
+    parser = ArgumentParser(description="In-process load test of the registrar and enrollment endpoints")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--classes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of class demand")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--json-encoder", choices=("stdlib", "orjson"), default="stdlib")
+    parser.add_argument("--roster-sizes", default="50,500,5000", help="comma separated row counts for the serializer comparison")
+    parser.add_argument("--write-workers", default="1,2,4,8", help="comma separated process counts for the enrollment writer comparison, empty to skip")
+    parser.add_argument("--write-batch-size", type=int, default=32, help="jobs per commit for the group commit run of the writer comparison")
+    parser.add_argument("--cold-starts", type=int, default=3, help="fresh worker processes timed from import to first response, 0 to skip")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--log-level", default="WARNING")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=arguments.log_level)
+    results = run_benchmark(arguments)
+    regressions = []
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as file:
+            regressions = compare_results(results, json.load(file), arguments.tolerance)
+        results["regressions"] = regressions
+    if arguments.output is not None:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print_report(results, regressions)
+    sys.exit(1 if len(regressions) != 0 else 0)
+
+
+if __name__ == "__main__":
+    run()
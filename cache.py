@@ -0,0 +1,362 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+from serialization import dumps
+from constant import Cache, DatabaseColumn, HttpCache
+
+
+class ClassCache:
+
+    def __init__(self, max_size: int = Cache.MAX_CLASSES, ttl: float = Cache.CLASS_TTL, clock = monotonic):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._rows = OrderedDict()
+        self._keys = {}
+        # Bumped by every write so a read that started before it cannot put back an older row
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, class_id: str):
+        with self._lock:
+            return self._lookup(class_id)
+
+    def get_by_key(self, class_key: tuple):
+        with self._lock:
+            return self._lookup(self._keys.get(class_key))
+
+    def put(self, class_data: dict, generation: int = None):
+        # Reads pass the generation observed before querying; writes pass nothing and always win
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            expires = self._clock() + self._ttl
+            if generation is None:
+                self._generation += 1
+                # Updating a cached row keeps its expiry so columns written elsewhere are still reloaded
+                entry = self._rows.get(class_data[DatabaseColumn.ID])
+                expires = expires if entry is None else entry[0]
+            self._remove(class_data[DatabaseColumn.ID])
+            self._rows[class_data[DatabaseColumn.ID]] = (expires, dict(class_data))
+            self._keys[self._class_key(class_data)] = class_data[DatabaseColumn.ID]
+            while len(self._rows) > self._max_size:
+                self._remove(next(iter(self._rows)))
+                self._evictions += 1
+
+    def invalidate(self, class_id: str = None):
+        # Without an id only the generation moves on, so reads that started before a bulk write are not cached
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            if class_id is not None:
+                self._remove(class_id)
+
+    def reconcile(self, class_id: str, current_enrollment: int):
+        # Drops a cached row whose seat count was changed by a write this process did not cache. The generation
+        # moves on either way, so a read that started before the write cannot cache what it read.
+        with self._lock:
+            self._generation += 1
+            entry = self._rows.get(class_id)
+            if entry is not None and entry[1][DatabaseColumn.CURRENT_ENROLLMENT] != current_enrollment:
+                self._invalidations += 1
+                self._remove(class_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._rows.clear()
+            self._keys.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._rows),
+                "max_size": self._max_size,
+                "ttl": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": 0.0 if lookups == 0 else self._hits / lookups,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+    def _lookup(self, class_id: str):
+        entry = None if class_id is None else self._rows.get(class_id)
+        if entry is None or entry[0] <= self._clock():
+            if entry is not None:
+                self._remove(class_id)
+            self._misses += 1
+            return None
+        self._rows.move_to_end(class_id)
+        self._hits += 1
+        return dict(entry[1])
+
+    def _remove(self, class_id: str):
+        entry = self._rows.pop(class_id, None)
+        if entry is not None:
+            self._keys.pop(self._class_key(entry[1]), None)
+
+    def _class_key(self, class_data: dict):
+        return (class_data[DatabaseColumn.DEPARTMENT], class_data[DatabaseColumn.COURSE_CODE], class_data[DatabaseColumn.SECTION_NUMBER])
+
+
+class AvailableSnapshot(namedtuple("AvailableSnapshot", ("seq", "changed_on", "rows", "encoded", "body"))):
+    # Never changed once built; rows and encoded are keyed by class id in the order the classes are listed
+
+    def classes(self):
+        return list(self.rows.values())
+
+    def version(self):
+        # In the (table_name, version, modified_on) shape of a table version, or None before the first change
+        return None if self.changed_on is None else (HttpCache.AVAILABLE_CLASSES, self.seq, self.changed_on)
+
+
+class AvailableClasses:
+    # Open classes with seats remaining and waiting list depth as of a change log seq. Only rows that
+    # changed are encoded again, so a newer snapshot costs the changed rows plus one join of the encoded ones.
+
+    def __init__(self, max_delta: int = Cache.AVAILABLE_MAX_DELTA):
+        self.max_delta = max_delta
+        self._lock = Lock()
+        self._snapshot = None
+        self._full_loads = 0
+        self._delta_loads = 0
+
+    def get(self):
+        return self._snapshot
+
+    def replace(self, seq: int, changed_on: str, rows: list):
+        encoded = {x[DatabaseColumn.ID]: dumps(x) for x in rows}
+        with self._lock:
+            if self._snapshot is None or seq > self._snapshot.seq:
+                self._install(seq, changed_on, {x[DatabaseColumn.ID]: x for x in rows}, encoded)
+                self._full_loads += 1
+        return self._snapshot
+
+    def apply(self, seq: int, changed_on: str, class_ids: list, rows: list):
+        # rows are the changed classes that are still open; the other changed ones are dropped.
+        # A snapshot that is already as new is kept, since a concurrent refresh got there first.
+        loaded = {x[DatabaseColumn.ID]: x for x in rows}
+        encoded = {class_id: dumps(x) for class_id, x in loaded.items()}
+        with self._lock:
+            current = self._snapshot
+            if current is not None and seq > current.seq:
+                # Assigning keeps a class in its place; new ones go to the end as they would in rowid order
+                current_rows = dict(current.rows)
+                current_encoded = dict(current.encoded)
+                for class_id in class_ids:
+                    if class_id not in loaded:
+                        current_rows.pop(class_id, None)
+                        current_encoded.pop(class_id, None)
+                current_rows.update(loaded)
+                current_encoded.update(encoded)
+                self._install(seq, changed_on, current_rows, current_encoded)
+                self._delta_loads += 1
+        return self._snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._full_loads = 0
+            self._delta_loads = 0
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "seq": None if snapshot is None else snapshot.seq,
+            "size": 0 if snapshot is None else len(snapshot.rows),
+            "bytes": 0 if snapshot is None else len(snapshot.body),
+            "full_loads": self._full_loads,
+            "delta_loads": self._delta_loads,
+        }
+
+    def _install(self, seq: int, changed_on: str, rows: dict, encoded: dict):
+        self._snapshot = AvailableSnapshot(seq, changed_on, rows, encoded, b"[" + b",".join(encoded.values()) + b"]")
+
+
+class WaitingList:
+
+    def __init__(self, enrollments: list = ()):
+        # Entries are (enrolled_on, id) keys in the order the waiting list window query numbers them
+        self._entries = []
+        self._students = {}
+        for enrollment_data in enrollments:
+            self.add(enrollment_data)
+
+    def position(self, student_id: str):
+        keys = self._students.get(student_id)
+        return None if keys is None else bisect_left(self._entries, keys[0]) + 1
+
+    def positions(self):
+        return {student_id: bisect_left(self._entries, keys[0]) + 1 for student_id, keys in self._students.items()}
+
+    def add(self, enrollment_data: dict):
+        key = self._key(enrollment_data)
+        index = bisect_left(self._entries, key)
+        if index < len(self._entries) and self._entries[index] == key:
+            return
+        self._entries.insert(index, key)
+        insort(self._students.setdefault(enrollment_data[DatabaseColumn.STUDENT_ID], []), key)
+
+    def remove(self, enrollment_data: dict):
+        key = self._key(enrollment_data)
+        index = bisect_left(self._entries, key)
+        if index == len(self._entries) or self._entries[index] != key:
+            return
+        del self._entries[index]
+        keys = self._students[enrollment_data[DatabaseColumn.STUDENT_ID]]
+        keys.remove(key)
+        if len(keys) == 0:
+            del self._students[enrollment_data[DatabaseColumn.STUDENT_ID]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, enrollment_data: dict):
+        # New rows hold a datetime while stored rows hold the text SQLite compares
+        return (str(enrollment_data[DatabaseColumn.ENROLLED_ON]), enrollment_data[DatabaseColumn.ID])
+
+
+class WaitingListIndex:
+
+    def __init__(self, max_size: int = Cache.MAX_WAITING_LISTS, ttl: float = Cache.WAITING_LIST_TTL, clock = monotonic):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._lists = OrderedDict()
+        # Stamp of each class's last write, so a load only loses to writes on the same class. The least recently
+        # written are forgotten past max_size; the floor then stands in for them, failing loads that started before.
+        self._versions = OrderedDict()
+        self._stamp = 0
+        self._floor = 0
+        self._epoch = 0
+        # Change log seq up to which writes of other processes have been applied
+        self._seq = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def version(self, class_id: str):
+        with self._lock:
+            return (self._epoch, self._versions.get(class_id, self._floor))
+
+    def position(self, class_id: str, student_id: str):
+        # None means the class is not indexed, 0 that the student is not on its waiting list
+        with self._lock:
+            entry = self._lists.get(class_id)
+            if entry is None or entry[0] <= self._clock():
+                self._lists.pop(class_id, None)
+                self._misses += 1
+                return None
+            self._lists.move_to_end(class_id)
+            self._hits += 1
+            return entry[1].position(student_id) or 0
+
+    def put(self, class_id: str, waiting_list: WaitingList, version: tuple):
+        with self._lock:
+            if version != (self._epoch, self._versions.get(class_id, self._floor)):
+                return
+            self._lists.pop(class_id, None)
+            self._lists[class_id] = (self._clock() + self._ttl, waiting_list)
+            while len(self._lists) > self._max_size:
+                self._lists.popitem(last=False)
+
+    def add(self, class_id: str, enrollment_data: dict):
+        self._update(class_id, lambda x: x.add(enrollment_data))
+
+    def remove(self, class_id: str, enrollment_data: dict):
+        self._update(class_id, lambda x: x.remove(enrollment_data))
+
+    def invalidate(self, class_id: str = None):
+        with self._lock:
+            if class_id is None:
+                self._epoch += 1
+                self._lists.clear()
+            else:
+                self._bump(class_id)
+                self._lists.pop(class_id, None)
+
+    def forget(self, class_id: str):
+        # For a deleted class, whose list and version are not needed again
+        with self._lock:
+            self._lists.pop(class_id, None)
+            self._floor = max(self._floor, self._versions.pop(class_id, 0))
+
+    def advance(self, seq: int, class_ids: list = None):
+        # Drops the lists of the classes changed up to seq, by this process or another. None drops them all,
+        # for changes pruned from the log before they were read or a database older than the index.
+        with self._lock:
+            if seq == self._seq:
+                return
+            if class_ids is None:
+                self._epoch += 1
+                self._lists.clear()
+            else:
+                for class_id in class_ids:
+                    self._bump(class_id)
+                    self._lists.pop(class_id, None)
+            self._seq = seq
+
+    def snapshot(self):
+        with self._lock:
+            return {class_id: entry[1].positions() for class_id, entry in self._lists.items()}
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._lists.clear()
+            self._floor = self._stamp
+            self._versions.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._lists),
+                "max_size": self._max_size,
+                "ttl": self._ttl,
+                "entries": sum(len(x[1]) for x in self._lists.values()),
+                "versions": len(self._versions),
+                "seq": self._seq,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def _update(self, class_id: str, change):
+        # Changes are applied after commit; a load that raced with the commit already has them, so both are idempotent
+        with self._lock:
+            self._bump(class_id)
+            entry = self._lists.get(class_id)
+            if entry is not None:
+                change(entry[1])
+
+    def _bump(self, class_id: str):
+        self._stamp += 1
+        self._versions.pop(class_id, None)
+        self._versions[class_id] = self._stamp
+        while len(self._versions) > self._max_size:
+            self._floor = self._versions.popitem(last=False)[1]
+
+
+class_cache = ClassCache()
+available_snapshot = AvailableClasses()
+waiting_list_index = WaitingListIndex()
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, status
+from fastapi.responses import Response
+from constant import HttpCache
+
+
+def validators(table_version: tuple):
+    # Weak tags: bodies rendered by another JSON encoder are equivalent but not byte for byte equal
+    if table_version is None:
+        return {}
+    table_name, version, modified_on = table_version
+    modified_on = datetime.fromisoformat(modified_on).replace(tzinfo=timezone.utc)
+    return {
+        "ETag": f'W/"{table_name}-{version}"',
+        "Last-Modified": format_datetime(modified_on, usegmt=True),
+        "Cache-Control": HttpCache.CACHE_CONTROL,
+    }
+
+
+def not_modified(request: Request, headers: dict):
+    # Returns the 304 to send instead of the body, or None when the client's copy is missing or stale
+    if len(headers) == 0:
+        return None
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-Modified-Since only has one second resolution, so it is ignored whenever a tag was sent
+        tags = [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+        matched = "*" in tags or headers["ETag"].removeprefix("W/") in tags
+    else:
+        matched = _not_modified_since(request.headers.get("if-modified-since"), headers["Last-Modified"])
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers) if matched else None
+
+
+def _not_modified_since(if_modified_since: str, last_modified: str):
+    if if_modified_since is None:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,137 @@
+from sqlite3 import Connection, Row, connect
+from os import environ, path
+from urllib.request import pathname2url
+
+
+class DatabaseConfig:
+
+    def __init__(self,
+                 database: str = "database.db",
+                 journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL",
+                 cache_size: int = -20000,
+                 mmap_size: int = 268435456,
+                 temp_store: str = "MEMORY",
+                 busy_timeout: int = 5000,
+                 max_readers: int = 8,
+                 pool_timeout: float = 5.0,
+                 cached_statements: int = 256):
+        self.database = database
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.temp_store = temp_store
+        self.busy_timeout = busy_timeout
+        self.max_readers = max_readers
+        self.pool_timeout = pool_timeout
+        self.cached_statements = cached_statements
+
+    @classmethod
+    def from_environment(cls):
+        default = cls()
+        return cls(
+            database=environ.get("DATABASE_PATH", default.database),
+            journal_mode=environ.get("DATABASE_JOURNAL_MODE", default.journal_mode),
+            synchronous=environ.get("DATABASE_SYNCHRONOUS", default.synchronous),
+            cache_size=int(environ.get("DATABASE_CACHE_SIZE", default.cache_size)),
+            mmap_size=int(environ.get("DATABASE_MMAP_SIZE", default.mmap_size)),
+            temp_store=environ.get("DATABASE_TEMP_STORE", default.temp_store),
+            busy_timeout=int(environ.get("DATABASE_BUSY_TIMEOUT", default.busy_timeout)),
+            max_readers=int(environ.get("DATABASE_MAX_READERS", default.max_readers)),
+            pool_timeout=float(environ.get("DATABASE_POOL_TIMEOUT", default.pool_timeout)),
+            cached_statements=int(environ.get("DATABASE_CACHED_STATEMENTS", default.cached_statements)),
+        )
+
+    def connect(self, **kwargs):
+        conn = connect(self.database, cached_statements=self.cached_statements, **kwargs)
+        self.apply_pragmas(conn)
+        conn.row_factory = Row
+        return conn
+
+    def connect_read_only(self, **kwargs):
+        # mode=ro refuses writes at the SQLite level, for tools that must never take the write lock
+        conn = connect(f"file:{pathname2url(path.abspath(self.database))}?mode=ro", uri=True, cached_statements=self.cached_statements, **kwargs)
+        self.apply_pragmas(conn)
+        conn.row_factory = Row
+        return conn
+
+    def apply_pragmas(self, conn: Connection):
+        for statement in self.pragma_statements():
+            conn.execute(statement)
+
+    def pragma_statements(self):
+        # journal_mode is persisted in the database file and set by the migration runner
+        return [
+            "PRAGMA foreign_keys = ON",
+            f"PRAGMA busy_timeout = {int(self.busy_timeout)}",
+            f"PRAGMA synchronous = {self.synchronous}",
+            f"PRAGMA cache_size = {int(self.cache_size)}",
+            f"PRAGMA mmap_size = {int(self.mmap_size)}",
+            f"PRAGMA temp_store = {self.temp_store}",
+        ]
+
+    def settings(self):
+        return dict(vars(self))
+
+
+class WriteConfig:
+
+    def __init__(self,
+                 mode: str = "direct",
+                 poll_interval: float = 0.005,
+                 timeout: float = 30.0,
+                 lease: float = 5.0,
+                 retention: float = 3600.0,
+                 batch_size: int = 1,
+                 batch_window: float = 0.002):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.lease = lease
+        self.retention = retention
+        # Above 1 the writer commits up to batch_size jobs at once, waiting at most batch_window for them
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+
+    @classmethod
+    def from_environment(cls):
+        default = cls()
+        return cls(
+            mode=environ.get("WRITE_MODE", default.mode),
+            poll_interval=float(environ.get("WRITE_POLL_INTERVAL", default.poll_interval)),
+            timeout=float(environ.get("WRITE_TIMEOUT", default.timeout)),
+            lease=float(environ.get("WRITE_LEASE", default.lease)),
+            retention=float(environ.get("WRITE_JOB_RETENTION", default.retention)),
+            batch_size=int(environ.get("WRITE_BATCH_SIZE", default.batch_size)),
+            batch_window=float(environ.get("WRITE_BATCH_WINDOW", default.batch_window)),
+        )
+
+    def settings(self):
+        return dict(vars(self))
+
+
+class LoggingConfig:
+
+    def __init__(self,
+                 level: str = "INFO",
+                 format: str = "text",
+                 query_sample_rate: float = 0.01,
+                 queue_size: int = 10000):
+        self.level = level.upper()
+        self.format = format
+        self.query_sample_rate = query_sample_rate
+        self.queue_size = queue_size
+
+    @classmethod
+    def from_environment(cls):
+        default = cls()
+        return cls(
+            level=environ.get("LOG_LEVEL", default.level),
+            format=environ.get("LOG_FORMAT", default.format),
+            query_sample_rate=float(environ.get("LOG_QUERY_SAMPLE_RATE", default.query_sample_rate)),
+            queue_size=int(environ.get("LOG_QUEUE_SIZE", default.queue_size)),
+        )
+
+    def settings(self):
+        return dict(vars(self))
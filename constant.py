@@ -15,6 +15,9 @@ class DatabaseColumn:
     WAITING_LIST = "waiting_list"
     CLASS_ID = "class_id"
 
+    SEATS_REMAINING = "seats_remaining"
+    WAITING_LIST_DEPTH = "waiting_list_depth"
+
     AND = "AND"
     OR = "OR"
 
@@ -28,6 +31,114 @@ class Message:
     STUDENT_DELETE_SUCCESSFULLY = "Student delete successfully"
     INSTRUCTOR_DELETE_SUCCESSFULLY = "Instructor delete successfully"
     CLASS_INSTRUCTOR_UPDATED_SUCCESSFULLY = "Class instructor updated successfully"
+    ENROLLMENT_CONFLICT = "Class is busy, please retry"
+    STUDENT_DOES_NOT_EXISTS = "Student does not exists"
+    ENROLLMENT_FROZEN = "Enrollment has been frozen"
+    WAITING_LIST_FULL = "Waiting list is full"
+    WAITING_LIST_LIMIT = "Student cannot be in more than 3 waiting list"
+    INVALID_CURSOR = "Invalid pagination cursor"
+    IDEMPOTENCY_KEY_TOO_LONG = "Idempotency-Key is too long"
+    IDEMPOTENCY_KEY_REUSED = "Idempotency-Key was already used for a different request"
+    IDEMPOTENCY_IN_PROGRESS = "A request with this Idempotency-Key is still in progress, please retry"
+    IDEMPOTENCY_BODY_TOO_LARGE = "Idempotency-Key is not supported for request bodies this large"
+    WRITE_TIMEOUT = "Write is still queued"
+    WRITE_RESULT_LOST = "Write was applied but its result was lost when the writer stopped"
+    WRITE_NOT_FOUND = "Write ticket not found"
+    IMPORT_WRITES_QUEUED = "Imports are not available while writes are queued, run them with WRITE_MODE=direct"
+
+class Concurrency:
+    MAX_RETRIES = 5
+
+class Batch:
+    MAX_VARIABLES = 30000
+    FETCH_SIZE = 1000
+    IMPORT_CHUNK_SIZE = 5000
+    IMPORT_COMMIT_SIZE = 50000
+    IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+    MAX_REPORTED_REJECTIONS = 1000
+    MAX_REPORTED_DUPLICATES = 20
+    EXPORT_BUFFER_SIZE = 64 * 1024
+
+class Pagination:
+    MAX_LIMIT = 1000
+    NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+class Instrumentation:
+    SLOW_QUERY_MS = 100.0
+    REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+    ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+    BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class Events:
+    ENROLLED = "enrolled"
+    WAITING_LIST = "waitingList"
+    DROPPED = "dropped"
+    PROMOTED = "promoted"
+    CLASS_DELETED = "classDeleted"
+    MAX_QUEUE = 256
+    HEARTBEAT = 15.0
+    # How often a worker looks for changes another worker made; its own writes wake it right away
+    POLL_INTERVAL = 0.1
+
+class Cache:
+    MAX_STATEMENTS = 512
+    MAX_CACHED_KEYS = 64
+    MAX_CLASSES = 4096
+    CLASS_TTL = 30.0
+    MAX_WAITING_LISTS = 1024
+    WAITING_LIST_TTL = 30.0
+    # Above this many changed classes the available class snapshot is reloaded instead of patched
+    AVAILABLE_MAX_DELTA = 256
+
+class HttpCache:
+    VERSION_TABLE = "table_version"
+    VERSIONED_TABLES = ("student", "instructor", "class", "enrollment")
+    AVAILABLE_CLASSES = "available_classes"
+    # Clients may keep the body but have to revalidate it with If-None-Match before using it
+    CACHE_CONTROL = "no-cache"
+
+class Idempotency:
+    TABLE = "idempotency_key"
+    HEADER = "Idempotency-Key"
+    REPLAYED_HEADER = "Idempotent-Replayed"
+    METHODS = ("POST", "PUT", "PATCH", "DELETE")
+    MAX_KEY_LENGTH = 255
+    MAX_BODY = 1024 * 1024
+    # Retrying these is expected to give a different answer, so they are not kept
+    RETRYABLE_STATUSES = (408, 409, 425, 429)
+    TTL = 24 * 60 * 60.0
+    LEASE = 30.0
+    WAIT_TIMEOUT = 10.0
+    POLL_INTERVAL = 0.05
+    MAX_KEYS = 100000
+    PURGE_INTERVAL = 1000
+
+class ChangeLog:
+    TABLE = "change_log"
+    # The class a change belongs to, so the monitor only refreshes the classes it saw change
+    CLASS_COLUMNS = {"class": "id", "enrollment": "class_id", "student": None, "instructor": None}
+    RETENTION = 100000
+    PRUNE_EVERY = 1000
+    INTERVAL = 1.0
+    TOP_CLASSES = 10
+
+class WriteJob:
+    TABLE = "write_job"
+    LEASE_TABLE = "write_lease"
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    FETCH_SIZE = 100
+    MAX_POLL_INTERVAL = 0.05
+    CLEANUP_EVERY = 1000
+    SAVEPOINT = "write_job"
+
+class EnrollmentStatus:
+    ENROLLED = "enrolled"
+    WAITING_LIST = "waitingList"
+    REJECTED = "rejected"
 
 class Query:
     STUDENT_COUNT = "SELECT COUNT(*) FROM student"
@@ -1,131 +1,294 @@
-from util import Field, prepare_response_dict
-from sqlite3 import connect, Row
+from model import Field
+from util import prepare_response_dict
 from service import ClassService, EnrollmentService, ProfileService
+from pool import ConnectionPool, PoolExhaustedError
+from repository import CLASS_KEY_COLUMNS, ENROLLMENT_ORDER, statement_cache
+from conditional import not_modified, validators
+from pagination import FastJSONResponse, decode_cursor, lookahead_limit, page_response
+from instrumentation import Metrics, instrument
+from cache import available_snapshot, class_cache, waiting_list_index
+from events import ChangeDispatcher, event_bus, serve_events
+from transfer import EXPORT_TABLES, IMPORT_TABLES, MEDIA_TYPES, export_rows, import_spooled, spool_request, validate_transfer
+from config import DatabaseConfig, LoggingConfig, WriteConfig
+from jobs import JobWriter, QueuedService, WriteQueue
+from logs import RequestIdMiddleware, configure_logging
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from serialization import use_codec
+from schema import create_database
 import logging
-from fastapi import FastAPI
-from constant import Message, DatabaseColumn
+from contextlib import asynccontextmanager
+from os import environ
+from time import perf_counter
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from constant import Instrumentation, Message, DatabaseColumn, Pagination
 
 log = logging.getLogger()
-logging.basicConfig(level=logging.DEBUG)
 
-conn = connect("database.db", check_same_thread=False)
-conn.execute("PRAGMA foreign_keys = ON")
-conn.row_factory = Row
+# Nothing here opens the database; the pools and stores connect on first use and the lifespan does the rest
+config = DatabaseConfig.from_environment()
+pool = ConnectionPool(config)
+idempotency_store = IdempotencyStore(config)
+change_dispatcher = ChangeDispatcher(config, event_bus)
+metrics = Metrics(float(environ.get("SLOW_QUERY_MS", Instrumentation.SLOW_QUERY_MS)) / 1000)
+startup = {}
 
-class_service = ClassService(conn, "class", "instructor", log)
-enrollment_service = EnrollmentService(conn, "enrollment", "class", log)
-student_profile_service = ProfileService(conn, "student", log)
-instructor_profile_service = ProfileService(conn, "instructor", log)
+# WRITE_MODE=queue sends profile, class and enrollment writes to a single writer elected among all workers
+write_config = WriteConfig.from_environment()
+write_queue = None
+job_writer = None
+if write_config.mode == "queue":
+    write_queue = WriteQueue(config, write_config)
+    job_writer = JobWriter(config, write_config, log, metrics=metrics)
 
-app = FastAPI()
+def service_dependency(factory, writable: bool):
+    def dependency():
+        with (pool.writer() if writable else pool.reader()) as conn:
+            yield factory(conn)
+    return dependency
 
-@app.post("/registrar/student")
-def add_student(field: Field):
+def write_dependency(service: str, factory):
+    if write_queue is None:
+        return service_dependency(factory, True)
+    return lambda: QueuedService(write_queue, service)
+
+class_reader = service_dependency(lambda conn: ClassService(conn, "class", "instructor", log), False)
+class_writer = write_dependency("class", lambda conn: ClassService(conn, "class", "instructor", log))
+enrollment_reader = service_dependency(lambda conn: EnrollmentService(conn, "enrollment", "class", log), False)
+enrollment_writer = write_dependency("enrollment", lambda conn: EnrollmentService(conn, "enrollment", "class", log))
+student_reader = service_dependency(lambda conn: ProfileService(conn, "student", log), False)
+student_writer = write_dependency("student", lambda conn: ProfileService(conn, "student", log))
+instructor_reader = service_dependency(lambda conn: ProfileService(conn, "instructor", log), False)
+instructor_writer = write_dependency("instructor", lambda conn: ProfileService(conn, "instructor", log))
+
+router = APIRouter()
+
+@router.post("/registrar/student")
+def add_student(field: Field, student_service: ProfileService = Depends(student_writer)):
     log.info("Adding new student. Student name: %s %s", field.firstName, field.lastName)
-    response_dict = student_profile_service.add_profile(field)
+    response_dict = student_service.add_profile(field)
     log.info("Student added successfully. Student ID: %s", response_dict[DatabaseColumn.ID])
     return prepare_response_dict(response_dict)
 
-@app.put("/registrar/student")
-def update_student(field: Field):
+@router.put("/registrar/student")
+def update_student(field: Field, student_service: ProfileService = Depends(student_writer)):
     log.info("Updating student. Student ID: %s", field.id)
-    response = prepare_response_dict(student_profile_service.update_profile(field))
+    response = prepare_response_dict(student_service.update_profile(field))
     log.info("Student updated sucessfully")
     return response
 
-@app.get("/registrar/student/{id}")
-def get_student(id: str):
+@router.get("/registrar/student/{id}")
+def get_student(id: str, request: Request, response: Response, student_service: ProfileService = Depends(student_reader)):
     log.info("Searching student. Student ID: %s", id)
-    return prepare_response_dict(student_profile_service.get_profile(id))
+    headers = validators(student_service.table_version())
+    cached = not_modified(request, headers)
+    if cached is not None:
+        return cached
+    response_dict = prepare_response_dict(student_service.get_profile(id))
+    response.headers.update(headers)
+    return response_dict
 
-@app.delete("/registrar/student/{id}")
-def delete_student(id: str):
+@router.delete("/registrar/student/{id}")
+def delete_student(id: str, student_service: ProfileService = Depends(student_writer)):
     log.info("Deleting student. Student ID: %s", id)
-    student_profile_service.delete_profile(id)
+    student_service.delete_profile(id)
     log.info(Message.STUDENT_DELETE_SUCCESSFULLY)
     return {"msg": Message.STUDENT_DELETE_SUCCESSFULLY}
 
-@app.post("/registrar/instructor")
-def add_student(field: Field):
+@router.post("/registrar/instructor")
+def add_student(field: Field, instructor_service: ProfileService = Depends(instructor_writer)):
     log.info("Adding new instructor. Instructor name: %s %s", field.firstName, field.lastName)
-    response_dict = instructor_profile_service.add_profile(field)
+    response_dict = instructor_service.add_profile(field)
     log.info("Instructor added successfully. Instructor ID: %s", response_dict[DatabaseColumn.ID])
     return prepare_response_dict(response_dict)
 
-@app.put("/registrar/instructor")
-def update_student(field: Field):
+@router.put("/registrar/instructor")
+def update_student(field: Field, instructor_service: ProfileService = Depends(instructor_writer)):
     log.info("Updating instructor. Instructor ID: %s", field.id)
-    response = prepare_response_dict(instructor_profile_service.update_profile(field))
+    response = prepare_response_dict(instructor_service.update_profile(field))
     log.info("Instructor updated successfully")
     return response
 
-@app.get("/registrar/instructor/{id}")
-def get_instructor(id: str):
+@router.get("/registrar/instructor/{id}")
+def get_instructor(id: str, request: Request, response: Response, instructor_service: ProfileService = Depends(instructor_reader)):
     log.info("Searching instructor. Instructor ID: %s", id)
-    return prepare_response_dict(instructor_profile_service.get_profile(id))
+    headers = validators(instructor_service.table_version())
+    cached = not_modified(request, headers)
+    if cached is not None:
+        return cached
+    response_dict = prepare_response_dict(instructor_service.get_profile(id))
+    response.headers.update(headers)
+    return response_dict
 
-@app.delete("/registrar/instructor/{id}")
-def delete_student(id: str):
+@router.delete("/registrar/instructor/{id}")
+def delete_student(id: str, instructor_service: ProfileService = Depends(instructor_writer)):
     log.info("Deleting instructor. Instructor ID: %s", id)
-    instructor_profile_service.delete_profile(id)
+    instructor_service.delete_profile(id)
     log.info(Message.INSTRUCTOR_DELETE_SUCCESSFULLY)
     return {"msg": "Instructor deleted successfully"}
 
-@app.post("/registrar/class")
-def add_class(field: Field):
+@router.post("/registrar/class")
+def add_class(field: Field, class_service: ClassService = Depends(class_writer)):
     log.info("Adding new class")
     response_dict = class_service.add_class(field)
     log.info("Class added successfully. Class ID: %s", response_dict[DatabaseColumn.ID])
     return prepare_response_dict(response_dict)
 
-@app.delete("/registrar/class/{id}")
-def delete_class(id: str):
+@router.delete("/registrar/class/{id}")
+def delete_class(id: str, class_service: ClassService = Depends(class_writer)):
     log.info("Deleting class. Class ID: %s", id)
     class_service.delete_class(id)
     log.info("Class delete sucessfully")
     return {"msg": "Class deleted successfully"}
 
-@app.put("/registrar/class/{id}/{instructor_id}")
-def update_instructor(id: str, instructor_id: str):
+@router.put("/registrar/class/{id}/{instructor_id}")
+def update_instructor(id: str, instructor_id: str, class_service: ClassService = Depends(class_writer)):
     log.info("Updating class instructor. Class Id: %s. Instructor ID: %s", id, instructor_id)
     class_service.update_instructor(id, instructor_id)
     log.info(Message.CLASS_INSTRUCTOR_UPDATED_SUCCESSFULLY)
     return {"msg": Message.CLASS_INSTRUCTOR_UPDATED_SUCCESSFULLY}
 
 
-@app.get("/student/class")
-def available_classes():
-    return class_service.available_classes()
+@router.post("/registrar/import/{table_name}")
+async def import_table(table_name: str, request: Request, format: str = "csv"):
+    validate_transfer(table_name, format, IMPORT_TABLES)
+    if write_queue is not None:
+        # An import commits large chunks of its own and would contend with the elected writer for the write lock
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.IMPORT_WRITES_QUEUED)
+    log.info("Importing %s from %s", table_name, format)
+    body = await spool_request(request)
+
+    def run_import():
+        with pool.writer() as conn:
+            return import_spooled(conn, table_name, format, body, log)
+    return await run_in_threadpool(run_import)
+
+@router.get("/registrar/export/{table_name}")
+def export_table(table_name: str, format: str = "csv"):
+    validate_transfer(table_name, format, EXPORT_TABLES)
+    log.info("Exporting %s as %s", table_name, format)
 
-@app.post("/student/class")
-def enroll(field: Field):
+    def stream():
+        with pool.reader() as conn:
+            yield from export_rows(conn, table_name, format, log)
+    return StreamingResponse(stream(), media_type=MEDIA_TYPES[format])
+
+
+@router.get("/student/class")
+def available_classes(request: Request, department: str = None, courseCode: str = None, frozen: bool = None, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), class_service: ClassService = Depends(class_reader)):
+    if department is None and courseCode is None and frozen is None and after is None and limit is None:
+        # Tagged with the change log seq of the snapshot, which also moves when only a waiting list changed
+        snapshot = class_service.available_classes()
+        headers = validators(snapshot.version())
+        cached = not_modified(request, headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers) if cached is None else cached
+    # Read before the rows, so a write landing in between makes the tag older than the body, never newer
+    headers = validators(class_service.table_version())
+    cached = not_modified(request, headers)
+    if cached is not None:
+        return cached
+    rows = class_service.iter_available_classes(department, courseCode, frozen, decode_cursor(after, CLASS_KEY_COLUMNS), lookahead_limit(limit))
+    return page_response(rows, limit, CLASS_KEY_COLUMNS, headers)
+
+@router.post("/student/class")
+def enroll(field: Field, enrollment_service: EnrollmentService = Depends(enrollment_writer)):
     enrollment_service.enroll(field)
     return {"msg": "Enrolled successfully"}
 
-@app.delete("/student/class")
-def drop_enrollment(field: Field):
+@router.post("/student/class/bulk")
+def bulk_enroll(fields: list[Field], enrollment_service: EnrollmentService = Depends(enrollment_writer)):
+    log.info("Bulk enrolling %s students", len(fields))
+    return enrollment_service.bulk_enroll(fields)
+
+@router.delete("/student/class")
+def drop_enrollment(field: Field, enrollment_service: EnrollmentService = Depends(enrollment_writer)):
     enrollment_service.drop_enrollment(field)
     return {"msg": "Enrollment dropped successfully"}
 
-@app.get("/student/class/waitinglist")
-def waitinglist_position(field: Field):
+@router.get("/student/class/waitinglist")
+def waitinglist_position(field: Field, enrollment_service: EnrollmentService = Depends(enrollment_reader)):
     position = enrollment_service.waiting_list_position(field)
     return {"msg": f"Current position in waiting list: {position}"}
 
 
-@app.get("/instructor/waitinglist")
-def waiting_list(field: Field):
-    return enrollment_service.class_enrollment(field, True)
+@router.get("/instructor/waitinglist")
+def waiting_list(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), enrollment_service: EnrollmentService = Depends(enrollment_reader)):
+    rows = enrollment_service.iter_class_enrollment(field, True, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return page_response(rows, limit, ENROLLMENT_ORDER)
 
-@app.get("/instructor/class")
-def current_enrollment(field: Field):
-    return enrollment_service.class_enrollment(field, False) 
+@router.get("/instructor/class")
+def current_enrollment(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), enrollment_service: EnrollmentService = Depends(enrollment_reader)):
+    rows = enrollment_service.iter_class_enrollment(field, False, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return page_response(rows, limit, ENROLLMENT_ORDER)
 
-@app.get("/instructor/class/dropped")
-def dropped_student(field: Field):
-    return enrollment_service.dropped_student(field)
+@router.get("/instructor/class/dropped")
+def dropped_student(field: Field, after: str = None, limit: int = Query(None, ge=1, le=Pagination.MAX_LIMIT), enrollment_service: EnrollmentService = Depends(enrollment_reader)):
+    rows = enrollment_service.iter_dropped_student(field, decode_cursor(after, ENROLLMENT_ORDER), lookahead_limit(limit))
+    return page_response(rows, limit, ENROLLMENT_ORDER)
 
-@app.delete("/instructor/class")
-def drop_student(field: Field):
+@router.delete("/instructor/class")
+def drop_student(field: Field, enrollment_service: EnrollmentService = Depends(enrollment_writer)):
     enrollment_service.drop_enrollment(field)
-    return {"msg": "Student dropped successfully"}
\ No newline at end of file
+    return {"msg": "Student dropped successfully"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker before it takes requests, so migrations are not a side effect of importing the app
+    started = perf_counter()
+    log_listener = configure_logging(LoggingConfig.from_environment())
+    await run_in_threadpool(create_database, config)
+    change_dispatcher.start()
+    if job_writer is not None:
+        job_writer.start()
+    startup["seconds"] = perf_counter() - started
+    log.info("Worker started in %.1f ms", startup["seconds"] * 1000)
+    try:
+        yield
+    finally:
+        if job_writer is not None:
+            job_writer.stop()
+        change_dispatcher.stop()
+        if write_queue is not None:
+            write_queue.close()
+        if api_write_queue is not None and api_write_queue is not write_queue:
+            api_write_queue.close()
+        idempotency_store.close()
+        pool.close()
+        if api_pool is not pool:
+            await api_pool.close()
+        log_listener.stop()
+
+# JSON_ENCODER=orjson opts into the faster encoder for list bodies and the default response class
+json_codec = use_codec(environ.get("JSON_ENCODER", "stdlib"))
+app = FastAPI(default_response_class=JSONResponse if json_codec == "stdlib" else FastJSONResponse, lifespan=lifespan)
+instrument(app, metrics)
+# Added before RequestIdMiddleware so that replayed responses still carry their own request id
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+app.add_middleware(RequestIdMiddleware)
+serve_events(app, event_bus)
+
+if environ.get("API_MODE", "sync") == "async":
+    from async_controller import router as api_router, pool as api_pool, write_queue as api_write_queue
+else:
+    api_router, api_pool, api_write_queue = router, pool, write_queue
+
+app.include_router(api_router)
+
+@app.exception_handler(PoolExhaustedError)
+def pool_exhausted(request: Request, exc: PoolExhaustedError):
+    log.error("Connection pool exhausted: %s", exc)
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)})
+
+@app.get("/writes/{ticket}")
+def write_status(ticket: int):
+    job = None if api_write_queue is None else api_write_queue.status(ticket)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=Message.WRITE_NOT_FOUND)
+    return {"ticket": ticket, "status": job[0], "statusCode": job[1], "result": job[2]}
+
+@app.get("/stats")
+def stats():
+    writes = {"mode": write_config.mode} | ({} if api_write_queue is None else api_write_queue.stats() | {"writer": job_writer.stats()})
+    return {"database": config.settings(), "pool": api_pool.stats(), "statements": statement_cache.stats(), "class_cache": class_cache.stats(), "available_classes": available_snapshot.stats(), "waiting_lists": waiting_list_index.stats(), "events": event_bus.stats() | change_dispatcher.stats(), "idempotency": idempotency_store.stats(), "writes": writes, "startup": startup}
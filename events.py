@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
+from cache import class_cache
+from config import DatabaseConfig
+from constant import Batch, ChangeLog, DatabaseColumn, Events
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI, WebSocket
+
+log = logging.getLogger("events")
+
+# Set after a local commit, so this worker's dispatcher does not wait for its next poll
+committed = Event()
+
+
+class Subscription:
+
+    def __init__(self, bus, filters: dict, max_queue: int):
+        self.filters = filters
+        self.overflowed = False
+        self._bus = bus
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(max_queue)
+
+    def matches(self, event: dict):
+        return all(event.get(key) == value for key, value in self.filters.items())
+
+    def deliver(self, event: dict):
+        # Runs on the subscriber's event loop; a consumer that cannot keep up is ended instead of blocking publishers
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def send(self, event: dict):
+        self._loop.call_soon_threadsafe(self.deliver, event)
+
+    async def get(self, timeout: float = None):
+        # Returns None once an overflowed queue has been drained
+        if self.overflowed and self._queue.empty():
+            return None
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+
+    def __init__(self, max_queue: int = Events.MAX_QUEUE):
+        self._max_queue = max_queue
+        self._lock = Lock()
+        self._subscriptions = set()
+        self._published = 0
+
+    def subscribe(self, filters: dict = {}):
+        # Must be called on the event loop that will consume the events
+        subscription = Subscription(self, {key: value for key, value in filters.items() if value is not None}, self._max_queue)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: dict):
+        # Safe to call from worker threads as well as from the event loop
+        with self._lock:
+            self._published += 1
+            subscriptions = [x for x in self._subscriptions if x.matches(event)]
+        for subscription in subscriptions:
+            try:
+                subscription.send(event)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscriptions), "published": self._published}
+
+
+class ChangeDispatcher:
+    # Tails the change log that every worker writes to, so events reach the subscribers of every worker
+    # and cached classes another worker changed are dropped. A write made in this process is seen the same way.
+
+    def __init__(self, config: DatabaseConfig, bus: EventBus, interval: float = Events.POLL_INTERVAL, batch_size: int = Batch.FETCH_SIZE):
+        self._config = config
+        self._bus = bus
+        self._interval = interval
+        self._batch_size = batch_size
+        self._conn = None
+        self._stopped = Event()
+        self._thread = None
+        self.cursor = None
+        self._dispatched = 0
+        self._missed = 0
+
+    def start(self):
+        # The cursor is placed before returning, so no change committed after start is skipped
+        self._open()
+        self._stopped.clear()
+        self._thread = Thread(target=self.run_forever, name="change-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            try:
+                read = self.run_once()
+            except Exception:
+                log.exception("Change dispatcher failed, retrying")
+                read = 0
+            if read < self._batch_size:
+                committed.wait(self._interval)
+                committed.clear()
+
+    def stop(self):
+        self._stopped.set()
+        committed.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def run_once(self):
+        # Dispatches the next batch of changes; returns how many were read
+        self._open()
+        rows = self._conn.execute(
+            f"SELECT seq, table_name, class_id, event, student_id, current_enrollment FROM {ChangeLog.TABLE} WHERE seq > ? ORDER BY seq LIMIT ?",
+            [self.cursor, self._batch_size]).fetchall()
+        if len(rows) == 0:
+            return 0
+        self._missed += rows[0]["seq"] - self.cursor - 1
+        seats = {}
+        for row in rows:
+            if row["table_name"] == "enrollment":
+                seats[row["class_id"]] = row["current_enrollment"]
+            elif row["class_id"] is not None:
+                seats[row["class_id"]] = None
+        for class_id, current_enrollment in seats.items():
+            # Enrollment changes logged before migration 10 carry no seat count
+            if current_enrollment is None:
+                class_cache.invalidate(class_id)
+            else:
+                class_cache.reconcile(class_id, current_enrollment)
+        published = [x for x in rows if x["event"] is not None]
+        if len(published) != 0:
+            classes = self._classes({x["class_id"] for x in published})
+            for row in published:
+                class_data = classes.get(row["class_id"], {DatabaseColumn.ID: row["class_id"]})
+                self._bus.publish(enrollment_event(row["event"], class_data | {DatabaseColumn.CURRENT_ENROLLMENT: row["current_enrollment"]}, row["student_id"]))
+        self._dispatched += len(published)
+        self.cursor = rows[-1]["seq"]
+        return len(rows)
+
+    def stats(self):
+        return {"cursor": self.cursor, "dispatched": self._dispatched, "missed": self._missed}
+
+    def _open(self):
+        if self._conn is None:
+            self._conn = self._config.connect_read_only(check_same_thread=False)
+        if self.cursor is None:
+            # Like tail -f, a dispatcher starts at the end of the log
+            self.cursor = self._conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {ChangeLog.TABLE}").fetchone()[0]
+
+    def _classes(self, class_ids: set):
+        # A deleted class is not found and its event only carries the id
+        ids = list(class_ids)
+        rows = self._conn.execute(
+            f"SELECT id, department, course_code, section_number, max_enrollment FROM class WHERE id IN ({', '.join('?' for _ in ids)})", ids).fetchall()
+        return {x[DatabaseColumn.ID]: dict(x) for x in rows}
+
+
+def enrollment_event(event_type: str, class_data: dict, student_id: str = None):
+    return {
+        "type": event_type,
+        "studentId": student_id,
+        "classId": class_data[DatabaseColumn.ID],
+        "department": class_data.get(DatabaseColumn.DEPARTMENT),
+        "courseCode": class_data.get(DatabaseColumn.COURSE_CODE),
+        "sectionNumber": class_data.get(DatabaseColumn.SECTION_NUMBER),
+        "currentEnrollment": class_data.get(DatabaseColumn.CURRENT_ENROLLMENT),
+        "maxEnrollment": class_data.get(DatabaseColumn.MAX_ENROLLMENT),
+    }
+
+
+def event_filters(studentId: str = None, classId: str = None, department: str = None, courseCode: str = None, sectionNumber: int = None):
+    return {
+        "studentId": studentId,
+        "classId": classId,
+        "department": department,
+        "courseCode": courseCode,
+        "sectionNumber": sectionNumber,
+    }
+
+
+async def server_sent_events(subscription: Subscription, heartbeat: float = Events.HEARTBEAT):
+    with subscription:
+        # The first comment tells the client the subscription is in place
+        yield ": subscribed\n\n"
+        while True:
+            try:
+                event = await subscription.get(heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def websocket_events(websocket: "WebSocket", subscription: Subscription):
+    with subscription:
+        # The socket is read as well so a client that goes away releases its subscription right away
+        receive = asyncio.ensure_future(websocket.receive())
+        event = asyncio.ensure_future(subscription.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait((receive, event), return_when=asyncio.FIRST_COMPLETED)
+                if receive in done:
+                    if receive.result()["type"] == "websocket.disconnect":
+                        return
+                    receive = asyncio.ensure_future(websocket.receive())
+                if event in done:
+                    if event.result() is None:
+                        # 1013 asks the client to reconnect, after which it should re-read the current state
+                        await websocket.close(code=1013)
+                        return
+                    await websocket.send_json(event.result())
+                    event = asyncio.ensure_future(subscription.get())
+        finally:
+            receive.cancel()
+            event.cancel()
+
+
+def serve_events(app: "FastAPI", bus: EventBus):
+    # Imported here so that services publishing events do not load FastAPI
+    from fastapi import Depends, WebSocket
+    from fastapi.responses import StreamingResponse
+
+    @app.get("/events")
+    async def stream_events(filters: dict = Depends(event_filters)):
+        async def stream():
+            # Subscribes once the response starts, so the subscription is always released with the stream
+            async for chunk in server_sent_events(bus.subscribe(filters)):
+                yield chunk
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.websocket("/events/ws")
+    async def socket_events(websocket: WebSocket, filters: dict = Depends(event_filters)):
+        await websocket.accept()
+        await websocket_events(websocket, bus.subscribe(filters))
+    return bus
+
+
+event_bus = EventBus()
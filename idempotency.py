@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from hashlib import sha256
+from threading import Lock
+from time import monotonic, time
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from config import DatabaseConfig
+from constant import Idempotency, Message
+
+log = logging.getLogger("idempotency")
+
+StoredResponse = namedtuple("StoredResponse", ("status_code", "media_type", "body"))
+
+
+class IdempotencyStore:
+
+    def __init__(self, config: DatabaseConfig, ttl: float = Idempotency.TTL, lease: float = Idempotency.LEASE, max_keys: int = Idempotency.MAX_KEYS, clock = time):
+        self._ttl = ttl
+        self._lease = lease
+        self._max_keys = max_keys
+        self._clock = clock
+        self._lock = Lock()
+        self._config = config
+        # Opened on first use, so that building the store at import touches no database
+        self._conn = None
+        self._completed = 0
+        self._counts = {"executed": 0, "replayed": 0, "coalesced": 0, "conflicts": 0}
+
+    def claim(self, key: str, fingerprint: str):
+        # None means the caller now holds the key; otherwise the (fingerprint, status_code, media_type, body) row.
+        # An expired row, e.g. one left in flight by a worker that died, is taken over.
+        with self._lock:
+            while True:
+                now = self._clock()
+                claimed = self._connection().execute(
+                    f"INSERT INTO {Idempotency.TABLE} (key, fingerprint, expires_on) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, status_code = NULL, media_type = NULL, body = NULL, expires_on = excluded.expires_on "
+                    "WHERE expires_on <= ?",
+                    [key, fingerprint, now + self._lease, now]).rowcount == 1
+                if claimed:
+                    return None
+                row = self._connection().execute(f"SELECT fingerprint, status_code, media_type, body FROM {Idempotency.TABLE} WHERE key = ?", [key]).fetchone()
+                # Another worker may have released or purged the key in between; then try to claim it again
+                if row is not None:
+                    return tuple(row)
+
+    def complete(self, key: str, response: StoredResponse):
+        with self._lock:
+            self._connection().execute(
+                f"UPDATE {Idempotency.TABLE} SET status_code = ?, media_type = ?, body = ?, expires_on = ? WHERE key = ?",
+                [response.status_code, response.media_type, response.body, self._clock() + self._ttl, key])
+            self._completed += 1
+            purge = self._completed % Idempotency.PURGE_INTERVAL == 0
+        if purge:
+            self.purge()
+
+    def release(self, key: str):
+        # The request failed in a way a retry should not see, so the next attempt executes again
+        with self._lock:
+            self._connection().execute(f"DELETE FROM {Idempotency.TABLE} WHERE key = ? AND status_code IS NULL", [key])
+
+    def purge(self):
+        with self._lock:
+            expired = self._connection().execute(f"DELETE FROM {Idempotency.TABLE} WHERE expires_on <= ?", [self._clock()]).rowcount
+            # Over the bound, the completed keys closest to expiry go first
+            trimmed = self._connection().execute(
+                f"DELETE FROM {Idempotency.TABLE} WHERE key IN (SELECT key FROM {Idempotency.TABLE} WHERE status_code IS NOT NULL ORDER BY expires_on "
+                f"LIMIT MAX(0, (SELECT COUNT(*) FROM {Idempotency.TABLE}) - ?))",
+                [self._max_keys]).rowcount
+        log.debug("Purged %s expired and %s idempotency keys over the bound", expired, trimmed)
+        return expired + trimmed
+
+    def count(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self):
+        # Called with the lock held
+        if self._conn is None:
+            # Autocommit, so each claim or completion is visible to other workers as soon as it returns
+            self._conn = self._config.connect(check_same_thread=False, isolation_level=None)
+        return self._conn
+
+    def stats(self):
+        with self._lock:
+            size = self._connection().execute(f"SELECT COUNT(*) FROM {Idempotency.TABLE}").fetchone()[0]
+            return {"size": size, "max_keys": self._max_keys, "ttl": self._ttl} | self._counts
+
+
+class IdempotencyMiddleware:
+
+    def __init__(self, app, store: IdempotencyStore, wait_timeout: float = Idempotency.WAIT_TIMEOUT):
+        self.app = app
+        self._store = store
+        self._wait_timeout = wait_timeout
+        # Duplicates arriving at this worker wait on the first one's future instead of polling the store
+        self._in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        key = None
+        if scope["type"] == "http" and scope["method"] in Idempotency.METHODS:
+            key = dict(scope["headers"]).get(Idempotency.HEADER.lower().encode())
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.decode("latin-1")
+        if len(key) > Idempotency.MAX_KEY_LENGTH:
+            await send_response(send, error_response(status.HTTP_400_BAD_REQUEST, Message.IDEMPOTENCY_KEY_TOO_LONG))
+            return
+        body = await read_body(receive)
+        if body is None:
+            await send_response(send, error_response(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, Message.IDEMPOTENCY_BODY_TOO_LARGE))
+            return
+        fingerprint = sha256(b"\0".join((scope["method"].encode(), scope["path"].encode(), scope["query_string"], body))).hexdigest()
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._store.count("coalesced")
+            await send_response(send, *await self._wait(in_flight, fingerprint))
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (fingerprint, future)
+        try:
+            response, replayed = await self._settle(key, fingerprint)
+            if response is None:
+                response = await self._execute(key, scope, receive, send, body)
+                # To the coalesced duplicates this response is a replay
+                replayed = True
+            else:
+                await send_response(send, response, replayed)
+            future.set_result(None if response is None else (response, replayed))
+        finally:
+            if not future.done():
+                future.set_result(None)
+            del self._in_flight[key]
+
+    async def _settle(self, key: str, fingerprint: str):
+        # (None, False) once the key is held; otherwise the response to send and whether it is a replay
+        deadline = monotonic() + self._wait_timeout
+        while True:
+            row = await run_in_threadpool(self._store.claim, key, fingerprint)
+            if row is None:
+                return None, False
+            if row[0] != fingerprint:
+                self._store.count("conflicts")
+                return error_response(status.HTTP_400_BAD_REQUEST, Message.IDEMPOTENCY_KEY_REUSED), False
+            if row[1] is not None:
+                self._store.count("replayed")
+                return StoredResponse(*row[1:]), True
+            # Held by a request on another worker
+            if monotonic() >= deadline:
+                self._store.count("conflicts")
+                return error_response(status.HTTP_409_CONFLICT, Message.IDEMPOTENCY_IN_PROGRESS), False
+            await asyncio.sleep(Idempotency.POLL_INTERVAL)
+
+    async def _execute(self, key: str, scope, receive, send, body: bytes):
+        started = {}
+        chunks = []
+
+        async def replay_receive():
+            # The body was read up front for the fingerprint; disconnects still come from the client
+            nonlocal body
+            if body is None:
+                return await receive()
+            message = {"type": "http.request", "body": body, "more_body": False}
+            body = None
+            return message
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                started.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        self._store.count("executed")
+        try:
+            await self.app(scope, replay_receive, capture)
+        except BaseException:
+            await run_in_threadpool(self._store.release, key)
+            raise
+        if "status" not in started:
+            await run_in_threadpool(self._store.release, key)
+            return None
+        headers = dict(started.get("headers", []))
+        response = StoredResponse(started["status"], headers.get(b"content-type", b"").decode("latin-1") or None, b"".join(chunks))
+        if response.status_code >= 500 or response.status_code in Idempotency.RETRYABLE_STATUSES:
+            await run_in_threadpool(self._store.release, key)
+        else:
+            await run_in_threadpool(self._store.complete, key, response)
+        return response
+
+    async def _wait(self, in_flight: tuple, fingerprint: str):
+        if in_flight[0] != fingerprint:
+            self._store.count("conflicts")
+            return error_response(status.HTTP_400_BAD_REQUEST, Message.IDEMPOTENCY_KEY_REUSED), False
+        try:
+            result = await asyncio.wait_for(asyncio.shield(in_flight[1]), self._wait_timeout)
+        except asyncio.TimeoutError:
+            result = None
+        if result is None:
+            self._store.count("conflicts")
+            return error_response(status.HTTP_409_CONFLICT, Message.IDEMPOTENCY_IN_PROGRESS), False
+        return result
+
+
+async def read_body(receive, limit: int = Idempotency.MAX_BODY):
+    # None when the body is over limit; the request is rejected rather than buffered
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def error_response(status_code: int, detail: str):
+    return StoredResponse(status_code, "application/json", json.dumps({"detail": detail}).encode())
+
+
+async def send_response(send, response: StoredResponse, replayed: bool = False):
+    headers = [(b"content-length", str(len(response.body)).encode())]
+    if response.media_type is not None:
+        headers.append((b"content-type", response.media_type.encode("latin-1")))
+    if replayed:
+        headers.append((Idempotency.REPLAYED_HEADER.lower().encode(), b"true"))
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
@@ -0,0 +1,142 @@
+import re
+import logging
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from repository import query_caller, query_hooks
+from constant import Instrumentation
+
+log = logging.getLogger("instrumentation")
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = Lock()
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in series:
+            label_text = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels))
+            separator = "," if label_text != "" else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text}{separator}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Metrics:
+
+    def __init__(self, slow_query_seconds: float = Instrumentation.SLOW_QUERY_MS / 1000):
+        self.slow_query_seconds = slow_query_seconds
+        self.request_duration = Histogram("http_request_duration_seconds", "Handler latency by route", ("method", "route", "status"), Instrumentation.REQUEST_BUCKETS)
+        self.query_duration = Histogram("db_query_duration_seconds", "SQL statement latency", ("statement", "caller"), Instrumentation.QUERY_BUCKETS)
+        self.query_rows = Histogram("db_query_rows", "Rows returned or changed per SQL statement", ("statement", "caller"), Instrumentation.ROW_BUCKETS)
+        self.commit_batch_size = Histogram("write_commit_batch_size", "Write jobs per commit", (), Instrumentation.BATCH_BUCKETS)
+        self.commit_duration = Histogram("write_commit_duration_seconds", "Time to apply and commit a batch of write jobs", (), Instrumentation.REQUEST_BUCKETS)
+        self.write_latency = Histogram("write_job_latency_seconds", "Time from submit to commit of a write job", (), Instrumentation.REQUEST_BUCKETS)
+
+    def record_request(self, method: str, route: str, status: int, duration: float):
+        self.request_duration.observe((method, route, str(status)), duration)
+
+    def record_query(self, query: str, duration: float, rows: int):
+        statement = normalize(query)
+        caller = query_caller.get() or "unknown"
+        self.query_duration.observe((statement, caller), duration)
+        self.query_rows.observe((statement, caller), max(rows, 0))
+        if duration >= self.slow_query_seconds:
+            log.warning("Slow query %.1fms in %s, rows: %s: %s", duration * 1000, caller, rows, statement)
+
+    def record_commit(self, size: int, duration: float, latencies: list):
+        self.commit_batch_size.observe((), size)
+        self.commit_duration.observe((), duration)
+        for latency in latencies:
+            self.write_latency.observe((), latency)
+
+    def clear(self):
+        self.request_duration.clear()
+        self.query_duration.clear()
+        self.query_rows.clear()
+        self.commit_batch_size.clear()
+        self.commit_duration.clear()
+        self.write_latency.clear()
+
+    def render(self):
+        lines = self.request_duration.render() + self.query_duration.render() + self.query_rows.render()
+        lines += self.commit_batch_size.render() + self.commit_duration.render() + self.write_latency.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The route template keeps label cardinality bounded, unlike the raw path
+            route = scope.get("route")
+            self.metrics.record_request(scope["method"], "unmatched" if route is None else route.path, status[0], perf_counter() - start)
+
+
+@lru_cache(maxsize=1024)
+def normalize(query: str):
+    query = re.sub(r"\s+", " ", query).strip()
+    return re.sub(r"(\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+", r"\1, ...", query)
+
+
+def escape(value: str):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def instrument(app: FastAPI, metrics: Metrics):
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    query_hooks.append(metrics.record_query)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def render_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    return metrics
@@ -0,0 +1,399 @@
+#!/bin/python3
+
+import asyncio
+import json
+import logging
+from logging import Logger
+from os import getpid
+from socket import gethostname
+from sqlite3 import Connection
+from threading import Condition, Event, Lock, Thread
+from time import monotonic, perf_counter, time
+from uuid import uuid4
+from starlette import status
+from starlette.exceptions import HTTPException
+from starlette.concurrency import run_in_threadpool
+from config import DatabaseConfig, WriteConfig
+from cache import class_cache, waiting_list_index
+from service import ClassService, EnrollmentService, ProfileService
+from serialization import STDLIB_ENCODER
+from model import Field
+from constant import Message, WriteJob
+
+log = logging.getLogger("jobs")
+
+# The commands that go through the queue: the service each runs on and the methods callers may submit
+COMMANDS = {
+    "class": (lambda conn, log: ClassService(conn, "class", "instructor", log), ("add_class", "delete_class", "update_instructor")),
+    "enrollment": (lambda conn, log: EnrollmentService(conn, "enrollment", "class", log), ("enroll", "drop_enrollment", "bulk_enroll")),
+    "student": (lambda conn, log: ProfileService(conn, "student", log), ("add_profile", "update_profile", "delete_profile")),
+    "instructor": (lambda conn, log: ProfileService(conn, "instructor", log), ("add_profile", "update_profile", "delete_profile")),
+}
+
+FIELD_KEY = "__field__"
+
+# Wakes writers and waiters in this process without waiting for their next poll
+submitted = Event()
+completed = Condition()
+
+
+def encode_argument(value):
+    if isinstance(value, Field):
+        return {FIELD_KEY: value.model_dump(exclude_unset=True)}
+    if isinstance(value, list):
+        return [encode_argument(x) for x in value]
+    return value
+
+
+def decode_argument(value):
+    if isinstance(value, dict) and FIELD_KEY in value:
+        return Field(**value[FIELD_KEY])
+    if isinstance(value, list):
+        return [decode_argument(x) for x in value]
+    return value
+
+
+class WriteQueue:
+
+    def __init__(self, config: DatabaseConfig, write_config: WriteConfig):
+        self._write_config = write_config
+        self._lock = Lock()
+        self._config = config
+        # Opened on first use, so that building the queue at import touches no database
+        self._conn = None
+        self._submitted = 0
+        self._timeouts = 0
+
+    def submit(self, service: str, method: str, *arguments):
+        if service not in COMMANDS or method not in COMMANDS[service][1]:
+            raise ValueError(f"{service}.{method} is not a queued write command")
+        with self._lock:
+            ticket = self._connection().execute(
+                f"INSERT INTO {WriteJob.TABLE} (service, method, arguments, status, submitted_on) VALUES (?, ?, ?, ?, ?)",
+                [service, method, STDLIB_ENCODER.encode([encode_argument(x) for x in arguments]), WriteJob.QUEUED, time()]).lastrowid
+            self._submitted += 1
+        submitted.set()
+        return ticket
+
+    def status(self, ticket: int):
+        # (status, status_code, result) of a ticket, or None once it was cleaned up or never existed
+        with self._lock:
+            row = self._connection().execute(f"SELECT status, status_code, result FROM {WriteJob.TABLE} WHERE id = ?", [ticket]).fetchone()
+        return None if row is None else (row[0], row[1], None if row[2] is None else json.loads(row[2]))
+
+    def result(self, ticket: int):
+        # Blocks until the writer finished the ticket; the writer's HTTPException is raised here
+        deadline = monotonic() + self._write_config.timeout
+        interval = self._write_config.poll_interval
+        while True:
+            job = self.status(ticket)
+            if job is not None and job[0] in (WriteJob.DONE, WriteJob.FAILED):
+                return self._outcome(job)
+            remaining = deadline - monotonic()
+            if job is None or remaining <= 0:
+                return self._timed_out(ticket, job)
+            with completed:
+                completed.wait(min(interval, remaining))
+            interval = min(interval * 2, WriteJob.MAX_POLL_INTERVAL)
+
+    async def async_result(self, ticket: int):
+        deadline = monotonic() + self._write_config.timeout
+        interval = self._write_config.poll_interval
+        while True:
+            job = await run_in_threadpool(self.status, ticket)
+            if job is not None and job[0] in (WriteJob.DONE, WriteJob.FAILED):
+                return self._outcome(job)
+            if job is None or monotonic() >= deadline:
+                return self._timed_out(ticket, job)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, WriteJob.MAX_POLL_INTERVAL)
+
+    def call(self, service: str, method: str, *arguments):
+        return self.result(self.submit(service, method, *arguments))
+
+    async def async_call(self, service: str, method: str, *arguments):
+        return await self.async_result(await run_in_threadpool(self.submit, service, method, *arguments))
+
+    def stats(self):
+        with self._lock:
+            queued = self._connection().execute(f"SELECT COUNT(*) FROM {WriteJob.TABLE} WHERE status = ?", [WriteJob.QUEUED]).fetchone()[0]
+            return {"submitted": self._submitted, "timeouts": self._timeouts, "queued": queued}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self):
+        # Called with the lock held
+        if self._conn is None:
+            # Autocommit, so a submitted job is visible to the writer as soon as submit returns
+            self._conn = self._config.connect(check_same_thread=False, isolation_level=None)
+        return self._conn
+
+    def _outcome(self, job: tuple):
+        if job[0] == WriteJob.FAILED:
+            raise HTTPException(status_code=job[1], detail=job[2])
+        return job[2]
+
+    def _timed_out(self, ticket: int, job: tuple):
+        if job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=Message.WRITE_NOT_FOUND)
+        with self._lock:
+            self._timeouts += 1
+        # The write may still run, so the ticket is returned for the caller to look up later
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail={"msg": Message.WRITE_TIMEOUT, "ticket": ticket})
+
+
+class SavepointConnection:
+    # Hands a service the writer's connection inside a savepoint of the batch transaction:
+    # its commit keeps its writes so far and its rollback only undoes its own
+
+    def __init__(self, conn: Connection, hooks: list):
+        self._conn = conn
+        self._hooks = hooks
+        self._conn.execute(f"SAVEPOINT {WriteJob.SAVEPOINT}")
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    def after_commit(self, hook, *arguments):
+        # The service's commit is only a savepoint release, so cache updates and events wait for the batch commit
+        self._hooks.append((hook, arguments))
+
+    def commit(self):
+        self._conn.execute(f"RELEASE {WriteJob.SAVEPOINT}")
+        self._conn.execute(f"SAVEPOINT {WriteJob.SAVEPOINT}")
+
+    def rollback(self):
+        self._conn.execute(f"ROLLBACK TO {WriteJob.SAVEPOINT}")
+
+    def finish(self):
+        # Writes the service left uncommitted are dropped, as a direct connection would on rollback
+        self._conn.execute(f"ROLLBACK TO {WriteJob.SAVEPOINT}")
+        self._conn.execute(f"RELEASE {WriteJob.SAVEPOINT}")
+
+
+class QueuedService:
+    # Stands in for a writable service: its write methods submit a job and wait for the writer's result
+
+    def __init__(self, queue: WriteQueue, service: str):
+        self._queue = queue
+        self._service = service
+
+    def __getattr__(self, method: str):
+        if method not in COMMANDS[self._service][1]:
+            raise AttributeError(method)
+        return lambda *arguments: self._queue.call(self._service, method, *arguments)
+
+
+class JobWriter:
+
+    def __init__(self, config: DatabaseConfig, write_config: WriteConfig, log: Logger, name: str = "default", metrics = None):
+        self._config = config
+        self._write_config = write_config
+        self._log = log
+        self._name = name
+        self._metrics = metrics
+        self._owner = f"{gethostname()}:{getpid()}:{uuid4().hex[:8]}"
+        self._conn = None
+        self._leader = False
+        self._renewed_on = 0.0
+        self._stopped = Event()
+        self._thread = None
+        self._processed = 0
+        self._failed = 0
+        self._recovered = 0
+        self._batches = 0
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self.run_forever, name="job-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                self._log.exception("Job writer failed, retrying")
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.rollback()
+                processed = 0
+            if processed == 0:
+                # Followers only need to notice an expired lease; the leader also wakes for local submits
+                submitted.wait(self._write_config.poll_interval if self._leader else self._write_config.lease / 3)
+                submitted.clear()
+
+    def stop(self):
+        self._stopped.set()
+        submitted.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._release()
+            self._conn.close()
+            self._conn = None
+
+    def run_once(self):
+        # Processes what is queued if this writer holds (or can take) the lease; returns the jobs processed
+        if self._conn is None:
+            self._conn = self._config.connect(check_same_thread=False)
+        if not self._hold_lease():
+            return 0
+        batch_size = self._write_config.batch_size
+        if batch_size > 1:
+            jobs = self._collect(self._fetch(0, batch_size), batch_size)
+            if len(jobs) != 0:
+                self._execute_batch(jobs)
+            return len(jobs)
+        processed = 0
+        for job in self._fetch(0, WriteJob.FETCH_SIZE):
+            # Checked per job so a writer that lost its lease mid-batch stops before the next one
+            if not self._hold_lease():
+                break
+            self._execute(*job)
+            processed += 1
+        return processed
+
+    def stats(self):
+        return {"owner": self._owner, "leader": self._leader, "processed": self._processed, "failed": self._failed, "recovered": self._recovered, "batches": self._batches}
+
+    def _fetch(self, after: int, limit: int):
+        return self._conn.execute(f"SELECT id, service, method, arguments, submitted_on FROM {WriteJob.TABLE} WHERE status = ? AND id > ? ORDER BY id LIMIT ?", [WriteJob.QUEUED, after, limit]).fetchall()
+
+    def _collect(self, jobs: list, batch_size: int):
+        # Waits up to the batch window for more jobs once at least one is queued
+        deadline = monotonic() + self._write_config.batch_window
+        while 0 < len(jobs) < batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            submitted.wait(min(remaining, self._write_config.poll_interval))
+            submitted.clear()
+            jobs += self._fetch(jobs[-1][0], batch_size - len(jobs))
+        return jobs
+
+    def _execute(self, job_id: int, service: str, method: str, arguments: str, submitted_on: float):
+        conn = self._conn
+        start = perf_counter()
+        # Left uncommitted so it commits together with the command's own writes: a job found running
+        # after a writer died is one whose effect is in the database but whose result is not
+        conn.execute(f"UPDATE {WriteJob.TABLE} SET status = ? WHERE id = ?", [WriteJob.RUNNING, job_id])
+        result, status_code = self._apply(conn, job_id, service, method, arguments)
+        if conn.in_transaction:
+            conn.rollback()
+        completed_on = self._complete(job_id, result, status_code)
+        conn.commit()
+        self._committed(perf_counter() - start, [completed_on - submitted_on])
+
+    def _execute_batch(self, jobs: list):
+        # One transaction and one commit for the whole batch. Each job runs in its own savepoint, so a
+        # failing job only undoes its own writes, and results commit atomically with their effects:
+        # a writer that dies mid-batch leaves every job of it queued.
+        conn = self._conn
+        start = perf_counter()
+        hooks = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            completions = []
+            for job_id, service, method, arguments, submitted_on in jobs:
+                savepoint = SavepointConnection(conn, hooks)
+                result, status_code = self._apply(savepoint, job_id, service, method, arguments)
+                savepoint.finish()
+                completions.append(self._complete(job_id, result, status_code) - submitted_on)
+            conn.commit()
+        except Exception:
+            # The hooks of the rolled back jobs are dropped with their writes. Rows read inside the batch may
+            # have been cached with writes of earlier jobs that are now undone.
+            conn.rollback()
+            class_cache.clear()
+            waiting_list_index.clear()
+            raise
+        for hook, arguments in hooks:
+            try:
+                hook(*arguments)
+            except Exception:
+                self._log.exception("Post-commit hook of a write batch failed")
+        self._committed(perf_counter() - start, completions)
+
+    def _apply(self, conn, job_id: int, service: str, method: str, arguments: str):
+        try:
+            factory, methods = COMMANDS[service]
+            if method not in methods:
+                raise ValueError(f"{service}.{method} is not a queued write command")
+            return getattr(factory(conn, self._log), method)(*decode_argument(json.loads(arguments))), status.HTTP_200_OK
+        except HTTPException as e:
+            return e.detail, e.status_code
+        except Exception:
+            self._log.exception("Write job %s failed", job_id)
+            return "Internal Server Error", status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def _complete(self, job_id: int, result, status_code: int):
+        outcome = WriteJob.DONE if status_code < 400 else WriteJob.FAILED
+        completed_on = time()
+        self._conn.execute(f"UPDATE {WriteJob.TABLE} SET status = ?, status_code = ?, result = ?, completed_on = ? WHERE id = ?", [outcome, status_code, STDLIB_ENCODER.encode(result), completed_on, job_id])
+        if outcome == WriteJob.FAILED:
+            self._failed += 1
+        return completed_on
+
+    def _committed(self, duration: float, latencies: list):
+        self._batches += 1
+        before = self._processed
+        self._processed += len(latencies)
+        if self._metrics is not None:
+            self._metrics.record_commit(len(latencies), duration, latencies)
+        with completed:
+            completed.notify_all()
+        if before // WriteJob.CLEANUP_EVERY != self._processed // WriteJob.CLEANUP_EVERY:
+            self._cleanup()
+
+    def _hold_lease(self):
+        now = time()
+        if self._leader and now - self._renewed_on < self._write_config.lease / 3:
+            return True
+        held = self._conn.execute(
+            f"INSERT INTO {WriteJob.LEASE_TABLE} (name, owner, expires_on) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_on = excluded.expires_on WHERE owner = excluded.owner OR expires_on <= ?",
+            [self._name, self._owner, now + self._write_config.lease, now]).rowcount == 1
+        if held and not self._leader:
+            self._recover()
+        self._conn.commit()
+        if held != self._leader:
+            self._log.info("Job writer %s %s the write lease", self._owner, "took" if held else "lost")
+        self._leader = held
+        self._renewed_on = now
+        return held
+
+    def _recover(self):
+        self._recovered += self._conn.execute(
+            f"UPDATE {WriteJob.TABLE} SET status = ?, status_code = ?, result = ?, completed_on = ? WHERE status = ?",
+            [WriteJob.FAILED, status.HTTP_500_INTERNAL_SERVER_ERROR, STDLIB_ENCODER.encode(Message.WRITE_RESULT_LOST), time(), WriteJob.RUNNING]).rowcount
+
+    def _release(self):
+        if self._leader:
+            self._conn.execute(f"DELETE FROM {WriteJob.LEASE_TABLE} WHERE name = ? AND owner = ?", [self._name, self._owner])
+            self._conn.commit()
+            self._leader = False
+
+    def _cleanup(self):
+        self._conn.execute(f"DELETE FROM {WriteJob.TABLE} WHERE completed_on < ?", [time() - self._write_config.retention])
+        self._conn.commit()
+
+
+def run():
+    # A dedicated writer process; workers started with WRITE_MODE=queue then only take over if it stops
+    logging.basicConfig(level=logging.INFO)
+    writer = JobWriter(DatabaseConfig.from_environment(), WriteConfig.from_environment(), log)
+    try:
+        writer.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.stop()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,120 @@
+import json
+import logging
+import random
+from copy import copy
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from uuid import uuid4
+from config import LoggingConfig
+
+request_id = ContextVar("request_id", default=None)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class RequestIdFilter(logging.Filter):
+
+    def filter(self, record: logging.LogRecord):
+        # Runs on the request thread before the record is queued, while the context is still current
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        # Only the message is rendered here; the listener applies the configured format
+        record = copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # A full queue drops the record instead of blocking the request
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class RequestIdMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        current = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or uuid4().hex
+        token = request_id.set(current)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((REQUEST_ID_HEADER.encode(), current.encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
+
+
+def configure_logging(config: LoggingConfig, stream = None):
+    # Handlers run on the listener thread, so formatting and I/O stay off the request path
+    stream_handler = logging.StreamHandler(stream)
+    if config.format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    queue_handler = DroppingQueueHandler(Queue(config.queue_size))
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.level)
+    query_log = logging.getLogger("repository.query")
+    for existing in list(query_log.filters):
+        if isinstance(existing, SamplingFilter):
+            query_log.removeFilter(existing)
+    query_log.addFilter(SamplingFilter(config.query_sample_rate))
+    listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
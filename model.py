@@ -0,0 +1,29 @@
+from pydantic import BaseModel, ValidationError
+from constant import DatabaseColumn
+
+class Field(BaseModel):
+    instructorId: str = None
+    department: str = None
+    courseCode: str  = None
+    sectionNumber: int = 1
+    className: str = None
+    maxEnrollment: int = 20
+    automaticEnrollmentFrozen: bool = False
+    id: str = None
+    firstName: str = None
+    lastName: str = None
+    age: int= None
+
+def get_find_class_dict(field: Field):
+    return {
+        DatabaseColumn.DEPARTMENT: field.department,
+        DatabaseColumn.COURSE_CODE: field.courseCode,
+        DatabaseColumn.SECTION_NUMBER: field.sectionNumber,
+    }
+
+def parse_import_records(records: list, rejected: list):
+    for line, row in records:
+        try:
+            yield line, Field.model_validate(row)
+        except ValidationError as e:
+            rejected.append({"line": line, "errors": [f"{'.'.join(str(x) for x in error['loc'])}: {error['msg']}" for error in e.errors()]})
@@ -1,36 +1,126 @@
 #!/bin/python3
 
-import sqlite3
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from sqlite3 import Connection
+from time import monotonic, sleep
 from tabulate import tabulate
-from time import sleep
-from os import system
+from config import DatabaseConfig
+from constant import Batch, ChangeLog
 
-conn = sqlite3.connect("database.db")
-conn.row_factory = sqlite3.Row
+CLEAR_SCREEN = "\033[H\033[J"
+# Small enough to stay far below SQLite's variable limit
+CLASS_CHUNK_SIZE = 500
 
-def monitor(table_name):
-    cursor = conn.execute(f"SELECT * FROM {table_name}")
-    headers = list(map(lambda x: x[0], cursor.description))
-    data = cursor.fetchall()
-    rows = []
-    for row in data:
-        rows.append(row)
-    print_table(rows, headers, table_name)
 
-def print_table(rows, headers, table_name):
-    print(table_name.upper())
-    print(tabulate(rows, headers=headers, tablefmt="grid"), end="\n\n")
+class ChangeFeed:
+
+    def __init__(self, conn: Connection, after: int = None, batch_size: int = Batch.FETCH_SIZE):
+        self._conn = conn
+        self._batch_size = batch_size
+        # Without a cursor the feed starts at the end of the log, like tail -f
+        self.cursor = self.latest() if after is None else after
+
+    def latest(self):
+        return self._conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {ChangeLog.TABLE}").fetchone()[0]
+
+    def poll(self):
+        # Returns (counts by (table_name, operation), touched class ids, changes pruned before they were read)
+        counts = Counter()
+        class_ids = set()
+        missed = 0
+        while True:
+            rows = self._conn.execute(f"SELECT seq, table_name, operation, class_id FROM {ChangeLog.TABLE} WHERE seq > ? ORDER BY seq LIMIT ?", [self.cursor, self._batch_size]).fetchall()
+            if len(rows) == 0:
+                return counts, class_ids, missed
+            missed += rows[0][0] - self.cursor - 1
+            for seq, table_name, operation, class_id in rows:
+                counts[(table_name, operation)] += 1
+                if class_id is not None:
+                    class_ids.add(class_id)
+            self.cursor = rows[-1][0]
+            if len(rows) < self._batch_size:
+                return counts, class_ids, missed
+
+
+class Dashboard:
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._classes = {}
+        self._rates = {}
+        self._totals = Counter()
+        self._missed = 0
+        # One grouped pass at start; afterwards only classes seen in the change log are read again
+        self._load(self._class_stats(""), [])
+
+    def apply(self, counts: Counter, class_ids: set, missed: int, elapsed: float):
+        self._totals.update(counts)
+        self._missed += missed
+        self._rates = {key: count / elapsed for key, count in counts.items()} if elapsed > 0 else {}
+        ids = list(class_ids)
+        for index in range(0, len(ids), CLASS_CHUNK_SIZE):
+            chunk = ids[index:index + CLASS_CHUNK_SIZE]
+            self._load(self._class_stats(f"WHERE c.id IN ({', '.join('?' for _ in chunk)})", chunk), chunk)
+
+    def render(self, top: int = ChangeLog.TOP_CLASSES):
+        enrollments = self._rates.get(("enrollment", "insert"), 0.0)
+        updates = self._rates.get(("enrollment", "update"), 0.0)
+        seats = sum(x[1] for x in self._classes.values())
+        waiting = sum(x[2] for x in self._classes.values())
+        full = sum(1 for x in self._classes.values() if x[1] == 0)
+        lines = [
+            f"enrollments/sec {enrollments:.1f}  enrollment updates/sec {updates:.1f}  changes seen {sum(self._totals.values())}" + (f"  missed {self._missed}" if self._missed else ""),
+            f"classes {len(self._classes)}  full {full}  seats remaining {seats}  on waiting lists {waiting}",
+            "",
+        ]
+        busiest = sorted(self._classes.values(), key=lambda x: (-x[2], x[1], x[0]))[:top]
+        lines.append(tabulate(busiest, headers=["class", "seats remaining", "waiting list"], tablefmt="simple"))
+        return "\n".join(lines)
+
+    def _class_stats(self, where_clause: str, argument: list = []):
+        # The join condition matches the partial waiting list index, so depth is counted from the index alone
+        return self._conn.execute(f'''
+            SELECT c.id, c.department || ' ' || c.course_code || '-' || c.section_number, MAX(c.max_enrollment - c.current_enrollment, 0), COUNT(e.id)
+            FROM class c LEFT JOIN enrollment e ON e.class_id = c.id AND e.dropped = false AND e.waiting_list = true
+            {where_clause} GROUP BY c.id
+        ''', argument).fetchall()
+
+    def _load(self, rows: list, class_ids: list):
+        # Classes asked for but not returned were deleted
+        for class_id in class_ids:
+            self._classes.pop(class_id, None)
+        for class_id, name, seats, waiting in rows:
+            self._classes[class_id] = (name, seats, waiting)
+
 
 def run():
-    while(True):
-        try:
-            monitor("class")
-            monitor("enrollment")
-            monitor("instructor")
-            monitor("student")
-        except Exception as e:
-            print(e)
-        sleep(1)
-        system("clear")
-        
-run()
+    parser = ArgumentParser(description="Tail the change log and show enrollment activity")
+    parser.add_argument("--interval", type=float, default=ChangeLog.INTERVAL, help="seconds between polls")
+    parser.add_argument("--top", type=int, default=ChangeLog.TOP_CLASSES, help="classes listed, by waiting list depth")
+    parser.add_argument("--after", type=int, default=None, help="change log seq to start after instead of the latest")
+    arguments = parser.parse_args()
+
+    conn = DatabaseConfig.from_environment().connect_read_only()
+    try:
+        feed = ChangeFeed(conn, arguments.after)
+        dashboard = Dashboard(conn)
+        last = monotonic()
+        while True:
+            sleep(arguments.interval)
+            counts, class_ids, missed = feed.poll()
+            now = monotonic()
+            dashboard.apply(counts, class_ids, missed, now - last)
+            last = now
+            if sys.stdout.isatty():
+                sys.stdout.write(CLEAR_SCREEN)
+            print(dashboard.render(arguments.top), end="\n\n", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,94 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from records import encode_rows
+from serialization import dumps
+from constant import Batch, Message, Pagination
+
+
+def encode_cursor(row: dict, order_by: tuple):
+    return urlsafe_b64encode(json.dumps([row[x] for x in order_by]).encode()).decode()
+
+
+def decode_cursor(cursor: str, order_by: tuple):
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != len(order_by):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.INVALID_CURSOR)
+    return tuple(values)
+
+
+def lookahead_limit(limit: int):
+    # One extra row tells whether another page follows without a separate count query
+    return None if limit is None else limit + 1
+
+
+def page_response(rows, limit: int, order_by: tuple, headers: dict = None):
+    if limit is None:
+        return StreamingResponse(json_array(rows), media_type="application/json", headers=headers)
+    # The query already stops at lookahead_limit, so reading to the end lets the cursor finish normally
+    return _page(list(rows), limit, order_by, headers)
+
+
+async def async_page_response(rows, limit: int, order_by: tuple, headers: dict = None):
+    if limit is None:
+        return StreamingResponse(async_json_array(rows), media_type="application/json", headers=headers)
+    page = []
+    async for row in rows:
+        page.append(row)
+    return _page(page, limit, order_by, headers)
+
+
+def json_array(rows):
+    batch = []
+    first = True
+    for row in rows:
+        batch.append(row)
+        if len(batch) == Batch.FETCH_SIZE:
+            yield _array_chunk(batch, first)
+            batch = []
+            first = False
+    yield _array_chunk(batch, first) + b"]"
+
+
+async def async_json_array(rows):
+    batch = []
+    first = True
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == Batch.FETCH_SIZE:
+            yield _array_chunk(batch, first)
+            batch = []
+            first = False
+    yield _array_chunk(batch, first) + b"]"
+
+
+def rows_response(rows: list, headers: dict = None):
+    return Response(encode_rows(rows), media_type="application/json", headers=headers)
+
+
+def _page(page: list, limit: int, order_by: tuple, headers: dict = None):
+    headers = {} if headers is None else dict(headers)
+    if len(page) > limit:
+        page = page[:limit]
+        headers[Pagination.NEXT_CURSOR_HEADER] = encode_cursor(page[-1], order_by)
+    return rows_response(page, headers)
+
+
+def _array_chunk(batch: list, first: bool):
+    # Each batch is encoded as one array and spliced into the streamed one
+    body = encode_rows(batch)[1:-1]
+    if first:
+        return b"[" + body
+    return body if body == b"" else b"," + body
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,138 @@
+from sqlite3 import Connection
+from threading import Condition, Lock, get_ident
+from contextlib import contextmanager
+from time import perf_counter
+from config import DatabaseConfig
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, config: DatabaseConfig):
+        self._config = config
+        self._max_readers = config.max_readers
+        self._timeout = config.pool_timeout
+        self._condition = Condition()
+        self._idle_readers = []
+        self._reader_count = 0
+        self._writer = None
+        self._writer_lock = Lock()
+        self._stats_lock = Lock()
+        self._checkouts = 0
+        self._in_use = 0
+        self._exhausted = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    @contextmanager
+    def reader(self):
+        conn = self._checkout_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._checkin_reader(conn)
+
+    @contextmanager
+    def writer(self):
+        start = perf_counter()
+        if not self._writer_lock.acquire(timeout=self._timeout):
+            self._record_exhausted()
+            raise PoolExhaustedError("Timed out waiting for the writer connection")
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            self._record_checkout(perf_counter() - start)
+            try:
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+                self._record_checkin()
+        finally:
+            self._writer_lock.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "checkouts": self._checkouts,
+                "in_use": self._in_use,
+                "idle_readers": len(self._idle_readers),
+                "reader_connections": self._reader_count,
+                "max_readers": self._max_readers,
+                "exhausted": self._exhausted,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_max": self._wait_time_max,
+            }
+
+    def close(self):
+        with self._condition:
+            for _, conn in self._idle_readers:
+                conn.close()
+            self._reader_count -= len(self._idle_readers)
+            self._idle_readers.clear()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _checkout_reader(self):
+        start = perf_counter()
+        thread_id = get_ident()
+        with self._condition:
+            while True:
+                conn = self._take_idle_reader(thread_id)
+                if conn is not None:
+                    break
+                if self._reader_count < self._max_readers:
+                    self._reader_count += 1
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        self._reader_count -= 1
+                        raise
+                    break
+                remaining = self._timeout - (perf_counter() - start)
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    self._record_exhausted()
+                    raise PoolExhaustedError("Timed out waiting for a reader connection")
+        self._record_checkout(perf_counter() - start)
+        return conn
+
+    def _take_idle_reader(self, thread_id: int):
+        # Prefer the connection this thread used last so its page cache stays warm
+        for index, (owner_id, conn) in enumerate(self._idle_readers):
+            if owner_id == thread_id:
+                del self._idle_readers[index]
+                return conn
+        if len(self._idle_readers) != 0:
+            return self._idle_readers.pop()[1]
+        return None
+
+    def _checkin_reader(self, conn: Connection):
+        with self._condition:
+            self._idle_readers.append((get_ident(), conn))
+            self._condition.notify()
+        self._record_checkin()
+
+    def _connect(self):
+        return self._config.connect(check_same_thread=False)
+
+    def _record_checkout(self, wait_time: float):
+        with self._stats_lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+
+    def _record_checkin(self):
+        with self._stats_lock:
+            self._in_use -= 1
+
+    def _record_exhausted(self):
+        with self._stats_lock:
+            self._exhausted += 1
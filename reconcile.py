@@ -0,0 +1,33 @@
+#!/bin/python3
+
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+from service import EnrollmentService
+from config import DatabaseConfig
+from schema import create_database
+
+
+def run():
+    parser = ArgumentParser(description="Compare class seat counts with their enrollment rows")
+    parser.add_argument("--repair", action="store_true", help="rewrite the drifted counts from the enrollment rows")
+    arguments = parser.parse_args()
+
+    log = logging.getLogger()
+    logging.basicConfig(level=logging.INFO)
+    config = DatabaseConfig.from_environment()
+    create_database(config)
+    conn = config.connect()
+    try:
+        drift = EnrollmentService(conn, "enrollment", "class", log).reconcile_enrollment_counts(arguments.repair)
+    finally:
+        conn.close()
+    json.dump({"drifted": len(drift), "repaired": arguments.repair, "classes": drift}, sys.stdout, indent=2)
+    print()
+    # A non-zero exit lets a scheduled check alert on drift it was not asked to repair
+    return 1 if len(drift) != 0 and not arguments.repair else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
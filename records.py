@@ -0,0 +1,111 @@
+from collections import namedtuple
+from json.encoder import encode_basestring_ascii
+from constant import DatabaseColumn
+from util import snake_to_camel
+from serialization import STDLIB_ENCODER
+import serialization
+
+
+class Record:
+    # Mixed into the namedtuple row types so a record still reads like the dict it replaces
+    __slots__ = ()
+    INDEX = {}
+    RESPONSE_KEYS = ()
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self.INDEX[key] if isinstance(key, str) else key)
+
+    def get(self, key: str, default = None):
+        index = self.INDEX.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def to_response(self):
+        return dict(zip(self.RESPONSE_KEYS, self))
+
+
+def record_type(name: str, columns: tuple):
+    return type(name, (Record, namedtuple(name, columns)), {
+        "__slots__": (),
+        "INDEX": {column: index for index, column in enumerate(columns)},
+        "RESPONSE_KEYS": tuple(snake_to_camel(x) for x in columns),
+        # The JSON object of a row with its values still to be filled in, see encode_rows
+        "JSON_TEMPLATE": "{" + ",".join(f"{encode_basestring_ascii(x)}:%s" for x in columns) + "}",
+    })
+
+
+PROFILE_COLUMNS = (DatabaseColumn.ID, DatabaseColumn.FIRST_NAME, DatabaseColumn.LAST_NAME, DatabaseColumn.AGE)
+
+StudentRecord = record_type("StudentRecord", PROFILE_COLUMNS)
+InstructorRecord = record_type("InstructorRecord", PROFILE_COLUMNS)
+ClassRecord = record_type("ClassRecord", (
+    DatabaseColumn.ID,
+    DatabaseColumn.INSTRUCTOR_ID,
+    DatabaseColumn.DEPARTMENT,
+    DatabaseColumn.COURSE_CODE,
+    DatabaseColumn.SECTION_NUMBER,
+    DatabaseColumn.CLASS_NAME,
+    DatabaseColumn.CURRENT_ENROLLMENT,
+    DatabaseColumn.MAX_ENROLLMENT,
+    DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN,
+))
+EnrollmentRecord = record_type("EnrollmentRecord", (
+    DatabaseColumn.ID,
+    DatabaseColumn.STUDENT_ID,
+    DatabaseColumn.CLASS_ID,
+    DatabaseColumn.ENROLLED_ON,
+    DatabaseColumn.DROPPED,
+    DatabaseColumn.WAITING_LIST,
+))
+
+RECORD_TYPES = {
+    "student": StudentRecord,
+    "instructor": InstructorRecord,
+    "class": ClassRecord,
+    "enrollment": EnrollmentRecord,
+}
+
+
+def row_factory(table_name: str, description):
+    # Anything but the table's exact column list, e.g. after a migration added a column, falls back to dicts
+    columns = tuple(x[0] for x in description)
+    record = RECORD_TYPES.get(table_name)
+    if record is not None and record._fields == columns:
+        return record._make
+    return lambda row: dict(zip(columns, row))
+
+
+# The JSON the stdlib encoder writes for the values columns hold; floats and anything else go through the encoder itself
+VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    bool: lambda x: "true" if x else "false",
+    type(None): lambda x: "null",
+}
+
+
+def encode_value(value):
+    encoder = VALUE_ENCODERS.get(type(value))
+    return STDLIB_ENCODER.encode(value) if encoder is None else encoder(value)
+
+
+def encode_column(values: tuple):
+    # A column nearly always holds one type, whose encoder is then mapped over it without a lookup per value
+    kinds = set(map(type, values))
+    encoder = VALUE_ENCODERS.get(kinds.pop()) if len(kinds) == 1 else None
+    return list(map(encode_value if encoder is None else encoder, values))
+
+
+def encode_rows(rows: list):
+    # Records of one type are written from their tuples straight into the type's JSON template, a column at a
+    # time. orjson encodes dicts faster than that, so it and mixed batches get the rows as dicts in one call.
+    record = type(rows[0]) if len(rows) != 0 else dict
+    if serialization.codec != "stdlib" or not issubclass(record, Record) or any(type(x) is not record for x in rows):
+        return serialization.dumps([dict(x.items()) if isinstance(x, Record) else x for x in rows])
+    columns = [encode_column(x) for x in zip(*rows)]
+    return ("[" + ",".join([record.JSON_TEMPLATE % x for x in zip(*columns)]) + "]").encode()
@@ -1,7 +1,152 @@
+import sys
 from sqlite3 import Connection
-from logging import Logger
+from logging import Logger, getLogger
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isasyncgenfunction, iscoroutinefunction, isgeneratorfunction
 from uuid import uuid4
-from constant import DatabaseColumn
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+from constant import Batch, Cache, ChangeLog, DatabaseColumn, HttpCache
+from records import row_factory
+
+
+class StatementCache:
+
+    def __init__(self, max_size: int = Cache.MAX_STATEMENTS):
+        self._max_size = max_size
+        self._statements = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: tuple, build):
+        with self._lock:
+            query = self._statements.get(key)
+            if query is not None:
+                self._statements.move_to_end(key)
+                self._hits += 1
+                return query
+            self._misses += 1
+        query = build()
+        with self._lock:
+            self._statements[key] = query
+            if len(self._statements) > self._max_size:
+                self._statements.popitem(last=False)
+        return query
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._statements),
+                "max_size": self._max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+statement_cache = StatementCache()
+
+# Callables receiving (query, duration, rows) for every statement a repository runs
+query_hooks = []
+
+# Statement debug lines go to their own logger so they can be sampled separately
+query_log = getLogger("repository.query")
+
+# Service method behind the statements of the current public repository call, read by query hooks
+query_caller = ContextVar("query_caller", default=None)
+
+SERVICE_MODULES = ("service", "async_service")
+
+CLASS_KEY_COLUMNS = (DatabaseColumn.DEPARTMENT, DatabaseColumn.COURSE_CODE, DatabaseColumn.SECTION_NUMBER)
+ENROLLMENT_ORDER = (DatabaseColumn.ENROLLED_ON, DatabaseColumn.ID)
+
+
+def service_caller(frame, fallback: str):
+    while frame is not None:
+        if frame.f_globals.get("__name__") in SERVICE_MODULES:
+            owner = frame.f_locals.get("self")
+            return frame.f_code.co_name if owner is None else f"{type(owner).__name__}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback
+
+
+def traced(method):
+    # The stack is walked once per public call; nested calls and streamed batches reuse the resolved caller
+    def resolve(repository, frame):
+        return query_caller.get() or service_caller(frame, f"{type(repository).__name__}.{method.__name__}")
+
+    if isgeneratorfunction(method):
+        @wraps(method)
+        def wrapper(self, *arguments, **keywords):
+            return traced_steps(method(self, *arguments, **keywords), resolve(self, sys._getframe(1)))
+    elif isasyncgenfunction(method):
+        @wraps(method)
+        def wrapper(self, *arguments, **keywords):
+            return async_traced_steps(method(self, *arguments, **keywords), resolve(self, sys._getframe(1)))
+    elif iscoroutinefunction(method):
+        @wraps(method)
+        async def wrapper(self, *arguments, **keywords):
+            token = query_caller.set(resolve(self, sys._getframe(1)))
+            try:
+                return await method(self, *arguments, **keywords)
+            finally:
+                query_caller.reset(token)
+    else:
+        @wraps(method)
+        def wrapper(self, *arguments, **keywords):
+            token = query_caller.set(resolve(self, sys._getframe(1)))
+            try:
+                return method(self, *arguments, **keywords)
+            finally:
+                query_caller.reset(token)
+    return wrapper
+
+
+def traced_steps(iterator, caller: str):
+    # Each step may run in another thread or context, so the caller is set around every step
+    try:
+        while True:
+            token = query_caller.set(caller)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                query_caller.reset(token)
+            yield item
+    finally:
+        token = query_caller.set(caller)
+        try:
+            iterator.close()
+        finally:
+            query_caller.reset(token)
+
+
+async def async_traced_steps(iterator, caller: str):
+    try:
+        while True:
+            token = query_caller.set(caller)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                query_caller.reset(token)
+            yield item
+    finally:
+        token = query_caller.set(caller)
+        try:
+            await iterator.aclose()
+        finally:
+            query_caller.reset(token)
 
 
 class BasicRepository:
@@ -11,71 +156,240 @@ class BasicRepository:
         self._table_name = table_name
         self._log = log
     
+    @traced
     def save(self, data_dict: dict):
-        self._log.debug("Data dict: %s", data_dict)
+        query_log.debug("Data dict: %s", data_dict)
         if DatabaseColumn.ID in data_dict.keys() and self.exists_by_attribute({DatabaseColumn.ID: data_dict[DatabaseColumn.ID]}):
-            entity_id = data_dict[DatabaseColumn.ID]
-            query = self._generate_update_query(data_dict.keys())
-            argument = [x for x in data_dict.values() if x != entity_id]
-            argument.append(entity_id)
-            self._log.debug('Executing update query: [%s], arguments: %s', query, argument)
+            query, argument = self._prepare_update(data_dict)
         else:
-            if DatabaseColumn.ID not in data_dict.keys():
-                data_dict[DatabaseColumn.ID] = str(uuid4())
-            query = self._generate_save_query(data_dict.keys())
-            argument = list(data_dict.values())
-            self._log.debug('Executing insert query: [%s], arguments: %s', query, argument)
-        self._conn.execute(query, argument)
+            query, argument = self._prepare_insert(data_dict)
+        self._execute(query, argument)
         return data_dict
     
+    @traced
     def save_all(self, data_list: list):
-        saved_data = []
+        # New rows are grouped by column set and written with one executemany per group
+        inserts = {}
         for data in data_list:
-            saved_data.append(self.save(data))
-        return saved_data
+            if DatabaseColumn.ID in data.keys():
+                self.save(data)
+            else:
+                data[DatabaseColumn.ID] = str(uuid4())
+                inserts.setdefault(tuple(data.keys()), []).append(list(data.values()))
+        for keys, arguments in inserts.items():
+            query = self._generate_save_query(keys)
+            query_log.debug('Executing bulk insert query: [%s], rows: %s', query, len(arguments))
+            self._executemany(query, arguments)
+        return data_list
 
+    @traced
     def find_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND, wild_card = None):
-        query = f"SELECT * FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)} {'' if wild_card is None else wild_card}"
-        argument = list(pairs.values()) 
-        self._log.debug('Executing select query: [%s], arguments: %s', query, argument)
-        data = self._conn.execute(query, argument).fetchone()
+        query, argument = self._prepare_find(pairs, separator, wild_card)
+        data = self._fetchone(query, argument)
         return None if data is None else dict(data)
     
+    @traced
     def exists_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
-        query = f"SELECT count(*) > 0 FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}"
-        argument = list(pairs.values())
-        self._log.debug('Executing exists query: [%s], arguments: %s', query, argument)
-        entity_exists = self._conn.execute(query, argument).fetchone()[0]
+        query, argument = self._prepare_exists(pairs, separator)
+        entity_exists = self._fetchone(query, argument)[0]
         return True if entity_exists == 1 else False
 
+    @traced
     def delete_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
-        query = f"DELETE FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}"
-        argument = list(pairs.values())
-        self._log.debug('Executing delete query: [%s], arguments: %s', query, argument)
-        self._conn.execute(query, argument)
+        query, argument = self._prepare_delete(pairs, separator)
+        self._execute(query, argument)
 
+    @traced
     def find_all_by_attribute(self, pairs: dict, separator: str = DatabaseColumn.AND):
-        query = f"SELECT * FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}"
-        argument = list(pairs.values())
-        self._log.debug('Executing find query: [%s], arguments: %s', query, argument)
+        query, argument = self._prepare_find_all(pairs, separator)
+        return [dict(x) for x in self._fetchall(query, argument)]
+
+    @traced
+    def iter_by_attribute(self, pairs: dict = {}, separator: str = DatabaseColumn.AND, batch_size: int = Batch.FETCH_SIZE):
+        query, argument = self._prepare_find_all(pairs, separator)
+        yield from self._iter_query(query, argument, batch_size)
+
+    @traced
+    def iter_page(self, pairs: dict, order_by: tuple, after: tuple = None, limit: int = None, condition: str = "", batch_size: int = Batch.FETCH_SIZE, columns: str = "*"):
+        query, argument = self._prepare_page(pairs, order_by, after, limit, condition, columns)
+        yield from self._iter_query(query, argument, batch_size)
+
+    def _iter_query(self, query: str, argument: list, batch_size: int):
+        # Only time spent inside SQLite is recorded, not the time the consumer holds each batch
+        start = perf_counter()
+        cursor = self._records_cursor()
+        cursor.execute(query, argument)
+        elapsed = perf_counter() - start
+        make = row_factory(self._table_name, cursor.description)
+        count = 0
+        try:
+            while True:
+                start = perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                elapsed += perf_counter() - start
+                if len(rows) == 0:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield make(row)
+        finally:
+            cursor.close()
+            self._record(query, elapsed, count)
+
+    def _records_cursor(self):
+        # Plain tuples are turned straight into records, skipping sqlite3.Row and a dict per row
+        cursor = self._conn.cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def _execute(self, query: str, argument: list):
+        start = perf_counter()
         cursor = self._conn.execute(query, argument)
-        return [dict(x) for x in cursor.fetchall()]
+        self._record(query, perf_counter() - start, cursor.rowcount)
+        return cursor
+
+    def _executemany(self, query: str, arguments: list):
+        start = perf_counter()
+        cursor = self._conn.executemany(query, arguments)
+        self._record(query, perf_counter() - start, cursor.rowcount)
+        return cursor
 
+    def _fetchone(self, query: str, argument: list):
+        start = perf_counter()
+        row = self._conn.execute(query, argument).fetchone()
+        self._record(query, perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def _fetchall(self, query: str, argument: list):
+        start = perf_counter()
+        rows = self._conn.execute(query, argument).fetchall()
+        self._record(query, perf_counter() - start, len(rows))
+        return rows
+
+    def _record(self, query: str, duration: float, rows: int):
+        for hook in query_hooks:
+            hook(query, duration, rows)
+
+    @traced
     def count_by_attribute(self, pairs: dict = {}, separator: str = DatabaseColumn.AND):
-        query = f"SELECT COUNT(*) FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}"
+        query, argument = self._prepare_count(pairs, separator)
+        return self._fetchone(query, argument)[0]
+
+    @traced
+    def table_version(self):
+        # (table_name, version, modified_on) as kept by the version triggers, or None for an untracked table
+        row = self._fetchone(self._prepare_table_version(), [self._table_name])
+        return None if row is None else tuple(row)
+
+    @traced
+    def find_all_in(self, columns: tuple, values: list):
+        data = []
+        for query, argument in self._prepare_find_all_in(columns, values):
+            data.extend([dict(x) for x in self._fetchall(query, argument)])
+        return data
+
+    @traced
+    def compare_and_set(self, entity_id: str, expected: dict, changes: dict):
+        query, argument = self._prepare_compare_and_set(entity_id, expected, changes)
+        return self._execute(query, argument).rowcount == 1
+
+    def _prepare_compare_and_set(self, entity_id: str, expected: dict, changes: dict):
+        query = self._statement(("compare_and_set", tuple(changes.keys()), tuple(expected.keys())), lambda: f"UPDATE {self._table_name} SET {', '.join([f'{key} = ?' for key in changes.keys()])} WHERE {DatabaseColumn.ID} = ? AND {' AND '.join([f'{key} = ?' for key in expected.keys()])}")
+        argument = list(changes.values()) + [entity_id] + list(expected.values())
+        query_log.debug('Executing compare and set query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_find_all_in(self, columns: tuple, values: list, select: str = "t.*", condition: str = "", group_by: str = ""):
+        # Joining against a VALUES list lets SQLite probe the index once per key instead of scanning
+        row = f"({', '.join(['?' for _ in columns])})"
+        join = " AND ".join([f"t.{column} = k.column{index + 1}" for index, column in enumerate(columns)])
+        chunk_size = max(1, Batch.MAX_VARIABLES // len(columns))
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            build = lambda: f"SELECT {select} FROM (VALUES {', '.join([row for _ in chunk])}) AS k JOIN {self._table_name} t ON {join} {condition} {group_by}"
+            # Large key lists are built once per bulk call, so only the small lookups are worth caching
+            query = build() if len(chunk) > Cache.MAX_CACHED_KEYS else self._statement(("find_all_in", tuple(columns), len(chunk), select, condition, group_by), build)
+            argument = [x for value in chunk for x in value]
+            query_log.debug('Executing find in query on %s, keys: %s', self._table_name, len(chunk))
+            yield query, argument
+
+    def _prepare_update(self, data_dict: dict):
+        entity_id = data_dict[DatabaseColumn.ID]
+        query = self._generate_update_query(data_dict.keys())
+        argument = [x for x in data_dict.values() if x != entity_id]
+        argument.append(entity_id)
+        query_log.debug('Executing update query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_insert(self, data_dict: dict):
+        if DatabaseColumn.ID not in data_dict.keys():
+            data_dict[DatabaseColumn.ID] = str(uuid4())
+        query = self._generate_save_query(data_dict.keys())
+        argument = list(data_dict.values())
+        query_log.debug('Executing insert query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_find(self, pairs: dict, separator: str, wild_card):
+        query = self._statement(("find", tuple(pairs.keys()), separator, wild_card), lambda: f"SELECT * FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)} {'' if wild_card is None else wild_card}")
+        argument = list(pairs.values()) 
+        query_log.debug('Executing select query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_exists(self, pairs: dict, separator: str):
+        query = self._statement(("exists", tuple(pairs.keys()), separator), lambda: f"SELECT count(*) > 0 FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}")
         argument = list(pairs.values())
-        self._log.debug('Executing count query: [%s], arguments: %s', query, argument)
-        print(query)
-        return self._conn.execute(query, argument).fetchone()[0]
+        query_log.debug('Executing exists query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_delete(self, pairs: dict, separator: str):
+        query = self._statement(("delete", tuple(pairs.keys()), separator), lambda: f"DELETE FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}")
+        argument = list(pairs.values())
+        query_log.debug('Executing delete query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_find_all(self, pairs: dict, separator: str):
+        query = self._statement(("find_all", tuple(pairs.keys()), separator), lambda: f"SELECT * FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}")
+        argument = list(pairs.values())
+        query_log.debug('Executing find query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_page(self, pairs: dict, order_by: tuple, after: tuple, limit: int, condition: str, columns: str = "*"):
+        # Keyset pagination: the next page starts strictly after the sort key of the last row returned
+        query = self._statement(("page", tuple(pairs.keys()), tuple(order_by), after is not None, limit is not None, condition, columns), lambda: self._generate_page_query(pairs.keys(), order_by, after is not None, limit is not None, condition, columns))
+        argument = list(pairs.values()) + list(after or []) + ([] if limit is None else [limit])
+        query_log.debug('Executing page query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_count(self, pairs: dict, separator: str):
+        query = self._statement(("count", tuple(pairs.keys()), separator), lambda: f"SELECT COUNT(*) FROM {self._table_name} {self._generate_where_clause(pairs.keys(), separator)}")
+        argument = list(pairs.values())
+        query_log.debug('Executing count query: [%s], arguments: %s', query, argument)
+        return query, argument
     
+    def _prepare_table_version(self):
+        return self._statement(("table_version",), lambda: f"SELECT table_name, version, modified_on FROM {HttpCache.VERSION_TABLE} WHERE table_name = ?")
+
+    def _statement(self, key: tuple, build):
+        # SQL only depends on the table and the column names, so it is built once per shape
+        return statement_cache.get((self._table_name,) + key, build)
+
     def _generate_where_clause(self, keys: list, separator: str = DatabaseColumn.AND):
         return "" if len(keys) == 0 else f"WHERE {f' {separator} '.join([f'{key} = ?' for key in keys])}"
 
+    def _generate_page_query(self, keys: list, order_by: tuple, has_after: bool, has_limit: bool, condition: str, columns: str = "*"):
+        clauses = [f"{key} = ?" for key in keys]
+        if condition != "":
+            clauses.append(condition)
+        if has_after:
+            clauses.append(f"({', '.join(order_by)}) > ({', '.join(['?' for _ in order_by])})")
+        where_clause = "" if len(clauses) == 0 else f"WHERE {' AND '.join(clauses)}"
+        return f"SELECT {columns} FROM {self._table_name} {where_clause} ORDER BY {', '.join(order_by)}{' LIMIT ?' if has_limit else ''}"
+
     def _generate_save_query(self, keys: list):
-        return f"INSERT INTO {self._table_name} ({', '.join(keys)}) VALUES ({', '.join('?' for _ in range(len(keys)))})"
+        return self._statement(("insert", tuple(keys)), lambda: f"INSERT INTO {self._table_name} ({', '.join(keys)}) VALUES ({', '.join('?' for _ in range(len(keys)))})")
     
     def _generate_update_query(self, keys: list):
-        return f"UPDATE {self._table_name} SET {', '.join([f'{key} = ?' for key in keys if key != DatabaseColumn.ID])} WHERE {DatabaseColumn.ID} = ?"
+        return self._statement(("update", tuple(keys)), lambda: f"UPDATE {self._table_name} SET {', '.join([f'{key} = ?' for key in keys if key != DatabaseColumn.ID])} WHERE {DatabaseColumn.ID} = ?")
     
     
 class ClassRepository (BasicRepository):
@@ -83,9 +397,105 @@ class ClassRepository (BasicRepository):
     def __init__(self, conn: Connection, table_name: str, log: Logger):
         super().__init__(conn, table_name, log)
 
-    def findAllAvailableClasses(self):
-        cursor = self._conn.execute(f"SELECT * FROM {self._table_name} where {DatabaseColumn.CURRENT_ENROLLMENT} <= {DatabaseColumn.MAX_ENROLLMENT}")
-        return [dict(x) for x in cursor.fetchall()]
+    @traced
+    def findAvailableClasses(self, enrollment_table_name: str, class_ids: list = None):
+        # Open classes with seats remaining and waiting list depth; only those among class_ids if given
+        if class_ids is None:
+            return [dict(x) for x in self._fetchall(self._prepare_available_classes(enrollment_table_name), [])]
+        data = []
+        for query, argument in self._prepare_available_classes_in(enrollment_table_name, class_ids):
+            data.extend([dict(x) for x in self._fetchall(query, argument)])
+        return data
+
+    @traced
+    def latestChange(self):
+        # (seq, changed_on) of the newest change log entry, or None while the log is empty
+        row = self._fetchone(self._prepare_latest_change(), [])
+        return None if row is None else tuple(row)
+
+    @traced
+    def firstChange(self):
+        return self._fetchone(self._prepare_first_change(), [])[0]
+
+    @traced
+    def findChangedClasses(self, after: int, until: int):
+        return [x[0] for x in self._fetchall(self._prepare_changed_classes(), [after, until])]
+
+    @traced
+    def iterAvailableClasses(self, enrollment_table_name: str, pairs: dict, after: tuple = None, limit: int = None):
+        # The same columns as findAvailableClasses, so a filtered page reads like the unfiltered list
+        return self.iter_page(pairs, CLASS_KEY_COLUMNS, after, limit, self._available_condition(), columns=self._available_summary(enrollment_table_name, f"{self._table_name}."))
+
+    @traced
+    def compareEnrollment(self, class_data: dict):
+        query, argument = self._prepare_compare_enrollment(class_data)
+        return self._execute(query, argument).rowcount == 1
+
+    @traced
+    def compareEnrollments(self, classes: list):
+        query, arguments = self._prepare_compare_enrollments(classes)
+        return self._executemany(query, arguments).rowcount == len(arguments)
+
+    @traced
+    def findEnrollmentDrift(self, enrollment_table_name: str):
+        return [tuple(x) for x in self._fetchall(self._prepare_enrollment_drift(enrollment_table_name), [])]
+
+    @traced
+    def reconcileEnrollments(self, enrollment_table_name: str, class_ids: list):
+        query, arguments = self._prepare_reconcile_enrollments(enrollment_table_name, class_ids)
+        return self._executemany(query, arguments).rowcount
+
+    def _prepare_compare_enrollment(self, class_data: dict):
+        query, arguments = self._prepare_compare_enrollments([class_data])
+        return query, arguments[0]
+
+    def _prepare_compare_enrollments(self, classes: list):
+        # Only succeeds if nobody changed the seat count or frozen flag since class_data was read.
+        # The no-op write takes the write lock; the enrollment triggers change the count itself.
+        query = self._statement(("compare_enrollment",), lambda: f"UPDATE {self._table_name} SET {DatabaseColumn.CURRENT_ENROLLMENT} = {DatabaseColumn.CURRENT_ENROLLMENT} WHERE {DatabaseColumn.ID} = ? AND {DatabaseColumn.CURRENT_ENROLLMENT} = ? AND {DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN} = ?")
+        arguments = [[x[DatabaseColumn.ID], x[DatabaseColumn.CURRENT_ENROLLMENT], x[DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN]] for x in classes]
+        query_log.debug('Executing compare enrollment query: [%s], arguments: %s', query, arguments)
+        return query, arguments
+
+    def _prepare_enrollment_drift(self, enrollment_table_name: str):
+        # One grouped pass over the enrollment_class_status index, returning (id, stored, actual) for drifted classes
+        return self._statement(("enrollment_drift", enrollment_table_name), lambda: f"SELECT c.{DatabaseColumn.ID}, c.{DatabaseColumn.CURRENT_ENROLLMENT}, COUNT(e.{DatabaseColumn.ID}) FROM {self._table_name} c LEFT JOIN {enrollment_table_name} e ON e.{DatabaseColumn.CLASS_ID} = c.{DatabaseColumn.ID} AND e.{DatabaseColumn.DROPPED} = false GROUP BY c.{DatabaseColumn.ID} HAVING c.{DatabaseColumn.CURRENT_ENROLLMENT} != COUNT(e.{DatabaseColumn.ID})")
+
+    def _prepare_reconcile_enrollments(self, enrollment_table_name: str, class_ids: list):
+        # The count is taken inside the write, so enrollments committed since the drift was found are included
+        query = self._statement(("reconcile_enrollments", enrollment_table_name), lambda: f"UPDATE {self._table_name} SET {DatabaseColumn.CURRENT_ENROLLMENT} = (SELECT COUNT(*) FROM {enrollment_table_name} WHERE {DatabaseColumn.CLASS_ID} = {self._table_name}.{DatabaseColumn.ID} AND {DatabaseColumn.DROPPED} = false) WHERE {DatabaseColumn.ID} = ?")
+        arguments = [[x] for x in class_ids]
+        query_log.debug('Executing reconcile enrollments query: [%s], arguments: %s', query, arguments)
+        return query, arguments
+
+    def _prepare_available_classes(self, enrollment_table_name: str):
+        # Written as a difference so that the class_open_seats expression index applies
+        return self._statement(("available_classes", enrollment_table_name), lambda: f"SELECT {self._available_summary(enrollment_table_name)} FROM {self._table_name} t WHERE {self._available_condition('t.')}")
+
+    def _prepare_available_classes_in(self, enrollment_table_name: str, class_ids: list):
+        for start in range(0, len(class_ids), Batch.MAX_VARIABLES):
+            chunk = class_ids[start:start + Batch.MAX_VARIABLES]
+            build = lambda: f"SELECT {self._available_summary(enrollment_table_name)} FROM {self._table_name} t WHERE t.{DatabaseColumn.ID} IN ({', '.join(['?' for _ in chunk])}) AND {self._available_condition('t.')}"
+            query = build() if len(chunk) > Cache.MAX_CACHED_KEYS else self._statement(("available_classes_in", enrollment_table_name, len(chunk)), build)
+            yield query, chunk
+
+    def _available_summary(self, enrollment_table_name: str, prefix: str = "t."):
+        # The depth subquery is answered from the partial waiting list index alone
+        return (f"{prefix}*, MAX({prefix}{DatabaseColumn.MAX_ENROLLMENT} - {prefix}{DatabaseColumn.CURRENT_ENROLLMENT}, 0) AS {DatabaseColumn.SEATS_REMAINING}, "
+                f"(SELECT COUNT(*) FROM {enrollment_table_name} e WHERE e.{DatabaseColumn.CLASS_ID} = {prefix}{DatabaseColumn.ID} AND e.{DatabaseColumn.DROPPED} = false AND e.{DatabaseColumn.WAITING_LIST} = true) AS {DatabaseColumn.WAITING_LIST_DEPTH}")
+
+    def _prepare_latest_change(self):
+        # Looked up by rowid rather than ORDER BY ... LIMIT 1, which the planner reports as a scan
+        return self._statement(("latest_change",), lambda: f"SELECT seq, changed_on FROM {ChangeLog.TABLE} WHERE seq = (SELECT MAX(seq) FROM {ChangeLog.TABLE})")
+
+    def _prepare_first_change(self):
+        return self._statement(("first_change",), lambda: f"SELECT MIN(seq) FROM {ChangeLog.TABLE}")
+
+    def _prepare_changed_classes(self):
+        return self._statement(("changed_classes",), lambda: f"SELECT DISTINCT class_id FROM {ChangeLog.TABLE} WHERE seq > ? AND seq <= ? AND class_id IS NOT NULL")
+
+    def _available_condition(self, prefix: str = ""):
+        return f"{prefix}{DatabaseColumn.CURRENT_ENROLLMENT} - {prefix}{DatabaseColumn.MAX_ENROLLMENT} <= 0"
         
 
 class EnrollmentRepository (BasicRepository):
@@ -93,14 +503,49 @@ class EnrollmentRepository (BasicRepository):
     def __init__(self, conn: Connection, table_name: str, log: Logger):
         super().__init__(conn, table_name, log)
 
+    @traced
     def waitingListPosition(self, class_id: str, student_id: str):
-        sub_query = f"SELECT student_id, ROW_NUMBER() OVER (ORDER BY {DatabaseColumn.ENROLLED_ON}) pos FROM {self._table_name} WHERE {DatabaseColumn.CLASS_ID} = ? AND {DatabaseColumn.DROPPED} = false AND {DatabaseColumn.WAITING_LIST} = true"
-        query = f"SELECT pos from ({sub_query}) where {DatabaseColumn.STUDENT_ID} = ?"
-        argument = [class_id, student_id]
-        self._log.debug('Executing row number query: [%s], arguments: %s', query, argument)
-        data = self._conn.execute(query, argument).fetchone()
+        query, argument = self._prepare_waiting_list_position(class_id, student_id)
+        data = self._fetchone(query, argument)
         return None if data is None else data[0]
 
+    @traced
+    def waitingListPositions(self, class_id: str):
+        query, argument = self._prepare_waiting_list_positions(class_id)
+        positions = {}
+        for student_id, position in self._fetchall(query, argument):
+            positions.setdefault(student_id, position)
+        return positions
+
+    @traced
+    def countWaitingListByStudent(self, student_ids: list):
+        counts = {}
+        for query, argument in self._prepare_count_waiting_list_by_student(student_ids):
+            counts.update({x[0]: x[1] for x in self._fetchall(query, argument)})
+        return counts
+
+    def _prepare_count_waiting_list_by_student(self, student_ids: list):
+        return self._prepare_find_all_in((DatabaseColumn.STUDENT_ID,), [(x,) for x in student_ids], f"t.{DatabaseColumn.STUDENT_ID}, COUNT(*)", f"WHERE t.{DatabaseColumn.WAITING_LIST} = true", f"GROUP BY t.{DatabaseColumn.STUDENT_ID}")
+
+    def _prepare_waiting_list_position(self, class_id: str, student_id: str):
+        query = self._statement(("waiting_list_position",), self._generate_waiting_list_position_query)
+        argument = [class_id, student_id]
+        query_log.debug('Executing row number query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _prepare_waiting_list_positions(self, class_id: str):
+        query = self._statement(("waiting_list_positions",), self._generate_waiting_list_positions_query)
+        argument = [class_id]
+        query_log.debug('Executing row number query: [%s], arguments: %s', query, argument)
+        return query, argument
+
+    def _generate_waiting_list_position_query(self):
+        return f"SELECT pos from ({self._generate_waiting_list_positions_query()}) where {DatabaseColumn.STUDENT_ID} = ?"
+
+    def _generate_waiting_list_positions_query(self):
+        order_by = ", ".join(ENROLLMENT_ORDER)
+        return f"SELECT student_id, ROW_NUMBER() OVER (ORDER BY {order_by}) pos FROM {self._table_name} WHERE {DatabaseColumn.CLASS_ID} = ? AND {DatabaseColumn.DROPPED} = false AND {DatabaseColumn.WAITING_LIST} = true ORDER BY pos"
+
 
 class ProfileRepository (BasicRepository):
 
@@ -1,14 +1,74 @@
 #!/bin/python3
 
 import sqlite3
+from config import DatabaseConfig
+from records import RECORD_TYPES
+from constant import Batch, ChangeLog, Events, HttpCache, Idempotency, WriteJob
 
 
-def create_database():
+def version_trigger(table_name: str, event: str, when: str = ""):
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_version_{event.lower()} AFTER {event} ON {table_name} {when}
+        BEGIN
+            UPDATE {HttpCache.VERSION_TABLE} SET version = version + 1, modified_on = CURRENT_TIMESTAMP WHERE table_name = '{table_name}';
+        END
+        '''
 
-    conn = sqlite3.connect("database.db")  
-    cursor = conn.cursor()
 
-    cursor.execute('''
+
+def change_trigger(table_name: str, event: str, class_column: str, when: str = "", details: dict = {}):
+    row = "OLD" if event == "DELETE" else "NEW"
+    class_id = "NULL" if class_column is None else f"{row}.{class_column}"
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_change_{event.lower()} AFTER {event} ON {table_name} {when}
+        BEGIN
+            INSERT INTO {ChangeLog.TABLE} (table_name, operation, row_id, class_id, changed_on{''.join(f', {x}' for x in details)}) VALUES ('{table_name}', '{event.lower()}', {row}.id, {class_id}, CURRENT_TIMESTAMP{''.join(f', {x}' for x in details.values())});
+        END
+        '''
+
+
+def changed_row(table_name: str):
+    # Has to list every column of the table, so a migration adding one recreates the update triggers
+    columns = RECORD_TYPES[table_name]._fields
+    return f"WHEN ({', '.join(f'OLD.{x}' for x in columns)}) IS NOT ({', '.join(f'NEW.{x}' for x in columns)})"
+
+
+def unique_index(name: str, table_name: str, columns: tuple):
+    # Rows written before the index existed may repeat a key. They are listed rather than left to fail on the
+    # first one, and have to be merged or renumbered by hand: enrollments may point at any of them.
+    def create(conn: sqlite3.Connection):
+        key = ", ".join(columns)
+        duplicates = conn.execute(f"SELECT {key} FROM {table_name} GROUP BY {key} HAVING COUNT(*) > 1 LIMIT {Batch.MAX_REPORTED_DUPLICATES}").fetchall()
+        if len(duplicates) != 0:
+            raise sqlite3.IntegrityError(f"Cannot create {name}, {table_name} has more than one row for ({key}) in {', '.join(str(tuple(x)) for x in duplicates)}")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table_name} ({key})")
+    return create
+
+
+# Counted instead of read from class.current_enrollment, which the seat count triggers may not have updated yet
+SEATS_TAKEN = "(SELECT COUNT(*) FROM enrollment WHERE class_id = NEW.class_id AND dropped = false)"
+
+# What the change dispatcher needs to publish an event for a change, by (table, operation)
+EVENT_DETAILS = {
+    ("enrollment", "INSERT"): {
+        "event": f"CASE WHEN NEW.dropped THEN NULL WHEN NEW.waiting_list THEN '{Events.WAITING_LIST}' ELSE '{Events.ENROLLED}' END",
+        "student_id": "NEW.student_id",
+        "current_enrollment": SEATS_TAKEN,
+    },
+    ("enrollment", "UPDATE"): {
+        "event": f"CASE WHEN NEW.dropped AND NOT OLD.dropped THEN '{Events.DROPPED}' WHEN OLD.waiting_list AND NOT NEW.waiting_list AND NOT NEW.dropped THEN '{Events.PROMOTED}' END",
+        "student_id": "NEW.student_id",
+        "current_enrollment": SEATS_TAKEN,
+    },
+    ("class", "DELETE"): {
+        "event": f"'{Events.CLASS_DELETED}'",
+    },
+}
+
+
+MIGRATIONS = [
+    (1, [
+        '''
         CREATE TABLE IF NOT EXISTS student (
             id VARCHAR(36) NOT NULL,
             first_name VARCHAR(50) NOT NULL,
@@ -16,9 +76,8 @@ def create_database():
             age TINYINT NOT NULL,
             PRIMARY KEY (id)
         )
-    ''')
-
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS instructor (
             id VARCHAR(36) NOT NULL,
             first_name VARCHAR(50) NOT NULL,
@@ -26,9 +85,8 @@ def create_database():
             age TINYINT NOT NULL,
             PRIMARY KEY (id)
         )
-    ''')
-
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS class (
             id VARCHAR(36) NOT NULL,
             instructor_id VARCHAR(36) NOT NULL,
@@ -42,9 +100,8 @@ def create_database():
             PRIMARY KEY (id),
             FOREIGN KEY (instructor_id) REFERENCES instructor(id)
         )
-    ''')
-    
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS enrollment (
             id VARCHAR(36) NOT NULL,
             student_id VARCHAR(36) NOT NULL,
@@ -56,9 +113,183 @@ def create_database():
             FOREIGN KEY (class_id) REFERENCES class(id),
             FOREIGN KEY (student_id) REFERENCES student(id)
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+        ''',
+    ]),
+    (2, [
+        unique_index("class_natural_key", "class", ("department", "course_code", "section_number")),
+        "CREATE INDEX IF NOT EXISTS class_open_seats ON class (current_enrollment - max_enrollment)",
+        "CREATE INDEX IF NOT EXISTS enrollment_class_status ON enrollment (class_id, dropped, waiting_list, enrolled_on)",
+        "CREATE INDEX IF NOT EXISTS enrollment_student_class ON enrollment (student_id, class_id, dropped)",
+        "CREATE INDEX IF NOT EXISTS enrollment_student_waiting_list ON enrollment (student_id, waiting_list)",
+        # Trailing dropped/waiting_list columns make this partial index covering for the waiting list window query
+        "CREATE INDEX IF NOT EXISTS enrollment_waiting_list ON enrollment (class_id, enrolled_on, student_id, dropped, waiting_list) WHERE dropped = false AND waiting_list = true",
+    ]),
+    (3, [
+        # Waiting list positions are numbered by (enrolled_on, id), so ties no longer depend on scan order
+        "DROP INDEX IF EXISTS enrollment_waiting_list",
+        "CREATE INDEX IF NOT EXISTS enrollment_waiting_list_order ON enrollment (class_id, enrolled_on, id, student_id, dropped, waiting_list) WHERE dropped = false AND waiting_list = true",
+    ]),
+    (4, [
+        # current_enrollment counts the class's enrollments that are not dropped, seated or waiting
+        '''
+        CREATE TRIGGER IF NOT EXISTS enrollment_count_insert AFTER INSERT ON enrollment WHEN NEW.dropped = false
+        BEGIN
+            UPDATE class SET current_enrollment = current_enrollment + 1 WHERE id = NEW.class_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS enrollment_count_delete AFTER DELETE ON enrollment WHEN OLD.dropped = false
+        BEGIN
+            UPDATE class SET current_enrollment = current_enrollment - 1 WHERE id = OLD.class_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS enrollment_count_update AFTER UPDATE OF class_id, dropped ON enrollment
+        BEGIN
+            UPDATE class SET current_enrollment = current_enrollment - 1 WHERE id = OLD.class_id AND OLD.dropped = false;
+            UPDATE class SET current_enrollment = current_enrollment + 1 WHERE id = NEW.class_id AND NEW.dropped = false;
+        END
+        ''',
+        "UPDATE class SET current_enrollment = (SELECT COUNT(*) FROM enrollment WHERE class_id = class.id AND dropped = false)",
+    ]),
+    (5, [
+        # A write counter per table, bumped by triggers so imports, seat count triggers and other workers are all seen
+        f'''
+        CREATE TABLE IF NOT EXISTS {HttpCache.VERSION_TABLE} (
+            table_name VARCHAR(36) NOT NULL,
+            version INTEGER NOT NULL,
+            modified_on DATETIME NOT NULL,
+            PRIMARY KEY (table_name)
+        )
+        ''',
+    ] + [f"INSERT OR IGNORE INTO {HttpCache.VERSION_TABLE} VALUES ('{x}', 0, CURRENT_TIMESTAMP)" for x in HttpCache.VERSIONED_TABLES] + [
+        version_trigger(x, event) for x in HttpCache.VERSIONED_TABLES for event in ("INSERT", "UPDATE", "DELETE")
+    ]),
+    (6, [
+        # status_code is NULL while the first request holds the key; expires_on is a unix time shared by all workers
+        f'''
+        CREATE TABLE IF NOT EXISTS {Idempotency.TABLE} (
+            key VARCHAR({Idempotency.MAX_KEY_LENGTH}) NOT NULL,
+            fingerprint VARCHAR(64) NOT NULL,
+            status_code INTEGER,
+            media_type VARCHAR(100),
+            body BLOB,
+            expires_on REAL NOT NULL,
+            PRIMARY KEY (key)
+        )
+        ''',
+        f"CREATE INDEX IF NOT EXISTS idempotency_key_expiry ON {Idempotency.TABLE} (expires_on)",
+    ]),
+    (7, [
+        # Change data capture for readers that tail by seq instead of rescanning the tables
+        f'''
+        CREATE TABLE IF NOT EXISTS {ChangeLog.TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name VARCHAR(36) NOT NULL,
+            operation VARCHAR(6) NOT NULL,
+            row_id VARCHAR(36) NOT NULL,
+            class_id VARCHAR(36),
+            changed_on DATETIME NOT NULL
+        )
+        ''',
+        # Keeps the log bounded without a writer having to prune it
+        f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_retention AFTER INSERT ON {ChangeLog.TABLE} WHEN NEW.seq % {ChangeLog.PRUNE_EVERY} = 0
+        BEGIN
+            DELETE FROM {ChangeLog.TABLE} WHERE seq <= NEW.seq - {ChangeLog.RETENTION};
+        END
+        ''',
+    ] + [
+        change_trigger(x, event, class_column) for x, class_column in ChangeLog.CLASS_COLUMNS.items() for event in ("INSERT", "UPDATE", "DELETE")
+    ]),
+    (8, [
+        # Write commands queued by any worker for the single elected writer; id doubles as the ticket
+        f'''
+        CREATE TABLE IF NOT EXISTS {WriteJob.TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service VARCHAR(36) NOT NULL,
+            method VARCHAR(36) NOT NULL,
+            arguments TEXT NOT NULL,
+            status VARCHAR(8) NOT NULL,
+            status_code INTEGER,
+            result TEXT,
+            submitted_on REAL NOT NULL,
+            completed_on REAL
+        )
+        ''',
+        f"CREATE INDEX IF NOT EXISTS write_job_queued ON {WriteJob.TABLE} (id) WHERE status = '{WriteJob.QUEUED}'",
+        f"CREATE INDEX IF NOT EXISTS write_job_completed ON {WriteJob.TABLE} (completed_on) WHERE completed_on IS NOT NULL",
+        f'''
+        CREATE TABLE IF NOT EXISTS {WriteJob.LEASE_TABLE} (
+            name VARCHAR(36) NOT NULL,
+            owner VARCHAR(100) NOT NULL,
+            expires_on REAL NOT NULL,
+            PRIMARY KEY (name)
+        )
+        ''',
+    ]),
+    (9, [
+        # An update that changes nothing, like the compare-and-set that locks a class row, is not a change
+        f"DROP TRIGGER IF EXISTS {x}_version_update" for x in HttpCache.VERSIONED_TABLES
+    ] + [
+        version_trigger(x, "UPDATE", changed_row(x)) for x in HttpCache.VERSIONED_TABLES
+    ] + [
+        f"DROP TRIGGER IF EXISTS {x}_change_update" for x in ChangeLog.CLASS_COLUMNS
+    ] + [
+        change_trigger(x, "UPDATE", class_column, changed_row(x)) for x, class_column in ChangeLog.CLASS_COLUMNS.items()
+    ]),
+    (10, [
+        # Events are published from the change log, so every worker sees the writes of every other one
+        f"ALTER TABLE {ChangeLog.TABLE} ADD COLUMN event VARCHAR(12)",
+        f"ALTER TABLE {ChangeLog.TABLE} ADD COLUMN student_id VARCHAR(36)",
+        f"ALTER TABLE {ChangeLog.TABLE} ADD COLUMN current_enrollment INTEGER",
+    ] + [
+        f"DROP TRIGGER IF EXISTS {table_name}_change_{event.lower()}" for table_name, event in EVENT_DETAILS
+    ] + [
+        change_trigger(table_name, event, ChangeLog.CLASS_COLUMNS[table_name], changed_row(table_name) if event == "UPDATE" else "", details)
+        for (table_name, event), details in EVENT_DETAILS.items()
+    ]),
+]
+
+
+def schema_version(conn: sqlite3.Connection):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection):
+    applied = []
+    for version, statements in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        # BEGIN IMMEDIATE so that concurrently starting workers apply each migration once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version > schema_version(conn):
+                for statement in statements:
+                    # A callable is a step that has to look at the data first
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+                applied.append(version)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return applied
+
+
+def create_database(config: DatabaseConfig = None):
+    config = DatabaseConfig.from_environment() if config is None else config
+    conn = sqlite3.connect(config.database, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA journal_mode = {config.journal_mode}")
+        config.apply_pragmas(conn)
+        return migrate(conn)
+    finally:
+        conn.close()
+
 
-create_database()
+if __name__ == "__main__":
+    create_database()
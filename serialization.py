@@ -0,0 +1,40 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger("serialization")
+
+STDLIB_ENCODER = json.JSONEncoder(default=str)
+
+
+def stdlib_dumps(content):
+    return STDLIB_ENCODER.encode(content).encode()
+
+
+def orjson_dumps(content):
+    # datetimes are encoded natively as RFC 3339; anything else orjson does not know falls back to str
+    return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+CODECS = {"stdlib": stdlib_dumps}
+if orjson is not None:
+    CODECS["orjson"] = orjson_dumps
+
+codec = "stdlib"
+
+
+def use_codec(name: str):
+    global codec
+    if name not in CODECS:
+        log.warning("JSON encoder %s is not available, using stdlib", name)
+        name = "stdlib"
+    codec = name
+    return codec
+
+
+def dumps(content):
+    return CODECS[codec](content)
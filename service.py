@@ -1,149 +1,472 @@
-from repository import ClassRepository, EnrollmentRepository, ProfileRepository
-from util import DatabaseColumn, Field, get_find_class_dict, is_blank, valid_age
+from repository import CLASS_KEY_COLUMNS, ENROLLMENT_ORDER, ClassRepository, EnrollmentRepository, ProfileRepository
+from cache import WaitingList, available_snapshot, class_cache, waiting_list_index
+from events import committed
+from model import Field, get_find_class_dict, parse_import_records
+from util import is_blank, valid_age
 from sqlite3 import Connection, IntegrityError
 from logging import Logger
-from constant import DatabaseColumn, Message
-from fastapi import HTTPException, status
+from constant import Concurrency, DatabaseColumn, EnrollmentStatus, Message
+from starlette import status
+from starlette.exceptions import HTTPException
 from datetime import datetime
 
+# The first waiting list entry in the order waiting list positions are numbered
+PROMOTION_ORDER = f"ORDER BY {', '.join(ENROLLMENT_ORDER)} LIMIT 1"
+
+def after_commit(conn, hook, *arguments):
+    # Runs a hook that must only see committed writes. A connection whose commits are savepoints of a
+    # larger transaction (see jobs.SavepointConnection) holds it until that transaction commits.
+    defer = getattr(conn, "after_commit", None)
+    if defer is None:
+        hook(*arguments)
+    else:
+        defer(hook, *arguments)
+
+def require_class(class_data):
+    if not class_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.CLASS_DOES_NOT_EXISTS)
+    return class_data
+
+def cache_class(class_data: dict, generation: int):
+    # The generation read before the query keeps a row that a concurrent write already replaced out of the cache
+    if class_data is not None:
+        class_cache.put(class_data, generation)
+    return class_data
 
 class ClassService:
 
-    def __init__(self, conn: Connection, class_table_name: str, instructor_table_name: str, log: Logger):
+    def __init__(self, conn: Connection, class_table_name: str, instructor_table_name: str, log: Logger, enrollment_table_name: str = "enrollment"):
         self._conn = conn
         self._log = log
+        self._enrollment_table_name = enrollment_table_name
         self._class_repository = ClassRepository(conn, class_table_name, log)
         self._instructor_repository = ProfileRepository(conn, instructor_table_name, log)
 
     def add_class(self, field: Field):
-        if not self._instructor_repository.exists_by_attribute({DatabaseColumn.ID: field.instructorId}):
-            self._log.info("Instructor does not exists. Instructor ID: %s", field.instructorId)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Instructor does not exists")
-        class_data = get_find_class_dict(field)
-        if self._class_repository.exists_by_attribute(class_data):
-            self._log.info("Class already exists. Department: %s. Course Code: %s. Section Number %s", field.department, field.courseCode, field.sectionNumber)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Class already exists")
-        class_data[DatabaseColumn.INSTRUCTOR_ID] = field.instructorId
-        class_data[DatabaseColumn.CLASS_NAME] = field.className
-        class_data[DatabaseColumn.CURRENT_ENROLLMENT] = 0
-        class_data[DatabaseColumn.MAX_ENROLLMENT] = field.maxEnrollment
-        class_data[DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN] = field.automaticEnrollmentFrozen
+        self._require_instructor(field, self._instructor_repository.exists_by_attribute({DatabaseColumn.ID: field.instructorId}))
+        class_data = self._new_class(field, self._class_repository.exists_by_attribute(get_find_class_dict(field)))
         saved_class_data = self._class_repository.save(class_data)
         self._conn.commit()
+        after_commit(self._conn, class_cache.put, saved_class_data)
         return saved_class_data
         
     def delete_class(self, id: str):
         id_dict = {DatabaseColumn.ID: id}
-        if not self._class_repository.exists_by_attribute(id_dict):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.CLASS_DOES_NOT_EXISTS)
+        require_class(self._class_repository.exists_by_attribute(id_dict))
         self._class_repository.delete_by_attribute(id_dict)
         self._conn.commit()
+        after_commit(self._conn, self._deleted, id)
         
     def update_instructor(self, id: str, instructor_id: str):
-        class_data = self._class_repository.find_by_attribute({DatabaseColumn.ID: id})
-        if class_data is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.CLASS_DOES_NOT_EXISTS)
-        class_data[DatabaseColumn.INSTRUCTOR_ID] = instructor_id
-        self._class_repository.save(class_data)
+        require_class(self._class_repository.find_by_attribute({DatabaseColumn.ID: id}))
+        # Write only the instructor so a concurrent enrollment count change is not overwritten
+        self._class_repository.save({DatabaseColumn.ID: id, DatabaseColumn.INSTRUCTOR_ID: instructor_id})
         self._conn.commit()
+        after_commit(self._conn, class_cache.invalidate, id)
         
     def available_classes(self):
-        return self._class_repository.findAllAvailableClasses()
+        # The snapshot is brought up to the latest change log seq first, so it is never older than its ETag.
+        # Enrollments, drops, freezes and class writes all log the class they touched; only those are read again.
+        snapshot = available_snapshot.get()
+        seq, changed_on = self._class_repository.latestChange() or (0, None)
+        if snapshot is not None and snapshot.seq == seq:
+            return snapshot
+        class_ids = None
+        if snapshot is not None and snapshot.seq < seq and self._class_repository.firstChange() <= snapshot.seq + 1:
+            class_ids = self._class_repository.findChangedClasses(snapshot.seq, seq)
+        if self._reloads_snapshot(snapshot, seq, class_ids):
+            return available_snapshot.replace(seq, changed_on, self._class_repository.findAvailableClasses(self._enrollment_table_name))
+        return available_snapshot.apply(seq, changed_on, class_ids, self._class_repository.findAvailableClasses(self._enrollment_table_name, class_ids))
+
+    def table_version(self):
+        return self._class_repository.table_version()
+
+    def iter_available_classes(self, department: str = None, course_code: str = None, frozen: bool = None, after: tuple = None, limit: int = None):
+        filters = {
+            DatabaseColumn.DEPARTMENT: department,
+            DatabaseColumn.COURSE_CODE: course_code,
+            DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN: frozen,
+        }
+        return self._class_repository.iterAvailableClasses(self._enrollment_table_name, {key: value for key, value in filters.items() if value is not None}, after, limit)
+
+    def import_chunk(self, records: list):
+        # Validates and inserts a chunk of (line, row) records; the caller owns the transaction
+        rejected = []
+        fields = list(parse_import_records(records, rejected))
+        instructor_keys, class_keys = self._import_keys(fields)
+        instructors = self._instructor_repository.find_all_in((DatabaseColumn.ID,), instructor_keys)
+        classes = self._import_rows(fields, instructors, self._class_repository.find_all_in(CLASS_KEY_COLUMNS, class_keys), rejected)
+        self._class_repository.save_all(classes)
+        class_cache.invalidate()
+        return len(classes), rejected
+
+    def _import_keys(self, fields: list):
+        return list({(x.instructorId,) for _, x in fields}), list({(x.department, x.courseCode, x.sectionNumber) for _, x in fields})
+
+    def _require_instructor(self, field: Field, instructor_exists: bool):
+        if not instructor_exists:
+            self._log.info("Instructor does not exists. Instructor ID: %s", field.instructorId)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Instructor does not exists")
+
+    def _new_class(self, field: Field, class_exists: bool):
+        if class_exists:
+            self._log.info("Class already exists. Department: %s. Course Code: %s. Section Number %s", field.department, field.courseCode, field.sectionNumber)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Class already exists")
+        return get_find_class_dict(field) | {
+            DatabaseColumn.INSTRUCTOR_ID: field.instructorId,
+            DatabaseColumn.CLASS_NAME: field.className,
+            DatabaseColumn.CURRENT_ENROLLMENT: 0,
+            DatabaseColumn.MAX_ENROLLMENT: field.maxEnrollment,
+            DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN: field.automaticEnrollmentFrozen,
+        }
+
+    def _reloads_snapshot(self, snapshot, seq: int, class_ids: list):
+        # No snapshot yet, a database older than the snapshot, changes pruned before they were read or too many to apply
+        if snapshot is not None and snapshot.seq > seq:
+            available_snapshot.clear()
+        return class_ids is None or len(class_ids) > available_snapshot.max_delta
+
+    def _import_rows(self, fields: list, instructors: list, classes: list, rejected: list):
+        instructor_ids = {x[DatabaseColumn.ID] for x in instructors}
+        class_keys = {tuple(x[column] for column in CLASS_KEY_COLUMNS) for x in classes}
+        classes = []
+        for line, field in fields:
+            invalid_details = []
+            if field.instructorId not in instructor_ids:
+                invalid_details.append("Instructor does not exists")
+            if is_blank(field.department) or is_blank(field.courseCode) or is_blank(field.className):
+                invalid_details.append("Department, course code and class name cannot be blank")
+            if field.maxEnrollment < 1:
+                invalid_details.append("Max enrollment cannot be less than 1")
+            class_key = (field.department, field.courseCode, field.sectionNumber)
+            if class_key in class_keys:
+                invalid_details.append("Class already exists")
+            if len(invalid_details) != 0:
+                rejected.append({"line": line, "errors": invalid_details})
+                continue
+            class_keys.add(class_key)
+            classes.append({
+                DatabaseColumn.INSTRUCTOR_ID: field.instructorId,
+                DatabaseColumn.DEPARTMENT: field.department,
+                DatabaseColumn.COURSE_CODE: field.courseCode,
+                DatabaseColumn.SECTION_NUMBER: field.sectionNumber,
+                DatabaseColumn.CLASS_NAME: field.className,
+                DatabaseColumn.CURRENT_ENROLLMENT: 0,
+                DatabaseColumn.MAX_ENROLLMENT: field.maxEnrollment,
+                DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN: field.automaticEnrollmentFrozen,
+            })
+        return classes
+
+    def _deleted(self, id: str):
+        class_cache.invalidate(id)
+        waiting_list_index.forget(id)
+        committed.set()
 
 
 class EnrollmentService:
 
-    def __init__(self, conn: Connection, enrollment_table_name: str, class_table_name: str, log: Logger):
+    def __init__(self, conn: Connection, enrollment_table_name: str, class_table_name: str, log: Logger, student_table_name: str = "student"):
         self._conn = conn
+        self._enrollment_table_name = enrollment_table_name
         self._class_repository = ClassRepository(conn, class_table_name, log)
         self._enrollment_repository = EnrollmentRepository(conn, enrollment_table_name, log)
+        self._student_repository = ProfileRepository(conn, student_table_name, log)
 
     def enroll(self, field: Field):
-        class_data = self._class_repository.find_by_attribute(get_find_class_dict(field))
+        for attempt in range(Concurrency.MAX_RETRIES):
+            class_data = self._find_class(field, attempt == 0)
+            if attempt == 0 and self._enrollment_error(class_data) is not None:
+                # Only the stored row can reject an enrollment; the cached one may predate a drop made elsewhere
+                class_data = self._find_class(field, False)
+            self._validate_enrollment(class_data)
+            self._validate_waiting_lists(self._enrollment_repository.count_by_attribute(self._student_waiting_list_dict(field)))
+            enrollment_data = self._new_enrollment(field, class_data)
+            try:
+                if self._class_repository.compareEnrollment(class_data):
+                    self._enrollment_repository.save(enrollment_data)
+                    self._conn.commit()
+                    after_commit(self._conn, self._enrolled, [(class_data, 1)], [enrollment_data])
+                    return enrollment_data
+                self._conn.rollback()
+                self._conflicted([class_data])
+            except Exception:
+                self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    def drop_enrollment(self, field: Field):
+        for attempt in range(Concurrency.MAX_RETRIES):
+            class_data = self._get_class_data(field, attempt == 0)
+            enrollment_data = self._require_enrollment(self._enrollment_repository.find_by_attribute(self._student_enrollment_dict(field, class_data)))
+            migrate_enrollment = None
+            if self._promotes_waiting_list(class_data, enrollment_data):
+                migrate_enrollment = self._enrollment_repository.find_by_attribute(self._waiting_list_dict(class_data), wild_card=PROMOTION_ORDER)
+            try:
+                if (self._class_repository.compareEnrollment(class_data)
+                        and self._enrollment_repository.compare_and_set(*self._drop_change(enrollment_data))
+                        and (migrate_enrollment is None or self._enrollment_repository.compare_and_set(*self._promote_change(migrate_enrollment)))):
+                    self._conn.commit()
+                    after_commit(self._conn, self._dropped, class_data, enrollment_data, migrate_enrollment)
+                    return migrate_enrollment
+                self._conn.rollback()
+                self._conflicted([class_data])
+            except Exception:
+                self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    def bulk_enroll(self, fields: list):
+        student_keys, class_keys = self._bulk_keys(fields)
+        for _ in range(Concurrency.MAX_RETRIES):
+            classes = self._class_repository.find_all_in(CLASS_KEY_COLUMNS, class_keys)
+            student_ids = {x[DatabaseColumn.ID] for x in self._student_repository.find_all_in((DatabaseColumn.ID,), student_keys)}
+            waiting_list_counts = self._enrollment_repository.countWaitingListByStudent([x[0] for x in student_keys])
+            results, enrollments, class_deltas = self._place_enrollments(fields, classes, student_ids, waiting_list_counts)
+            try:
+                if self._class_repository.compareEnrollments([x for x, _ in class_deltas]):
+                    self._enrollment_repository.save_all(enrollments)
+                    self._conn.commit()
+                    after_commit(self._conn, self._enrolled, class_deltas, enrollments)
+                    return results
+                self._conn.rollback()
+                self._conflicted([x for x, _ in class_deltas])
+            except Exception:
+                self._conn.rollback()
+                raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=Message.ENROLLMENT_CONFLICT)
+
+    def waiting_list_position(self, field: Field):
+        class_data = self._get_class_data(field)
+        self._follow_waiting_lists()
+        position = waiting_list_index.position(class_data[DatabaseColumn.ID], field.id)
+        if position is None:
+            version = waiting_list_index.version(class_data[DatabaseColumn.ID])
+            position = self._index_waiting_list(class_data, self._enrollment_repository.iter_page(self._waiting_list_dict(class_data), ENROLLMENT_ORDER), version, field.id)
+        return self._require_position(position)
+
+    def check_waiting_list_positions(self):
+        # Compares every indexed waiting list with the window query and drops the ones that diverged
+        self._follow_waiting_lists()
+        mismatches = []
+        for class_id, positions in waiting_list_index.snapshot().items():
+            self._compare_positions(class_id, positions, self._enrollment_repository.waitingListPositions(class_id), mismatches)
+        return mismatches
+
+    def reconcile_enrollment_counts(self, repair: bool = False):
+        # Seat counts are kept by triggers; this finds and optionally repairs counts that drifted anyway
+        drift = [{"classId": x[0], "stored": x[1], "actual": x[2]} for x in self._class_repository.findEnrollmentDrift(self._enrollment_table_name)]
+        if repair and len(drift) != 0:
+            try:
+                self._class_repository.reconcileEnrollments(self._enrollment_table_name, [x["classId"] for x in drift])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._reconciled(drift)
+        return drift
+
+    def class_enrollment(self, field: Field, on_waiting_list: bool):
+        return list(self.iter_class_enrollment(field, on_waiting_list))
+
+    def dropped_student(self, field: Field):
+        return list(self.iter_dropped_student(field))
+
+    def iter_class_enrollment(self, field: Field, on_waiting_list: bool, after: tuple = None, limit: int = None):
+        # The class is looked up before the rows are iterated so a missing class fails the request up front
+        class_data = self._get_class_data(field)
+        return self._enrollment_repository.iter_page(self._class_enrollment_dict(class_data, on_waiting_list), ENROLLMENT_ORDER, after, limit)
+
+    def iter_dropped_student(self, field: Field, after: tuple = None, limit: int = None):
+        class_data = self._get_class_data(field)
+        return self._enrollment_repository.iter_page(self._dropped_student_dict(class_data), ENROLLMENT_ORDER, after, limit)
+    
+    def _get_class_data(self, field: Field, cached: bool = True):
+        return require_class(self._find_class(field, cached))
+
+    def _find_class(self, field: Field, cached: bool = True):
+        # A stale cached row fails the compare-and-set and is read again; enroll re-reads it before rejecting
+        class_data = class_cache.get_by_key((field.department, field.courseCode, field.sectionNumber)) if cached else None
+        if class_data is None:
+            generation = class_cache.generation
+            class_data = cache_class(self._class_repository.find_by_attribute(get_find_class_dict(field)), generation)
+        return class_data
+
+    def _follow_waiting_lists(self):
+        # Indexed lists only see this process's writes, so the classes any process changed since are read again
+        seq = (self._class_repository.latestChange() or (0, None))[0]
+        after = waiting_list_index.seq
+        if seq > after and self._class_repository.firstChange() <= after + 1:
+            waiting_list_index.advance(seq, self._class_repository.findChangedClasses(after, seq))
+        elif seq != after:
+            waiting_list_index.advance(seq)
+
+    def _conflicted(self, classes: list):
+        # The rows a failed compare-and-set was made against are out of date
+        for class_data in classes:
+            class_cache.invalidate(class_data[DatabaseColumn.ID])
+
+    def _reconciled(self, drift: list):
+        for x in drift:
+            class_cache.invalidate(x["classId"])
+
+    def _cache_enrollment_changes(self, class_deltas: list):
+        classes = {}
+        for class_data, delta in class_deltas:
+            classes[class_data[DatabaseColumn.ID]] = class_data | {DatabaseColumn.CURRENT_ENROLLMENT: class_data[DatabaseColumn.CURRENT_ENROLLMENT] + delta}
+            class_cache.put(classes[class_data[DatabaseColumn.ID]])
+        return classes
+
+    def _enrolled(self, class_deltas: list, enrollments: list):
+        # Runs after commit so the class cache and the waiting list index only see committed changes. Events are
+        # published by the change dispatcher of every worker, which the commit wakes in this one.
+        self._cache_enrollment_changes(class_deltas)
+        for enrollment_data in enrollments:
+            if enrollment_data[DatabaseColumn.WAITING_LIST]:
+                waiting_list_index.add(enrollment_data[DatabaseColumn.CLASS_ID], enrollment_data)
+        committed.set()
+
+    def _dropped(self, class_data: dict, enrollment_data: dict, migrate_enrollment: dict):
+        class_data = self._cache_enrollment_changes([(class_data, -1)])[class_data[DatabaseColumn.ID]]
+        # Both a dropped waiting list entry and a promoted one leave the waiting list
+        for removed in (enrollment_data, migrate_enrollment):
+            if removed is not None and removed[DatabaseColumn.WAITING_LIST]:
+                waiting_list_index.remove(class_data[DatabaseColumn.ID], removed)
+        committed.set()
+
+    def _validate_enrollment(self, class_data: dict):
+        error = self._enrollment_error(class_data)
+        if error is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+
+    def _validate_waiting_lists(self, waiting_lists: int):
+        if waiting_lists >= 3:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.WAITING_LIST_LIMIT)
+
+    def _require_enrollment(self, enrollment_data: dict):
+        if enrollment_data is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are not enrolled in this course")
+        return enrollment_data
+
+    def _require_position(self, position: int):
+        if not position:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are not in waiting list")
+        return position
+
+    def _index_waiting_list(self, class_data: dict, rows, version: int, student_id: str):
+        waiting_list = WaitingList(rows)
+        waiting_list_index.put(class_data[DatabaseColumn.ID], waiting_list, version)
+        return waiting_list.position(student_id)
+
+    def _compare_positions(self, class_id: str, indexed: dict, expected: dict, mismatches: list):
+        # An indexed waiting list that diverged from the window query is dropped and read again on next use
+        if indexed != expected:
+            waiting_list_index.invalidate(class_id)
+            mismatches.append({"classId": class_id, "expected": expected, "indexed": indexed})
+
+    def _bulk_keys(self, fields: list):
+        return list({(x.id,) for x in fields}), list({(x.department, x.courseCode, x.sectionNumber) for x in fields})
+
+    def _enrollment_error(self, class_data: dict):
         if class_data is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.CLASS_DOES_NOT_EXISTS)
+            return Message.CLASS_DOES_NOT_EXISTS
         if class_data[DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN]:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Enrollment has been frozen")
+            return Message.ENROLLMENT_FROZEN
         if class_data[DatabaseColumn.CURRENT_ENROLLMENT] - class_data[DatabaseColumn.MAX_ENROLLMENT] >= 15:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Waiting list is full")
-        if self._enrollment_repository.count_by_attribute({DatabaseColumn.STUDENT_ID: field.id, DatabaseColumn.WAITING_LIST: True}) >= 3:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student cannot be in more than 3 waiting list")
-        enrollment_data = {
+            return Message.WAITING_LIST_FULL
+        return None
+
+    def _place_enrollments(self, fields: list, classes: list, student_ids: set, waiting_list_counts: dict):
+        # Seat and waiting list placement is decided in memory against a private copy of each class row
+        classes = {(x[DatabaseColumn.DEPARTMENT], x[DatabaseColumn.COURSE_CODE], x[DatabaseColumn.SECTION_NUMBER]): dict(x) for x in classes}
+        original = {x[DatabaseColumn.ID]: dict(x) for x in classes.values()}
+        results = []
+        enrollments = []
+        for field in fields:
+            class_data = classes.get((field.department, field.courseCode, field.sectionNumber))
+            error = self._enrollment_error(class_data)
+            if error is None and field.id not in student_ids:
+                error = Message.STUDENT_DOES_NOT_EXISTS
+            if error is None and waiting_list_counts.get(field.id, 0) >= 3:
+                error = Message.WAITING_LIST_LIMIT
+            result = {
+                "id": field.id,
+                "department": field.department,
+                "courseCode": field.courseCode,
+                "sectionNumber": field.sectionNumber,
+            }
+            if error is not None:
+                result["status"] = EnrollmentStatus.REJECTED
+                result["detail"] = error
+            else:
+                enrollment_data = self._new_enrollment(field, class_data)
+                if enrollment_data[DatabaseColumn.WAITING_LIST]:
+                    waiting_list_counts[field.id] = waiting_list_counts.get(field.id, 0) + 1
+                class_data[DatabaseColumn.CURRENT_ENROLLMENT] += 1
+                enrollments.append(enrollment_data)
+                result["status"] = EnrollmentStatus.WAITING_LIST if enrollment_data[DatabaseColumn.WAITING_LIST] else EnrollmentStatus.ENROLLED
+            results.append(result)
+        class_deltas = [(original[x[DatabaseColumn.ID]], x[DatabaseColumn.CURRENT_ENROLLMENT] - original[x[DatabaseColumn.ID]][DatabaseColumn.CURRENT_ENROLLMENT]) for x in classes.values()]
+        return results, enrollments, [x for x in class_deltas if x[1] != 0]
+
+    def _new_enrollment(self, field: Field, class_data: dict):
+        return {
             DatabaseColumn.STUDENT_ID: field.id,
             DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
             DatabaseColumn.ENROLLED_ON: datetime.now(),
             DatabaseColumn.DROPPED: False,
+            DatabaseColumn.WAITING_LIST: class_data[DatabaseColumn.CURRENT_ENROLLMENT] >= class_data[DatabaseColumn.MAX_ENROLLMENT],
         }
-        enrollment_data[DatabaseColumn.WAITING_LIST] = False if class_data[DatabaseColumn.CURRENT_ENROLLMENT] < class_data[DatabaseColumn.MAX_ENROLLMENT] else True
-        class_data[DatabaseColumn.CURRENT_ENROLLMENT] += 1
-        try:
-            self._enrollment_repository.save(enrollment_data)
-            self._class_repository.save(class_data)
-            self._conn.commit()
-        except Exception:
-            self._conn.rollback()
 
-    def drop_enrollment(self, field: Field):
-        class_data = self._get_class_data(field)
-        enrollment_data = {
+    def _promotes_waiting_list(self, class_data: dict, enrollment_data: dict):
+        return (not enrollment_data[DatabaseColumn.WAITING_LIST]
+                and class_data[DatabaseColumn.CURRENT_ENROLLMENT] > class_data[DatabaseColumn.MAX_ENROLLMENT]
+                and not class_data[DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN])
+
+    def _drop_change(self, enrollment_data: dict):
+        # (id, expected, changes) for the compare-and-set that drops an enrollment
+        return enrollment_data[DatabaseColumn.ID], self._status_dict(enrollment_data), {DatabaseColumn.DROPPED: True, DatabaseColumn.WAITING_LIST: False}
+
+    def _promote_change(self, enrollment_data: dict):
+        return enrollment_data[DatabaseColumn.ID], self._status_dict(enrollment_data), {DatabaseColumn.WAITING_LIST: False}
+
+    def _student_enrollment_dict(self, field: Field, class_data: dict):
+        return {
             DatabaseColumn.STUDENT_ID: field.id,
             DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
             DatabaseColumn.DROPPED: False,
         }
-        enrollment_data = self._enrollment_repository.find_by_attribute(enrollment_data)
-        migrate_enrollment = None
-        if enrollment_data is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are not enrolled in this course")
-        elif enrollment_data[DatabaseColumn.WAITING_LIST]:
-            enrollment_data[DatabaseColumn.WAITING_LIST] = False
-        elif class_data[DatabaseColumn.CURRENT_ENROLLMENT] > class_data[DatabaseColumn.MAX_ENROLLMENT] and not class_data[DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN]:
-            search_enrollment = {
-                DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
-                DatabaseColumn.DROPPED: False,
-                DatabaseColumn.WAITING_LIST: True,
-            }
-            migrate_enrollment = self._enrollment_repository.find_by_attribute(search_enrollment, wild_card=f"ORDER BY {DatabaseColumn.ENROLLED_ON} ASC LIMIT 1")
-            migrate_enrollment[DatabaseColumn.WAITING_LIST] = False
-        enrollment_data[DatabaseColumn.DROPPED] = True
-        class_data[DatabaseColumn.CURRENT_ENROLLMENT] -= 1
-        try:
-            self._enrollment_repository.save(enrollment_data)
-            self._class_repository.save(class_data)
-            if migrate_enrollment is not None:
-                self._enrollment_repository.save(migrate_enrollment)
-            self._conn.commit()
-        except Exception:
-            self._conn.rollback()
 
-    def waiting_list_position(self, field: Field):
-        class_data = self._get_class_data(field)
-        position = self._enrollment_repository.waitingListPosition(class_data[DatabaseColumn.ID], field.id)
-        if position is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You are not in waiting list")
-        return position
+    def _student_waiting_list_dict(self, field: Field):
+        return {
+            DatabaseColumn.STUDENT_ID: field.id,
+            DatabaseColumn.WAITING_LIST: True,
+        }
 
-    def class_enrollment(self, field: Field, on_waiting_list: bool):
-        class_data = self._get_class_data(field)
-        enrollment_data = {
+    def _waiting_list_dict(self, class_data: dict):
+        return {
+            DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
+            DatabaseColumn.DROPPED: False,
+            DatabaseColumn.WAITING_LIST: True,
+        }
+
+    def _class_enrollment_dict(self, class_data: dict, on_waiting_list: bool):
+        return {
             DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
             DatabaseColumn.DROPPED: False,
             DatabaseColumn.WAITING_LIST: on_waiting_list,
         }
-        return self._enrollment_repository.find_all_by_attribute(enrollment_data)
 
-    def dropped_student(self, field: Field):
-        class_data = self._get_class_data(field)
-        enrollment_data = {
+    def _dropped_student_dict(self, class_data: dict):
+        return {
             DatabaseColumn.CLASS_ID: class_data[DatabaseColumn.ID],
             DatabaseColumn.DROPPED: True,
         }
-        return self._enrollment_repository.find_all_by_attribute(enrollment_data)
-    
-    def _get_class_data(self, field: Field):
-        class_data = self._class_repository.find_by_attribute(get_find_class_dict(field))
-        if class_data is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.CLASS_DOES_NOT_EXISTS)
-        return class_data
+
+    def _status_dict(self, enrollment_data: dict):
+        return {
+            DatabaseColumn.DROPPED: enrollment_data[DatabaseColumn.DROPPED],
+            DatabaseColumn.WAITING_LIST: enrollment_data[DatabaseColumn.WAITING_LIST],
+        }
     
 
 class ProfileService:
@@ -160,52 +483,79 @@ class ProfileService:
         return saved_student
     
     def get_profile(self, id: str):
-        profile = self._profile_repository.find_by_attribute({DatabaseColumn.ID: id})
-        if profile is None:
-            self._log.error(Message.PROFLIE_NOT_FOUND)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.PROFLIE_NOT_FOUND)
-        return profile
+        return self._require_profile(self._profile_repository.find_by_attribute({DatabaseColumn.ID: id}))
+
+    def table_version(self):
+        return self._profile_repository.table_version()
 
     def update_profile(self, field: Field):
-        profile = self._profile_repository.find_by_attribute({DatabaseColumn.ID: field.id})
-        if profile is None:
-            self._log.error(Message.PROFLIE_NOT_FOUND)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.PROFLIE_NOT_FOUND)
+        profile = self._require_profile(self._profile_repository.find_by_attribute({DatabaseColumn.ID: field.id}))
         self._validate_details(field)
-        profile[DatabaseColumn.ID] = field.id
-        profile[DatabaseColumn.FIRST_NAME] = field.firstName
-        profile[DatabaseColumn.LAST_NAME] = field.lastName
-        profile[DatabaseColumn.AGE] = field.age
-        saved_profile = self._profile_repository.save(profile)
+        saved_profile = self._profile_repository.save(profile | {DatabaseColumn.ID: field.id} | self._profile_dict(field))
         self._conn.commit()
         return saved_profile
     
     def delete_profile(self, id: str):
         profile_id_dict = {DatabaseColumn.ID: id}
-        if not self._profile_repository.find_by_attribute(profile_id_dict):
-            self._log.error(Message.PROFLIE_NOT_FOUND)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.PROFLIE_NOT_FOUND)
+        self._require_profile(self._profile_repository.find_by_attribute(profile_id_dict))
         self._profile_repository.delete_by_attribute(profile_id_dict)
         self._conn.commit()
 
+    def import_chunk(self, records: list):
+        # Validates and inserts a chunk of (line, row) records; the caller owns the transaction
+        rejected = []
+        fields = list(parse_import_records(records, rejected))
+        profiles = self._import_rows(fields, self._profile_repository.find_all_in((DatabaseColumn.ID,), self._import_keys(fields)), rejected)
+        self._profile_repository.save_all(profiles)
+        return len(profiles), rejected
+
+    def _import_keys(self, fields: list):
+        return list({(x.id,) for _, x in fields if x.id is not None})
+
+    def _import_rows(self, fields: list, existing: list, rejected: list):
+        # An id that is already taken is rejected rather than overwriting the stored profile
+        existing_ids = {x[DatabaseColumn.ID] for x in existing}
+        profiles = []
+        for line, field in fields:
+            invalid_details = self._invalid_details(field)
+            if field.id is not None and field.id in existing_ids:
+                invalid_details.append("Profile already exists")
+            if len(invalid_details) != 0:
+                rejected.append({"line": line, "errors": invalid_details})
+                continue
+            profile = self._profile_dict(field)
+            if field.id is not None:
+                existing_ids.add(field.id)
+                profile[DatabaseColumn.ID] = field.id
+            profiles.append(profile)
+        return profiles
+
     def _validate_details(self, field: Field):
-        first_name = field.firstName
-        last_name = field.lastName
-        age = field.age
+        invalid_details = self._invalid_details(field)
+        if len(invalid_details) != 0:
+            self._log.error("Invalid profile details: %s", ", ".join(invalid_details))
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=", ".join(invalid_details))
+        return self._profile_dict(field)
+
+    def _invalid_details(self, field: Field):
         invalid_details = []
-        if is_blank(first_name):
-            self._log.error("Invalid first name: %s", first_name)
+        if is_blank(field.firstName):
             invalid_details.append("Firstname cannot be blank")
-        if is_blank(last_name):
-            self._log.error("Invalid last name: %s", last_name)
+        if is_blank(field.lastName):
             invalid_details.append("Lastname cannot be blank")
-        if not valid_age(age):
-            self._log.error("Invalid age: %s", age)
+        if not valid_age(field.age):
             invalid_details.append("Age cannot be less than 1 or greater than 110")
-        if len(invalid_details) != 0:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=", ".join(invalid_details))
+        return invalid_details
+
+    def _require_profile(self, profile: dict):
+        if not profile:
+            self._log.error(Message.PROFLIE_NOT_FOUND)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=Message.PROFLIE_NOT_FOUND)
+        return profile
+
+    def _profile_dict(self, field: Field):
         return {
-            DatabaseColumn.FIRST_NAME: first_name,
-            DatabaseColumn.LAST_NAME: last_name,
-            DatabaseColumn.AGE:  age,
-        }
\ No newline at end of file
+            DatabaseColumn.FIRST_NAME: field.firstName,
+            DatabaseColumn.LAST_NAME: field.lastName,
+            DatabaseColumn.AGE: field.age,
+        }
@@ -0,0 +1,59 @@
+from unittest import IsolatedAsyncioTestCase
+from async_pool import AsyncConnectionPool
+from async_service import AsyncClassService, AsyncEnrollmentService, AsyncProfileService
+from schema import create_database
+from config import DatabaseConfig
+from cache import class_cache, waiting_list_index
+from model import Field
+from util import insert_test_data
+from constant import DatabaseColumn
+from starlette.exceptions import HTTPException
+from tempfile import TemporaryDirectory
+from os import path
+import logging
+
+
+class TestAsyncProfileService(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "async.db"))
+        create_database(config)
+        conn = config.connect()
+        insert_test_data(conn)
+        conn.close()
+        self._config = config
+        self._pool = AsyncConnectionPool(config)
+        self._log = logging.getLogger()
+
+    async def asyncTearDown(self):
+        await self._pool.close()
+        self._directory.cleanup()
+
+    async def test_add_and_get_profile(self):
+        field = Field(firstName="Gault", lastName="Graply", age=19)
+        saved = await self._pool.submit(lambda conn: AsyncProfileService(conn, "student", self._log).add_profile(field))
+        async with self._pool.reader() as conn:
+            profile = await AsyncProfileService(conn, "student", self._log).get_profile(saved[DatabaseColumn.ID])
+        self.assertEqual(profile[DatabaseColumn.FIRST_NAME], "Gault")
+
+    async def test_failed_write_is_rolled_back(self):
+        field = Field(instructorId="INS404", department="FOO", courseCode="BAR", className="BAZ")
+        with self.assertRaises(HTTPException):
+            await self._pool.submit(lambda conn: AsyncClassService(conn, "class", "instructor", self._log).add_class(field))
+        self.assertEqual(self._pool.stats()["in_use"], 0)
+
+    async def test_stale_cached_row_does_not_reject(self):
+        field = Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1)
+        conn = self._config.connect()
+        conn.execute("UPDATE class SET current_enrollment = 25 WHERE department = 'QUX'")
+        conn.commit()
+        async with self._pool.reader() as reader:
+            await AsyncEnrollmentService(reader, "enrollment", "class", self._log)._get_class_data(field)
+        conn.execute("UPDATE class SET current_enrollment = 24 WHERE department = 'QUX'")
+        conn.commit()
+        conn.close()
+        enrollment = await self._pool.submit(lambda conn: AsyncEnrollmentService(conn, "enrollment", "class", self._log).enroll(field))
+        self.assertTrue(enrollment[DatabaseColumn.WAITING_LIST])
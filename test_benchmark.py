@@ -0,0 +1,78 @@
+from unittest import TestCase
+from benchmark import BenchmarkState, compare_results, compare_serializers, compare_write_workers, generate_data, import_breakdown, measure_cold_start, summarize
+from schema import create_database
+from config import DatabaseConfig
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from os import environ, path
+
+
+class TestBenchmark(TestCase):
+
+    def test_generate_data(self):
+        with TemporaryDirectory() as directory:
+            config = DatabaseConfig(path.join(directory, "benchmark.db"))
+            create_database(config)
+            conn = config.connect()
+            state = BenchmarkState(1)
+            generate_data(conn, state, 30, 12, 1.1)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM student").fetchone()[0], 30)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM class").fetchone()[0], 12)
+            conn.close()
+        self.assertGreater(state.class_weights[0], state.class_weights[-1])
+
+    def test_summarize(self):
+        result = summarize([x / 1000 for x in range(1, 101)], [200] * 99 + [500], 2.0)
+        self.assertEqual(result["requests"], 100)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["rps"], 50.0)
+        self.assertAlmostEqual(result["p50_ms"], 50.5)
+        self.assertAlmostEqual(result["p99_ms"], 99.01)
+
+    def test_compare_results(self):
+        baseline = {"routes": {"GET /stats": {"p95_ms": 10.0}, "GET /student/class": {"p95_ms": 10.0}}}
+        current = {"routes": {"GET /stats": {"p95_ms": 11.0}, "GET /student/class": {"p95_ms": 13.0}}}
+        regressions = compare_results(current, baseline, 0.2)
+        self.assertEqual([x["route"] for x in regressions], ["GET /student/class"])
+        baseline["cold_start"] = {"total_ms": 100.0}
+        current["cold_start"] = {"total_ms": 150.0}
+        self.assertEqual([x["route"] for x in compare_results(current, baseline, 0.2)], ["GET /student/class", "cold start"])
+
+    def test_compare_serializers(self):
+        results = compare_serializers(BenchmarkState(1), (3, 10), 2)
+        self.assertEqual(list(results.keys()), ["3", "10"])
+        self.assertIn("default", results["3"])
+        self.assertIn("stdlib", results["3"])
+
+    def test_compare_write_workers(self):
+        with TemporaryDirectory() as directory:
+            config = DatabaseConfig(path.join(directory, "benchmark.db"))
+            create_database(config)
+            conn = config.connect()
+            state = BenchmarkState(1)
+            generate_data(conn, state, 30, 4, 1.1)
+            conn.close()
+            results = compare_write_workers(config, state, (1, 2), 5, directory, 4)
+        self.assertEqual(list(results.keys()), ["direct", "queue", "group"])
+        self.assertEqual(results["queue"]["2"]["requests"], 10)
+        self.assertEqual(results["direct"]["1"]["errors"], 0)
+
+    def test_import_breakdown(self):
+        output = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:      2000 |       2000 |     pydantic.main",
+            "import time:      1000 |       3000 |   pydantic",
+            "import time:       500 |        500 |   util",
+            "import time:       250 |        250 | service",
+        ])
+        self.assertEqual(import_breakdown(output, 2), {"pydantic": 3.0, "util": 0.5, "other": 0.25})
+
+    def test_measure_cold_start(self):
+        with TemporaryDirectory() as directory:
+            with patch.dict(environ, {"DATABASE_PATH": path.join(directory, "benchmark.db")}):
+                result = measure_cold_start(1)
+            self.assertTrue(path.exists(path.join(directory, "benchmark.db")))
+        self.assertEqual(result["status"], 200)
+        self.assertGreater(result["import_ms"], 0)
+        self.assertAlmostEqual(result["total_ms"], result["import_ms"] + result["startup_ms"] + result["first_request_ms"])
+        self.assertIn("fastapi", result["imports_ms"])
@@ -0,0 +1,248 @@
+from unittest import TestCase
+from cache import AvailableClasses, ClassCache, WaitingList, WaitingListIndex, available_snapshot, class_cache, waiting_list_index
+from service import ClassService, EnrollmentService
+from schema import create_database
+from config import DatabaseConfig
+from constant import DatabaseColumn
+from model import Field
+from util import insert_test_data
+from tempfile import TemporaryDirectory
+from os import path
+from starlette.exceptions import HTTPException
+import json
+import logging
+
+
+def class_row(class_id: str, section_number: int = 1, current_enrollment: int = 0):
+    return {
+        DatabaseColumn.ID: class_id,
+        DatabaseColumn.DEPARTMENT: "DEP",
+        DatabaseColumn.COURSE_CODE: "COR",
+        DatabaseColumn.SECTION_NUMBER: section_number,
+        DatabaseColumn.CURRENT_ENROLLMENT: current_enrollment,
+    }
+
+
+class TestClassCache(TestCase):
+
+    def setUp(self):
+        self._now = 0.0
+        self._cache = ClassCache(max_size=2, ttl=10.0, clock=lambda: self._now)
+
+    def test_lookup_by_id_and_key(self):
+        self._cache.put(class_row("A"), self._cache.generation)
+        self.assertEqual(self._cache.get("A")[DatabaseColumn.ID], "A")
+        self.assertEqual(self._cache.get_by_key(("DEP", "COR", 1))[DatabaseColumn.ID], "A")
+        self.assertIsNone(self._cache.get_by_key(("DEP", "COR", 2)))
+        self.assertEqual(self._cache.stats()["hits"], 2)
+        self.assertEqual(self._cache.stats()["misses"], 1)
+
+    def test_expiry_and_eviction(self):
+        self._cache.put(class_row("A", 1), self._cache.generation)
+        self._cache.put(class_row("B", 2), self._cache.generation)
+        self._cache.get("A")
+        self._cache.put(class_row("C", 3), self._cache.generation)
+        self.assertIsNone(self._cache.get("B"))
+        self.assertIsNone(self._cache.get_by_key(("DEP", "COR", 2)))
+        self._now = 10.0
+        self.assertIsNone(self._cache.get("A"))
+        self.assertEqual(self._cache.stats()["evictions"], 1)
+
+    def test_stale_read_is_not_cached(self):
+        generation = self._cache.generation
+        self._cache.put(class_row("A", current_enrollment=1))
+        self._cache.put(class_row("A", current_enrollment=0), generation)
+        self.assertEqual(self._cache.get("A")[DatabaseColumn.CURRENT_ENROLLMENT], 1)
+
+
+class TestAvailableClasses(TestCase):
+
+    def test_apply_changes(self):
+        snapshot = AvailableClasses()
+        snapshot.replace(1, "2024-01-01 10:00:00", [class_row("A"), class_row("B", 2), class_row("C", 3)])
+        snapshot.apply(3, "2024-01-01 10:00:01", ["A", "B", "D"], [class_row("A", current_enrollment=1), class_row("D", 4)])
+        current = snapshot.get()
+        # A keeps its place, B is no longer open and D is new
+        self.assertEqual([x[DatabaseColumn.ID] for x in current.classes()], ["A", "C", "D"])
+        self.assertEqual(json.loads(current.body), current.classes())
+        self.assertEqual(current.version(), ("available_classes", 3, "2024-01-01 10:00:01"))
+        # A refresh that read an older seq loses to the one already installed
+        snapshot.apply(2, "2024-01-01 10:00:00", ["A"], [])
+        snapshot.replace(2, "2024-01-01 10:00:00", [])
+        self.assertIs(snapshot.get(), current)
+        self.assertEqual(snapshot.stats()["delta_loads"], 1)
+
+
+class TestClassCacheService(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        available_snapshot.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "cache.db"))
+        create_database(config)
+        self._conn = config.connect(check_same_thread=False)
+        insert_test_data(self._conn)
+        log = logging.getLogger()
+        self._class_service = ClassService(self._conn, "class", "instructor", log)
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", log)
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_enrollment_updates_cached_class(self):
+        field = Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1)
+        self._enrollment_service.enroll(field)
+        class_data = self._enrollment_service._get_class_data(field)
+        stored = self._conn.execute("SELECT current_enrollment FROM class WHERE id = ?", [class_data[DatabaseColumn.ID]]).fetchone()[0]
+        self.assertEqual(class_data[DatabaseColumn.CURRENT_ENROLLMENT], stored)
+        self.assertGreater(class_cache.stats()["hits"], 0)
+
+    def test_stale_cached_row_does_not_reject(self):
+        field = Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1)
+        self._conn.execute("UPDATE class SET current_enrollment = 25 WHERE department = 'QUX'")
+        self._conn.commit()
+        self.assertEqual(self._enrollment_service._get_class_data(field)[DatabaseColumn.CURRENT_ENROLLMENT], 25)
+        # A drop made by another worker leaves this worker's cached row with a full waiting list
+        self._conn.execute("UPDATE class SET current_enrollment = 24 WHERE department = 'QUX'")
+        self._conn.commit()
+        self.assertTrue(self._enrollment_service.enroll(field)[DatabaseColumn.WAITING_LIST])
+
+    def test_class_writes_invalidate(self):
+        available = self._class_service.available_classes()
+        self.assertIs(self._class_service.available_classes(), available)
+        class_id = available.classes()[0][DatabaseColumn.ID]
+        self._class_service.delete_class(class_id)
+        self.assertIsNone(class_cache.get(class_id))
+        self.assertNotIn(class_id, [x[DatabaseColumn.ID] for x in self._class_service.available_classes().classes()])
+
+    def test_available_classes_follow_changes(self):
+        self._conn.execute("UPDATE class SET max_enrollment = 1 WHERE department = 'QUX'")
+        self._conn.commit()
+        before = {x[DatabaseColumn.ID]: x for x in self._class_service.available_classes().classes()}
+        field = Field(department="QUX", courseCode="QUUX", sectionNumber=1)
+        for student_id in ("6f68124d-4494-4a61-bd52-dc3b313c6ab7", "52e9c54c-1880-4920-a322-ca7a7bc3c8c7"):
+            self._enrollment_service.enroll(Field(id=student_id, **field.model_dump(exclude_unset=True)))
+        class_id = self._enrollment_service._get_class_data(field)[DatabaseColumn.ID]
+        self.assertEqual((before[class_id][DatabaseColumn.SEATS_REMAINING], before[class_id][DatabaseColumn.WAITING_LIST_DEPTH]), (1, 0))
+        # The second student went on the waiting list, so the class is over capacity and no longer listed
+        full = self._class_service.available_classes()
+        self.assertNotIn(class_id, full.rows)
+        self.assertEqual(full.classes(), [x for x in before.values() if x[DatabaseColumn.ID] != class_id])
+        self._conn.execute("UPDATE class SET max_enrollment = 3 WHERE id = ?", [class_id])
+        self._conn.commit()
+        reopened = self._class_service.available_classes()
+        self.assertEqual((reopened.rows[class_id][DatabaseColumn.SEATS_REMAINING], reopened.rows[class_id][DatabaseColumn.WAITING_LIST_DEPTH]), (1, 1))
+        self.assertEqual(available_snapshot.stats()["delta_loads"], 2)
+        self.assertEqual(json.loads(reopened.body), reopened.classes())
+        # A filtered page has the snapshot's columns
+        page = {x[DatabaseColumn.ID]: x for x in self._class_service.iter_available_classes(department="QUX", limit=10)}
+        self.assertEqual(page, {x[DatabaseColumn.ID]: x for x in reopened.classes() if x[DatabaseColumn.DEPARTMENT] == "QUX"})
+        self.assertEqual(page[class_id][DatabaseColumn.WAITING_LIST_DEPTH], 1)
+
+
+def enrollment_row(enrollment_id: str, student_id: str, enrolled_on: str):
+    return {
+        DatabaseColumn.ID: enrollment_id,
+        DatabaseColumn.STUDENT_ID: student_id,
+        DatabaseColumn.ENROLLED_ON: enrolled_on,
+    }
+
+
+class TestWaitingListIndex(TestCase):
+
+    def setUp(self):
+        self._index = WaitingListIndex(max_size=2, ttl=10.0, clock=lambda: 0.0)
+
+    def test_positions_follow_enrollment_order(self):
+        waiting_list = WaitingList([enrollment_row("b", "S2", "2024-01-01"), enrollment_row("a", "S1", "2024-01-01"), enrollment_row("c", "S3", "2023-12-31")])
+        self.assertEqual(waiting_list.positions(), {"S3": 1, "S1": 2, "S2": 3})
+        waiting_list.remove(enrollment_row("c", "S3", "2023-12-31"))
+        waiting_list.add(enrollment_row("a", "S1", "2024-01-01"))
+        self.assertEqual(waiting_list.positions(), {"S1": 1, "S2": 2})
+
+    def test_incremental_updates(self):
+        self.assertIsNone(self._index.position("A", "S1"))
+        self._index.put("A", WaitingList([enrollment_row("a", "S1", "2024-01-01")]), self._index.version("A"))
+        self._index.add("A", enrollment_row("b", "S2", "2024-01-02"))
+        self.assertEqual(self._index.position("A", "S2"), 2)
+        self._index.remove("A", enrollment_row("a", "S1", "2024-01-01"))
+        self.assertEqual(self._index.position("A", "S2"), 1)
+        self.assertEqual(self._index.position("A", "S1"), 0)
+
+    def test_versions_are_bounded(self):
+        version = self._index.version("A")
+        for class_id in ("A", "B", "C"):
+            self._index.invalidate(class_id)
+        self.assertEqual(self._index.stats()["versions"], 2)
+        # A's version was forgotten, but a load that started before its write still loses
+        self._index.put("A", WaitingList(), version)
+        self.assertIsNone(self._index.position("A", "S1"))
+        self._index.forget("B")
+        self.assertEqual(self._index.stats()["versions"], 1)
+
+    def test_stale_load_is_not_indexed(self):
+        version = self._index.version("A")
+        self._index.add("A", enrollment_row("a", "S1", "2024-01-01"))
+        self._index.put("A", WaitingList(), version)
+        self.assertIsNone(self._index.position("A", "S1"))
+        self._index.put("B", WaitingList(), self._index.version("B"))
+        self.assertEqual(self._index.position("B", "S1"), 0)
+
+
+class TestWaitingListService(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "waiting_list.db"))
+        create_database(config)
+        self._config = config
+        self._conn = config.connect(check_same_thread=False)
+        insert_test_data(self._conn)
+        self._conn.execute("UPDATE class SET max_enrollment = 1 WHERE department = 'QUX'")
+        self._conn.commit()
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", logging.getLogger())
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_positions_after_promotion(self):
+        fields = [Field(id=x, department="QUX", courseCode="QUUX", sectionNumber=1) for x in ("6f68124d-4494-4a61-bd52-dc3b313c6ab7", "52e9c54c-1880-4920-a322-ca7a7bc3c8c7", "41359222-8d72-4dd7-a697-91bd5146aa58")]
+        for field in fields:
+            self._enrollment_service.enroll(field)
+        self.assertEqual(self._enrollment_service.waiting_list_position(fields[1]), 1)
+        self.assertEqual(self._enrollment_service.waiting_list_position(fields[2]), 2)
+        self.assertEqual(waiting_list_index.stats()["misses"], 1)
+        self._enrollment_service.drop_enrollment(fields[0])
+        self.assertEqual(self._enrollment_service.waiting_list_position(fields[2]), 1)
+        with self.assertRaises(HTTPException):
+            self._enrollment_service.waiting_list_position(fields[1])
+        self.assertEqual(self._enrollment_service.check_waiting_list_positions(), [])
+        # The drop shows up in the change log like any other process's write, so the class is read once more
+        self.assertEqual(waiting_list_index.stats()["misses"], 2)
+
+    def test_writes_of_another_connection(self):
+        fields = [Field(id=x, department="QUX", courseCode="QUUX", sectionNumber=1) for x in ("6f68124d-4494-4a61-bd52-dc3b313c6ab7", "52e9c54c-1880-4920-a322-ca7a7bc3c8c7", "41359222-8d72-4dd7-a697-91bd5146aa58")]
+        for field in fields[:2]:
+            self._enrollment_service.enroll(field)
+        self.assertEqual(self._enrollment_service.waiting_list_position(fields[1]), 1)
+        # Another worker's writes reach the database but never this process's cache hooks
+        other = self._config.connect()
+        try:
+            class_id = other.execute("SELECT id FROM class WHERE department = 'QUX'").fetchone()[0]
+            other.execute("INSERT INTO enrollment (id, student_id, class_id, enrolled_on, dropped, waiting_list) VALUES ('E3', ?, ?, '2999-01-01', false, true)", [fields[2].id, class_id])
+            other.commit()
+            self.assertEqual(self._enrollment_service.waiting_list_position(fields[2]), 2)
+            other.execute("UPDATE enrollment SET dropped = true WHERE student_id = ?", [fields[0].id])
+            other.execute("UPDATE enrollment SET waiting_list = false WHERE student_id = ?", [fields[1].id])
+            other.commit()
+        finally:
+            other.close()
+        self.assertEqual(self._enrollment_service.waiting_list_position(fields[2]), 1)
+        with self.assertRaises(HTTPException):
+            self._enrollment_service.waiting_list_position(fields[1])
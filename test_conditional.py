@@ -0,0 +1,91 @@
+from unittest import TestCase
+from conditional import not_modified, validators
+from cache import available_snapshot, class_cache, waiting_list_index
+from service import ClassService, EnrollmentService, ProfileService
+from schema import create_database
+from config import DatabaseConfig
+from model import Field
+from util import insert_test_data
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from tempfile import TemporaryDirectory
+from os import path
+import logging
+
+
+class TestConditional(TestCase):
+
+    def setUp(self):
+        self._headers = validators(("student", 3, "2024-01-01 10:00:00"))
+        app = FastAPI()
+
+        @app.get("/student")
+        def get_student(request: Request):
+            return not_modified(request, self._headers) or {"id": "S1"}
+
+        self._client = TestClient(app)
+
+    def test_validators(self):
+        self.assertEqual(self._headers["ETag"], 'W/"student-3"')
+        self.assertEqual(self._headers["Last-Modified"], "Mon, 01 Jan 2024 10:00:00 GMT")
+        self.assertEqual(validators(None), {})
+
+    def test_not_modified(self):
+        for headers in ({"If-None-Match": 'W/"student-3"'}, {"If-None-Match": '"student-2", "student-3"'}, {"If-None-Match": "*"}, {"If-Modified-Since": "Mon, 01 Jan 2024 10:00:00 GMT"}):
+            response = self._client.get("/student", headers=headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], 'W/"student-3"')
+            self.assertEqual(response.content, b"")
+        for headers in ({}, {"If-None-Match": 'W/"student-2"'}, {"If-None-Match": 'W/"student-2"', "If-Modified-Since": "Mon, 01 Jan 2024 10:00:00 GMT"}, {"If-Modified-Since": "yesterday"}):
+            self.assertEqual(self._client.get("/student", headers=headers).json(), {"id": "S1"})
+
+
+class TestTableVersion(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        available_snapshot.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "version.db"))
+        create_database(config)
+        self._conn = config.connect(check_same_thread=False)
+        insert_test_data(self._conn)
+        self._conn.commit()
+        log = logging.getLogger()
+        self._student_service = ProfileService(self._conn, "student", log)
+        self._class_service = ClassService(self._conn, "class", "instructor", log)
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", log)
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_writes_bump_version(self):
+        student_version = self._student_service.table_version()
+        class_version = self._class_service.table_version()
+        self._student_service.add_profile(Field(firstName="Foo", lastName="Bar", age=20))
+        self.assertEqual(self._student_service.table_version()[1], student_version[1] + 1)
+        self.assertEqual(self._class_service.table_version(), class_version)
+        # The seat count trigger's update of the class row counts as a class write
+        self._enrollment_service.enroll(Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1))
+        self.assertGreater(self._class_service.table_version()[1], class_version[1])
+
+    def test_unchanged_row_keeps_version(self):
+        class_version = self._class_service.table_version()
+        changes = self._conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+        class_data = self._class_service._class_repository.find_by_attribute({"department": "QUX"})
+        self.assertTrue(self._class_service._class_repository.compareEnrollment(class_data))
+        self._conn.commit()
+        self.assertEqual(self._class_service.table_version(), class_version)
+        self.assertEqual(self._conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0], changes)
+        self._class_service.update_instructor(class_data["id"], "INS101")
+        self.assertEqual(self._class_service.table_version()[1], class_version[1] + 1)
+
+    def test_available_classes_follow_change_log(self):
+        snapshot = self._class_service.available_classes()
+        self._conn.execute("UPDATE class SET max_enrollment = -1")
+        self._conn.commit()
+        refreshed = self._class_service.available_classes()
+        self.assertGreater(refreshed.version()[1], snapshot.version()[1])
+        self.assertEqual(refreshed.classes(), [])
@@ -0,0 +1,137 @@
+from unittest import TestCase
+from events import ChangeDispatcher, EventBus, enrollment_event, event_bus, serve_events, server_sent_events
+from cache import class_cache, waiting_list_index
+from service import EnrollmentService
+from schema import create_database
+from config import DatabaseConfig
+from constant import DatabaseColumn, Events
+from model import Field
+from util import insert_test_data
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from tempfile import TemporaryDirectory
+from time import sleep
+from os import path
+from multiprocessing import get_context
+import asyncio
+import logging
+
+
+QUX_STUDENTS = ("6f68124d-4494-4a61-bd52-dc3b313c6ab7", "52e9c54c-1880-4920-a322-ca7a7bc3c8c7")
+
+
+def enroll_and_drop(database: str):
+    # Runs in another process, whose in-process hooks the test cannot see
+    conn = DatabaseConfig(database).connect()
+    service = EnrollmentService(conn, "enrollment", "class", logging.getLogger())
+    fields = [Field(id=x, department="QUX", courseCode="QUUX", sectionNumber=1) for x in QUX_STUDENTS]
+    for field in fields:
+        service.enroll(field)
+    service.drop_enrollment(fields[0])
+    conn.close()
+
+
+def class_row(class_id: str):
+    return {DatabaseColumn.ID: class_id, DatabaseColumn.DEPARTMENT: "DEP", DatabaseColumn.COURSE_CODE: "COR", DatabaseColumn.SECTION_NUMBER: 1}
+
+
+class TestEventBus(TestCase):
+
+    def test_filters_and_overflow(self):
+        async def consume():
+            bus = EventBus(max_queue=2)
+            with bus.subscribe({"classId": "A", "studentId": None}) as subscription:
+                for class_id in ("B", "A", "A", "A"):
+                    await asyncio.to_thread(bus.publish, enrollment_event(Events.ENROLLED, class_row(class_id), "S1"))
+                await asyncio.sleep(0)
+                events = [await subscription.get(), await subscription.get(), await subscription.get()]
+            return events, bus.stats()
+        events, stats = asyncio.run(consume())
+        self.assertEqual([x and x["classId"] for x in events], ["A", "A", None])
+        self.assertEqual(stats, {"subscribers": 0, "published": 4})
+
+    def test_server_sent_events(self):
+        async def consume():
+            bus = EventBus()
+            stream = server_sent_events(bus.subscribe({"studentId": "S1"}), heartbeat=0.01)
+            chunks = [await anext(stream), await anext(stream)]
+            bus.publish(enrollment_event(Events.PROMOTED, class_row("A"), "S1"))
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks, bus.stats()["subscribers"]
+        chunks, subscribers = asyncio.run(consume())
+        self.assertEqual(chunks[:2], [": subscribed\n\n", ": keepalive\n\n"])
+        self.assertTrue(chunks[2].startswith("event: promoted\ndata: {"))
+        self.assertEqual(subscribers, 0)
+
+    def test_websocket(self):
+        bus = EventBus()
+        app = FastAPI()
+        serve_events(app, bus)
+        with TestClient(app) as client:
+            with client.websocket_connect("/events/ws?department=DEP&sectionNumber=1") as websocket:
+                while bus.stats()["subscribers"] == 0:
+                    sleep(0.01)
+                bus.publish(enrollment_event(Events.DROPPED, class_row("A") | {DatabaseColumn.SECTION_NUMBER: 2}, "S1"))
+                bus.publish(enrollment_event(Events.DROPPED, class_row("B"), "S2"))
+                self.assertEqual(websocket.receive_json()["classId"], "B")
+            while bus.stats()["subscribers"] != 0:
+                sleep(0.01)
+
+
+class TestEnrollmentEvents(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "events.db"))
+        create_database(config)
+        self._database = config.database
+        self._conn = config.connect(check_same_thread=False)
+        insert_test_data(self._conn)
+        self._conn.execute("UPDATE class SET max_enrollment = 1 WHERE department = 'QUX'")
+        self._conn.commit()
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", logging.getLogger())
+        self._dispatcher = ChangeDispatcher(config, event_bus).start()
+
+    def tearDown(self):
+        self._dispatcher.stop()
+        self._conn.close()
+        self._directory.cleanup()
+
+    def assert_promotion_events(self, events: list):
+        self.assertEqual([(x["type"], x["studentId"]) for x in events], [
+            (Events.ENROLLED, QUX_STUDENTS[0]),
+            (Events.WAITING_LIST, QUX_STUDENTS[1]),
+            (Events.DROPPED, QUX_STUDENTS[0]),
+            (Events.PROMOTED, QUX_STUDENTS[1]),
+        ])
+        self.assertEqual([x["currentEnrollment"] for x in events], [1, 2, 1, 1])
+        self.assertEqual({(x["courseCode"], x["maxEnrollment"]) for x in events}, {("QUUX", 1)})
+
+    def test_drop_publishes_promotion(self):
+        fields = [Field(id=x, department="QUX", courseCode="QUUX", sectionNumber=1) for x in QUX_STUDENTS]
+
+        async def consume():
+            with event_bus.subscribe({"department": "QUX"}) as subscription:
+                for field in fields:
+                    await asyncio.to_thread(self._enrollment_service.enroll, field)
+                await asyncio.to_thread(self._enrollment_service.drop_enrollment, fields[0])
+                return [await subscription.get(1.0) for _ in range(4)]
+        self.assert_promotion_events(asyncio.run(consume()))
+
+    def test_writes_of_another_process(self):
+        class_data = self._enrollment_service._class_repository.find_by_attribute({"department": "QUX"})
+        class_cache.put(class_data)
+
+        async def consume():
+            with event_bus.subscribe({"department": "QUX"}) as subscription:
+                process = get_context("spawn").Process(target=enroll_and_drop, args=(self._database,))
+                process.start()
+                await asyncio.to_thread(process.join)
+                self.assertEqual(process.exitcode, 0)
+                return [await subscription.get(5.0) for _ in range(4)]
+        self.assert_promotion_events(asyncio.run(consume()))
+        # The other process changed the seat count behind this process's cache
+        self.assertIsNone(class_cache.get(class_data["id"]))
@@ -0,0 +1,102 @@
+from unittest import TestCase
+from idempotency import IdempotencyMiddleware, IdempotencyStore, StoredResponse
+from schema import create_database
+from config import DatabaseConfig
+from constant import Idempotency
+from fastapi import FastAPI, HTTPException, status
+from fastapi.testclient import TestClient
+from tempfile import TemporaryDirectory
+from os import path
+import asyncio
+import httpx
+
+
+class TestIdempotencyStore(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "idempotency.db"))
+        create_database(config)
+        self._now = 1000.0
+        self._store = IdempotencyStore(config, ttl=60.0, lease=5.0, max_keys=2, clock=lambda: self._now)
+
+    def tearDown(self):
+        self._store.close()
+        self._directory.cleanup()
+
+    def test_claim_complete_and_expire(self):
+        self.assertIsNone(self._store.claim("K1", "F1"))
+        self.assertEqual(self._store.claim("K1", "F1"), ("F1", None, None, None))
+        # A lease left behind by a request that never finished is taken over
+        self._now += 5.0
+        self.assertIsNone(self._store.claim("K1", "F2"))
+        self._store.complete("K1", StoredResponse(200, "application/json", b"{}"))
+        self._now += 30.0
+        self.assertEqual(self._store.claim("K1", "F1"), ("F2", 200, "application/json", b"{}"))
+        self._now += 30.0
+        self.assertIsNone(self._store.claim("K1", "F1"))
+
+    def test_purge_keeps_bound(self):
+        for key in ("K1", "K2", "K3", "K4"):
+            self._store.claim(key, "F")
+            self._store.complete(key, StoredResponse(200, None, b""))
+            self._now += 1.0
+        self.assertEqual(self._store.purge(), 2)
+        self.assertEqual(self._store.stats()["size"], 2)
+        self.assertIsNone(self._store.claim("K1", "F"))
+
+
+class TestIdempotencyMiddleware(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "idempotency.db"))
+        create_database(config)
+        self._store = IdempotencyStore(config)
+        self._calls = 0
+        app = FastAPI()
+        app.add_middleware(IdempotencyMiddleware, store=self._store)
+
+        @app.post("/student")
+        async def add_student(body: dict):
+            self._calls += 1
+            await asyncio.sleep(0.05)
+            return {"call": self._calls} | body
+
+        @app.post("/busy")
+        def busy():
+            self._calls += 1
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="busy")
+
+        self._app = app
+
+    def tearDown(self):
+        self._store.close()
+        self._directory.cleanup()
+
+    def test_replay(self):
+        client = TestClient(self._app)
+        headers = {Idempotency.HEADER: "K1"}
+        first = client.post("/student", json={"age": 20}, headers=headers)
+        second = client.post("/student", json={"age": 20}, headers=headers)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.headers[Idempotency.REPLAYED_HEADER], "true")
+        self.assertNotIn(Idempotency.REPLAYED_HEADER, first.headers)
+        self.assertEqual(client.post("/student", json={"age": 21}, headers=headers).status_code, 400)
+        client.post("/student", json={"age": 20})
+        self.assertEqual(self._calls, 2)
+        # Retryable answers are not kept
+        client.post("/busy", headers={Idempotency.HEADER: "K2"})
+        self.assertEqual(client.post("/busy", headers={Idempotency.HEADER: "K2"}).status_code, 409)
+        self.assertEqual(self._calls, 4)
+        self.assertEqual(client.post("/student", json={}, headers={Idempotency.HEADER: "K" * 300}).status_code, 400)
+
+    def test_concurrent_duplicates_coalesce(self):
+        async def post_all():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self._app), base_url="http://test") as client:
+                return await asyncio.gather(*[client.post("/student", json={"age": 20}, headers={Idempotency.HEADER: "K1"}) for _ in range(3)])
+        responses = asyncio.run(post_all())
+        self.assertEqual(self._calls, 1)
+        self.assertEqual([x.json() for x in responses], [{"call": 1, "age": 20}] * 3)
+        self.assertEqual(sorted(x.headers.get(Idempotency.REPLAYED_HEADER, "") for x in responses), ["", "true", "true"])
+        self.assertEqual(self._store.stats()["coalesced"], 2)
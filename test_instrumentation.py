@@ -0,0 +1,58 @@
+from unittest import TestCase
+from instrumentation import Histogram, Metrics, normalize
+from repository import query_caller, query_hooks
+from service import EnrollmentService, ProfileService
+from model import Field
+from schema import create_database
+from config import DatabaseConfig
+from util import insert_test_data
+from tempfile import TemporaryDirectory
+from os import path
+import logging
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "metrics.db"))
+        create_database(config)
+        self._conn = config.connect()
+        insert_test_data(self._conn)
+        self._metrics = Metrics(slow_query_seconds=0.0)
+        query_hooks.append(self._metrics.record_query)
+
+    def tearDown(self):
+        query_hooks.remove(self._metrics.record_query)
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_histogram_render(self):
+        histogram = Histogram("latency", "Latency", ("route",), (0.1, 1.0))
+        histogram.observe(("/a",), 0.05)
+        histogram.observe(("/a",), 0.5)
+        histogram.observe(("/a",), 5.0)
+        lines = histogram.render()
+        self.assertIn('latency_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{route="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_count{route="/a"} 3', lines)
+
+    def test_normalize(self):
+        self.assertEqual(normalize("SELECT  *\n FROM t WHERE x IN (VALUES (?, ?), (?, ?), (?, ?))"), "SELECT * FROM t WHERE x IN (VALUES (?, ?), ...)")
+
+    def test_query_hook_records_service_caller(self):
+        with self.assertLogs("instrumentation", logging.WARNING):
+            ProfileService(self._conn, "student", logging.getLogger()).get_profile("6f68124d-4494-4a61-bd52-dc3b313c6ab7")
+        rendered = self._metrics.render()
+        self.assertIn('db_query_duration_seconds_count{statement="SELECT * FROM student WHERE id = ?",caller="ProfileService.get_profile"} 1', rendered)
+        self.assertIn('db_query_rows_sum{statement="SELECT * FROM student WHERE id = ?",caller="ProfileService.get_profile"} 1', rendered)
+
+    def test_streamed_query_keeps_service_caller(self):
+        field = Field(department="QUX", courseCode="QUUX", sectionNumber=1)
+        with self.assertLogs("instrumentation", logging.WARNING):
+            rows = EnrollmentService(self._conn, "enrollment", "class", logging.getLogger()).iter_class_enrollment(field, False)
+            self.assertIsNone(query_caller.get())
+            list(rows)
+        self.assertIsNone(query_caller.get())
+        self.assertIn('db_query_duration_seconds_count{statement="SELECT * FROM enrollment WHERE class_id = ? AND dropped = ? AND waiting_list = ? ORDER BY enrolled_on, id",caller="EnrollmentService.iter_class_enrollment"} 1', self._metrics.render())
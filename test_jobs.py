@@ -0,0 +1,144 @@
+from unittest import TestCase
+from jobs import JobWriter, QueuedService, SavepointConnection, WriteQueue, decode_argument, encode_argument
+from instrumentation import Metrics
+from cache import class_cache, waiting_list_index
+from events import ChangeDispatcher, event_bus
+from service import EnrollmentService
+from schema import create_database
+from config import DatabaseConfig, WriteConfig
+from constant import DatabaseColumn, Message, WriteJob
+from model import Field
+from util import insert_test_data
+from starlette.exceptions import HTTPException
+from tempfile import TemporaryDirectory
+from os import path
+import logging
+
+
+class TestJobs(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        self._config = DatabaseConfig(path.join(self._directory.name, "jobs.db"))
+        create_database(self._config)
+        conn = self._config.connect()
+        insert_test_data(conn)
+        conn.close()
+        self._write_config = WriteConfig(poll_interval=0.001, timeout=0.05, lease=5.0)
+        self._queue = WriteQueue(self._config, self._write_config)
+        self._writer = JobWriter(self._config, self._write_config, logging.getLogger())
+
+    def tearDown(self):
+        self._writer.stop()
+        self._queue.close()
+        self._directory.cleanup()
+
+    def test_arguments_round_trip(self):
+        fields = [Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1)]
+        decoded = decode_argument(encode_argument(fields))
+        self.assertEqual(decoded[0].model_dump(exclude_unset=True), fields[0].model_dump(exclude_unset=True))
+        self.assertEqual(decode_argument(encode_argument("QUX")), "QUX")
+
+    def test_submit_and_run(self):
+        field = Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1)
+        first = self._queue.submit("enrollment", "enroll", field)
+        second = self._queue.submit("enrollment", "enroll", Field(id=field.id, department="QUX", courseCode="QUUX", sectionNumber=99))
+        self.assertEqual(self._queue.stats()["queued"], 2)
+        self.assertEqual(self._writer.run_once(), 2)
+        self.assertEqual(self._queue.status(first)[0], WriteJob.DONE)
+        self._queue.result(first)
+        # The writer's HTTPException reaches the caller with its status code
+        with self.assertRaises(HTTPException) as context:
+            self._queue.result(second)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(self._writer.stats()["failed"], 1)
+        with self.assertRaises(ValueError):
+            self._queue.submit("enrollment", "add_student", field)
+        with self.assertRaises(AttributeError):
+            QueuedService(self._queue, "enrollment").add_student
+
+    def test_timeout_and_unknown_ticket(self):
+        ticket = self._queue.submit("class", "delete_class", Field(department="QUX", courseCode="QUUX", sectionNumber=1))
+        with self.assertRaises(HTTPException) as context:
+            self._queue.result(ticket)
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(context.exception.detail["ticket"], ticket)
+        with self.assertRaises(HTTPException) as context:
+            self._queue.result(ticket + 1)
+        self.assertEqual(context.exception.status_code, 404)
+
+    def test_single_leader_and_recovery(self):
+        self.assertEqual(self._writer.run_once(), 0)
+        self.assertTrue(self._writer.stats()["leader"])
+        follower = JobWriter(self._config, WriteConfig(lease=0.0), logging.getLogger())
+        try:
+            self._queue.submit("class", "delete_class", Field(department="QUX", courseCode="QUUX", sectionNumber=1))
+            self.assertEqual(follower.run_once(), 0)
+            self.assertFalse(follower.stats()["leader"])
+            # A job left running by a leader that died is failed when the next leader takes over
+            self._queue._conn.execute(f"UPDATE {WriteJob.TABLE} SET status = ?", [WriteJob.RUNNING])
+            self._writer._release()
+            self.assertEqual(follower.run_once(), 0)
+            self.assertEqual(follower.stats()["recovered"], 1)
+            self.assertEqual(self._queue.status(1), (WriteJob.FAILED, 500, Message.WRITE_RESULT_LOST))
+        finally:
+            follower.stop()
+
+    def test_group_commit(self):
+        metrics = Metrics()
+        writer = JobWriter(self._config, WriteConfig(batch_size=8, batch_window=0.0), logging.getLogger(), metrics=metrics)
+        try:
+            student_id = "6f68124d-4494-4a61-bd52-dc3b313c6ab7"
+            tickets = [self._queue.submit("enrollment", "enroll", Field(id=student_id, department="QUX", courseCode="QUUX", sectionNumber=x)) for x in (1, 99)]
+            tickets.append(self._queue.submit("student", "add_profile", Field(firstName="A", lastName="B", age=20)))
+            dispatcher = ChangeDispatcher(self._config, event_bus)
+            dispatcher.run_once()
+            published = event_bus.stats()["published"]
+            self.assertEqual(writer.run_once(), 3)
+            # Only the enrollment that committed is in the change log
+            dispatcher.run_once()
+            dispatcher.stop()
+            self.assertEqual(event_bus.stats()["published"], published + 1)
+            self.assertEqual(writer.stats()["batches"], 1)
+            # The failing job in the middle of the batch does not undo the others
+            self.assertEqual([self._queue.status(x)[:2] for x in tickets], [(WriteJob.DONE, 200), (WriteJob.FAILED, 400), (WriteJob.DONE, 200)])
+            self.assertEqual(self._queue.result(tickets[2])["first_name"], "A")
+            self.assertIn("write_commit_batch_size_count{} 1", metrics.render())
+            self.assertIn("write_job_latency_seconds_count{} 3", metrics.render())
+        finally:
+            writer.stop()
+
+    def test_savepoint_connection(self):
+        conn = self._config.connect()
+        try:
+            conn.execute("CREATE TABLE item (name TEXT)")
+            conn.execute("BEGIN IMMEDIATE")
+            savepoint = SavepointConnection(conn, [])
+            savepoint.execute("INSERT INTO item VALUES ('kept')")
+            savepoint.commit()
+            savepoint.execute("INSERT INTO item VALUES ('rolled back')")
+            savepoint.rollback()
+            savepoint.execute("INSERT INTO item VALUES ('uncommitted')")
+            savepoint.finish()
+            conn.commit()
+            self.assertEqual([tuple(x) for x in conn.execute("SELECT name FROM item")], [("kept",)])
+        finally:
+            conn.close()
+
+    def test_hooks_wait_for_batch_commit(self):
+        conn = self._config.connect()
+        try:
+            hooks = []
+            published = event_bus.stats()["published"]
+            conn.execute("BEGIN IMMEDIATE")
+            service = EnrollmentService(SavepointConnection(conn, hooks), "enrollment", "class", logging.getLogger())
+            service.enroll(Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX", sectionNumber=1))
+            # The enrollment is only released into the batch, so nothing is published or cached yet
+            self.assertEqual(len(hooks), 1)
+            self.assertEqual(event_bus.stats()["published"], published)
+            self.assertEqual(class_cache.get_by_key(("QUX", "QUUX", 1))[DatabaseColumn.CURRENT_ENROLLMENT], 0)
+            conn.rollback()
+        finally:
+            conn.close()
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from io import StringIO
+from config import LoggingConfig
+from logs import JsonFormatter, RequestIdFilter, SamplingFilter, configure_logging, request_id
+import json
+import logging
+
+
+class TestLogs(TestCase):
+
+    def _record(self, level: int, message: str, *args):
+        return logging.LogRecord("repository.query", level, __file__, 1, message, args, None)
+
+    def test_json_formatter_includes_request_id(self):
+        token = request_id.set("abc123")
+        try:
+            record = self._record(logging.INFO, "Enrolled %s", "student")
+            RequestIdFilter().filter(record)
+        finally:
+            request_id.reset(token)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Enrolled student")
+        self.assertEqual(entry["request_id"], "abc123")
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_sampling_filter(self):
+        self.assertFalse(SamplingFilter(0.0).filter(self._record(logging.DEBUG, "query")))
+        self.assertTrue(SamplingFilter(0.0).filter(self._record(logging.INFO, "query")))
+        self.assertTrue(SamplingFilter(1.0).filter(self._record(logging.DEBUG, "query")))
+
+    def test_configure_logging(self):
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        query_log = logging.getLogger("repository.query")
+        filters = list(query_log.filters)
+        stream = StringIO()
+        listener = configure_logging(LoggingConfig(level="debug", format="json", query_sample_rate=0.0), stream)
+        try:
+            logging.getLogger("repository.query").debug("Executing select query")
+            logging.getLogger("service").info("Added class %s", "CS101")
+        finally:
+            listener.stop()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            for handler in handlers:
+                root.addHandler(handler)
+            root.setLevel(level)
+            query_log.filters = filters
+        lines = [json.loads(x) for x in stream.getvalue().splitlines()]
+        self.assertEqual([x["message"] for x in lines], ["Added class CS101"])
+        self.assertEqual(lines[0]["logger"], "service")
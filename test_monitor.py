@@ -0,0 +1,55 @@
+from unittest import TestCase
+from monitor import ChangeFeed, Dashboard
+from cache import class_cache, waiting_list_index
+from service import EnrollmentService
+from schema import create_database
+from config import DatabaseConfig
+from model import Field
+from util import insert_test_data
+from sqlite3 import OperationalError
+from tempfile import TemporaryDirectory
+from os import path
+import logging
+
+
+class TestMonitor(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "monitor.db"))
+        create_database(config)
+        self._conn = config.connect(check_same_thread=False)
+        insert_test_data(self._conn)
+        self._conn.execute("UPDATE class SET max_enrollment = 1 WHERE department = 'QUX'")
+        self._conn.commit()
+        self._reader = config.connect_read_only()
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", logging.getLogger())
+
+    def tearDown(self):
+        self._reader.close()
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_read_only(self):
+        with self.assertRaises(OperationalError):
+            self._reader.execute("DELETE FROM change_log")
+
+    def test_tail_changes(self):
+        feed = ChangeFeed(self._reader)
+        dashboard = Dashboard(self._reader)
+        self.assertEqual(feed.poll(), ({}, set(), 0))
+        for student_id in ("6f68124d-4494-4a61-bd52-dc3b313c6ab7", "52e9c54c-1880-4920-a322-ca7a7bc3c8c7"):
+            self._enrollment_service.enroll(Field(id=student_id, department="QUX", courseCode="QUUX", sectionNumber=1))
+        counts, class_ids, missed = feed.poll()
+        self.assertEqual(counts[("enrollment", "insert")], 2)
+        self.assertEqual(len(class_ids), 1)
+        self.assertEqual(missed, 0)
+        dashboard.apply(counts, class_ids, missed, 2.0)
+        render = dashboard.render(1)
+        self.assertIn("enrollments/sec 1.0", render)
+        self.assertIn("QUX QUUX-1", render.splitlines()[-1])
+        self.assertEqual(render.splitlines()[-1].split()[-2:], ["0", "1"])
+        # From seq 0 the test data inserted before the feed started is read too
+        self.assertGreater(ChangeFeed(self._reader, 0).poll()[0][("student", "insert")], 0)
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from pool import ConnectionPool, PoolExhaustedError
+from config import DatabaseConfig
+from tempfile import TemporaryDirectory
+from threading import Thread, Event
+from os import path
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        self._pool = ConnectionPool(DatabaseConfig(path.join(self._directory.name, "pool.db"), max_readers=2, pool_timeout=0.1))
+
+    def tearDown(self):
+        self._pool.close()
+        self._directory.cleanup()
+
+    def test_reader_is_thread_affine(self):
+        with self._pool.reader() as first:
+            pass
+        with self._pool.reader() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_reader_exhaustion(self):
+        with self._pool.reader(), self._pool.reader():
+            with self.assertRaises(PoolExhaustedError):
+                with self._pool.reader():
+                    pass
+        self.assertEqual(self._pool.stats()["exhausted"], 1)
+        self.assertEqual(self._pool.stats()["in_use"], 0)
+
+    def test_single_writer_lane(self):
+        acquired = Event()
+        release = Event()
+
+        def hold_writer():
+            with self._pool.writer():
+                acquired.set()
+                release.wait()
+
+        thread = Thread(target=hold_writer)
+        thread.start()
+        acquired.wait()
+        with self.assertRaises(PoolExhaustedError):
+            with self._pool.writer():
+                pass
+        release.set()
+        thread.join()
+        with self._pool.writer() as conn:
+            self.assertEqual(conn.execute("SELECT 1").fetchone()[0], 1)
+
+    def test_writer_rolls_back_uncommitted_work(self):
+        with self._pool.writer() as conn:
+            conn.execute("CREATE TABLE item (id INTEGER)")
+            conn.commit()
+            conn.execute("INSERT INTO item VALUES (1)")
+        with self._pool.reader() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM item").fetchone()[0], 0)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from records import EnrollmentRecord, encode_rows, row_factory
+from pagination import FastJSONResponse, json_array
+from constant import Batch, DatabaseColumn
+from serialization import CODECS, stdlib_dumps, use_codec
+from datetime import datetime
+import json
+
+
+class TestRecords(TestCase):
+
+    def setUp(self):
+        self._record = EnrollmentRecord("E1", "S1", "C1", "2024-01-01 10:00:00", 0, 1)
+
+    def test_record_reads_like_a_dict(self):
+        self.assertEqual(self._record[DatabaseColumn.STUDENT_ID], "S1")
+        self.assertEqual(self._record[0], "E1")
+        self.assertEqual(self._record.get(DatabaseColumn.WAITING_LIST), 1)
+        self.assertIsNone(self._record.get("missing"))
+        with self.assertRaises(KeyError):
+            self._record["missing"]
+        self.assertEqual(self._record.to_response()["enrolledOn"], "2024-01-01 10:00:00")
+        self.assertFalse(hasattr(self._record, "__dict__"))
+
+    def test_row_factory(self):
+        description = [(x, None, None, None, None, None, None) for x in EnrollmentRecord._fields]
+        self.assertEqual(row_factory("enrollment", description)(tuple(self._record)), self._record)
+        self.assertEqual(row_factory("enrollment", description[:2])(("E1", "S1")), {"id": "E1", "student_id": "S1"})
+
+    def test_json_array(self):
+        self.assertEqual(json.loads(encode_rows([self._record, {"id": "E2"}])), [dict(self._record.items()), {"id": "E2"}])
+        for count in (0, 1, Batch.FETCH_SIZE, Batch.FETCH_SIZE + 1):
+            rows = [self._record] * count
+            self.assertEqual(json.loads(b"".join(json_array(rows))), [dict(self._record.items())] * count)
+
+    def test_encoded_like_the_codec(self):
+        rows = [self._record, EnrollmentRecord("E\"2", "S\u00e9", None, 1.5, True, 0)]
+        self.assertEqual(json.loads(encode_rows(rows)), json.loads(stdlib_dumps([dict(x.items()) for x in rows])))
+        self.assertTrue(encode_rows(rows).isascii())
+        self.assertEqual(encode_rows([]), b"[]")
+        for name in CODECS:
+            try:
+                use_codec(name)
+                self.assertEqual(json.loads(encode_rows(rows + [{"id": "E3"}])), [dict(x.items()) for x in rows] + [{"id": "E3"}])
+            finally:
+                use_codec("stdlib")
+
+    def test_codecs_agree(self):
+        content = [dict(self._record.items()), {"id": "E2", "enrolled_on": datetime(2024, 1, 1, 10), "nested": {"count": 1}}]
+        bodies = {name: json.loads(dumps(content)) for name, dumps in CODECS.items()}
+        for body in bodies.values():
+            self.assertEqual(body[0], dict(self._record.items()))
+            self.assertEqual(body[1]["nested"], {"count": 1})
+            self.assertTrue(body[1]["enrolled_on"].startswith("2024-01-01"))
+
+    def test_use_codec(self):
+        try:
+            self.assertEqual(use_codec("missing"), "stdlib")
+            self.assertEqual(json.loads(FastJSONResponse({"id": "E1"}).body), {"id": "E1"})
+        finally:
+            use_codec("stdlib")
@@ -1,8 +1,10 @@
 from unittest import TestCase
-from repository import ClassRepository
+from repository import ClassRepository, StatementCache, statement_cache
 from sqlite3 import connect, Row
-from util import DatabaseColumn, insert_test_data, clear_tables
-from constant import Query
+from util import insert_test_data, clear_tables
+from constant import DatabaseColumn, Query
+from schema import create_database
+from config import DatabaseConfig
 import logging
 
 
@@ -12,6 +14,7 @@ class TestClassRepository(TestCase):
     def setUp(cls):
         logger = logging.getLogger()
         logging.basicConfig(level=logging.DEBUG)
+        create_database(DatabaseConfig("database.db"))
         conn = connect("database.db", check_same_thread=False)
         conn.execute("PRAGMA foreign_keys = ON")
         clear_tables(conn)
@@ -29,7 +32,7 @@ class TestClassRepository(TestCase):
 
     def test_save(self):
         class_data = {
-            DatabaseColumn.INSTRUCTOR_ID: "INS",
+            DatabaseColumn.INSTRUCTOR_ID: "INS101",
             DatabaseColumn.DEPARTMENT: "DEP",
             DatabaseColumn.COURSE_CODE: "COR",
             DatabaseColumn.SECTION_NUMBER: 1,
@@ -46,7 +49,7 @@ class TestClassRepository(TestCase):
             DatabaseColumn.ID: "c25ccf22-4539-4810-b78b-81049b546bf1"
         }
         class_data = {
-            DatabaseColumn.INSTRUCTOR_ID: "INS",
+            DatabaseColumn.INSTRUCTOR_ID: "INS101",
             DatabaseColumn.DEPARTMENT: "DEP",
             DatabaseColumn.COURSE_CODE: "COR",
             DatabaseColumn.SECTION_NUMBER: 1,
@@ -65,7 +68,7 @@ class TestClassRepository(TestCase):
                 DatabaseColumn.INSTRUCTOR_ID: "INS101",
                 DatabaseColumn.DEPARTMENT: "FOO",
                 DatabaseColumn.COURSE_CODE: "BAR",
-                DatabaseColumn.SECTION_NUMBER: 1,
+                DatabaseColumn.SECTION_NUMBER: 2,
                 DatabaseColumn.CLASS_NAME: "BAZ",
                 DatabaseColumn.CURRENT_ENROLLMENT: 0,
                 DatabaseColumn.MAX_ENROLLMENT: 10,
@@ -75,7 +78,7 @@ class TestClassRepository(TestCase):
                 DatabaseColumn.INSTRUCTOR_ID: "INS102",
                 DatabaseColumn.DEPARTMENT: "QUX",
                 DatabaseColumn.COURSE_CODE: "QUUX",
-                DatabaseColumn.SECTION_NUMBER: 1,
+                DatabaseColumn.SECTION_NUMBER: 2,
                 DatabaseColumn.CLASS_NAME: "CORGE",
                 DatabaseColumn.CURRENT_ENROLLMENT: 0,
                 DatabaseColumn.MAX_ENROLLMENT: 10,
@@ -102,3 +105,26 @@ class TestClassRepository(TestCase):
 
     def test_count_by_attribute(self):
         self.assertEqual(self._class_repository.count_by_attribute({DatabaseColumn.MAX_ENROLLMENT: 10, DatabaseColumn.AUTOMATIC_ENROLLMENT_FROZEN: False}), 1)
+
+    def test_statement_cache(self):
+        cache = StatementCache(max_size=2)
+        hits = statement_cache.stats()["hits"]
+        first, _ = self._class_repository._prepare_find_all({DatabaseColumn.INSTRUCTOR_ID: "INS101"}, DatabaseColumn.AND)
+        second, _ = self._class_repository._prepare_find_all({DatabaseColumn.INSTRUCTOR_ID: "INS102"}, DatabaseColumn.AND)
+        self.assertIs(first, second)
+        self.assertGreater(statement_cache.stats()["hits"], hits)
+        self.assertEqual(cache.get(("a",), lambda: "A"), "A")
+        self.assertEqual(cache.get(("b",), lambda: "B"), "B")
+        self.assertEqual(cache.get(("a",), lambda: "X"), "A")
+        self.assertEqual(cache.get(("c",), lambda: "C"), "C")
+        self.assertEqual(cache.get(("b",), lambda: "Y"), "Y")
+        self.assertEqual(cache.stats(), {"size": 2, "max_size": 2, "hits": 1, "misses": 4})
+
+    def test_iter_page(self):
+        order_by = (DatabaseColumn.DEPARTMENT, DatabaseColumn.COURSE_CODE, DatabaseColumn.SECTION_NUMBER)
+        first_page = list(self._class_repository.iter_page({}, order_by, limit=2))
+        self.assertEqual(len(first_page), 2)
+        last = first_page[-1]
+        second_page = list(self._class_repository.iter_page({}, order_by, tuple(last[x] for x in order_by), 2))
+        self.assertEqual(len(first_page) + len(second_page), self._init_count)
+        self.assertTrue(all((x[DatabaseColumn.DEPARTMENT], x[DatabaseColumn.COURSE_CODE]) > (last[DatabaseColumn.DEPARTMENT], last[DatabaseColumn.COURSE_CODE]) for x in second_page))
@@ -0,0 +1,95 @@
+from unittest import TestCase
+from schema import MIGRATIONS, create_database, migrate, schema_version
+from config import DatabaseConfig
+from tempfile import TemporaryDirectory
+from service import ClassService, EnrollmentService, ProfileService
+from cache import available_snapshot
+from model import Field
+from util import insert_test_data
+from sqlite3 import IntegrityError, connect, Row
+from os import path
+import logging
+
+
+class TestSchema(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        self._config = DatabaseConfig(path.join(self._directory.name, "schema.db"))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_create_database(self):
+        applied = create_database(self._config)
+        conn = connect(self._config.database)
+        self.assertEqual(applied, [version for version, _ in MIGRATIONS])
+        self.assertEqual(schema_version(conn), MIGRATIONS[-1][0])
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        conn.close()
+
+    def test_migrations_apply_once(self):
+        create_database(self._config)
+        self.assertEqual(create_database(self._config), [])
+
+    def test_duplicate_natural_keys_are_reported(self):
+        conn = connect(self._config.database, isolation_level=None)
+        for statement in MIGRATIONS[0][1]:
+            conn.execute(statement)
+        conn.execute("PRAGMA user_version = 1")
+        conn.execute("INSERT INTO instructor (id, first_name, last_name, age) VALUES ('I1', 'A', 'B', 40)")
+        for class_id in ("C1", "C2"):
+            conn.execute("INSERT INTO class VALUES (?, 'I1', 'QUX', 'QUUX', 1, 'CORGE', 0, 10, false)", [class_id])
+        with self.assertRaisesRegex(IntegrityError, r"\('QUX', 'QUUX', 1\)"):
+            migrate(conn)
+        self.assertEqual(schema_version(conn), 1)
+        conn.execute("UPDATE class SET section_number = 2 WHERE id = 'C2'")
+        self.assertEqual(migrate(conn)[0], 2)
+        conn.close()
+
+
+class TestQueryPlan(TestCase):
+
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "plan.db"))
+        create_database(config)
+        conn = connect(config.database, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.row_factory = Row
+        insert_test_data(conn)
+        self._statements = []
+        conn.set_trace_callback(self._statements.append)
+        self._conn = conn
+        logger = logging.getLogger()
+        self._class_service = ClassService(conn, "class", "instructor", logger)
+        self._enrollment_service = EnrollmentService(conn, "enrollment", "class", logger)
+        self._student_service = ProfileService(conn, "student", logger)
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_repository_queries_use_index(self):
+        field = Field(department="QUX", courseCode="QUUX", sectionNumber=1, id="6f68124d-4494-4a61-bd52-dc3b313c6ab7")
+        self._student_service.get_profile(field.id)
+        available_snapshot.clear()
+        self._class_service.available_classes()
+        self._class_service.update_instructor("9cfaf63d-77db-4d7e-b72b-2a1d2fd1b57a", "INS101")
+        self._enrollment_service.enroll(field)
+        self._class_service.available_classes()
+        self._enrollment_service.class_enrollment(field, False)
+        self._enrollment_service.drop_enrollment(field)
+        self._enrollment_service.dropped_student(field)
+        list(self._class_service.iter_available_classes(department="QUX", after=("QUX", "QUUX", 0), limit=2))
+        list(self._enrollment_service.iter_class_enrollment(field, False, ("", ""), 2))
+        self._enrollment_service._enrollment_repository.waitingListPosition("9cfaf63d-77db-4d7e-b72b-2a1d2fd1b57a", field.id)
+        self._conn.set_trace_callback(None)
+
+        statements = [x for x in self._statements if x.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+        self.assertNotEqual(len(statements), 0)
+        for statement in statements:
+            plan = [x[3] for x in self._conn.execute(f"EXPLAIN QUERY PLAN {statement}", [None] * statement.count("?"))]
+            for detail in plan:
+                if detail.startswith("SCAN ") and not detail.startswith("SCAN (subquery"):
+                    self.fail(f"Full table scan in [{statement}]: {plan}")
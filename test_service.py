@@ -1,8 +1,17 @@
 from unittest import TestCase
 from sqlite3 import connect, Row
-from service import ProfileService
-from constant import DatabaseColumn, Query
-from util import Field, insert_test_data, clear_tables
+from service import EnrollmentService, ProfileService
+from constant import DatabaseColumn, EnrollmentStatus, Message, Query
+from model import Field
+from util import insert_test_data, clear_tables
+from schema import create_database
+from config import DatabaseConfig
+from cache import class_cache, waiting_list_index
+from starlette import status
+from starlette.exceptions import HTTPException
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from os import path
 import logging
 
 class TestStudentProfileService(TestCase):
@@ -11,6 +20,9 @@ class TestStudentProfileService(TestCase):
     def setUp(cls):
         logger = logging.getLogger()
         logging.basicConfig(level=logging.DEBUG)
+        class_cache.clear()
+        waiting_list_index.clear()
+        create_database(DatabaseConfig("database.db"))
         conn = connect("database.db", check_same_thread=False)
         conn.execute("PRAGMA foreign_keys = ON")
         conn.row_factory = Row
@@ -65,3 +77,141 @@ class TestStudentProfileService(TestCase):
         self._student_service.delete_profile(student_id)
         count = self._conn.execute(Query.STUDENT_COUNT).fetchone()[0]
         self.assertEqual(count, self._init_count-1)
+
+
+class TestEnrollmentConcurrency(TestCase):
+
+    STUDENT_COUNT = 40
+    MAX_ENROLLMENT = 5
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        self._config = DatabaseConfig(path.join(self._directory.name, "concurrency.db"))
+        create_database(self._config)
+        conn = connect(self._config.database)
+        insert_test_data(conn)
+        conn.execute("UPDATE class SET max_enrollment = ? WHERE department = 'QUX'", [self.MAX_ENROLLMENT])
+        conn.executemany("INSERT INTO student (id, first_name, last_name, age) VALUES (?, 'Foo', 'Bar', 20)", [[f"STU{x}"] for x in range(self.STUDENT_COUNT)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_concurrent_enrollment_never_oversells(self):
+        barrier = Barrier(self.STUDENT_COUNT)
+        outcomes = []
+
+        def enroll(student_id: str):
+            conn = connect(self._config.database, check_same_thread=False, timeout=30)
+            self._config.apply_pragmas(conn)
+            conn.row_factory = Row
+            service = EnrollmentService(conn, "enrollment", "class", logging.getLogger())
+            barrier.wait()
+            try:
+                service.enroll(Field(id=student_id, department="QUX", courseCode="QUUX"))
+                outcomes.append(status.HTTP_200_OK)
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+            finally:
+                conn.close()
+
+        threads = [Thread(target=enroll, args=[f"STU{x}"]) for x in range(self.STUDENT_COUNT)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        conn = connect(self._config.database)
+        current = conn.execute("SELECT current_enrollment FROM class WHERE department = 'QUX'").fetchone()[0]
+        seated = conn.execute("SELECT COUNT(*) FROM enrollment WHERE waiting_list = false").fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM enrollment").fetchone()[0]
+        conn.close()
+        self.assertEqual(len(outcomes), self.STUDENT_COUNT)
+        self.assertEqual(outcomes.count(status.HTTP_200_OK), total)
+        self.assertEqual(current, total)
+        self.assertEqual(seated, self.MAX_ENROLLMENT)
+        self.assertLessEqual(total, self.MAX_ENROLLMENT + 15)
+
+
+class TestBulkEnrollment(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "bulk.db"))
+        create_database(config)
+        conn = connect(config.database)
+        config.apply_pragmas(conn)
+        conn.row_factory = Row
+        insert_test_data(conn)
+        conn.execute("UPDATE class SET max_enrollment = 1 WHERE department = 'QUX'")
+        conn.commit()
+        self._conn = conn
+        self._enrollment_service = EnrollmentService(conn, "enrollment", "class", logging.getLogger())
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_bulk_enroll(self):
+        fields = [
+            Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX"),
+            Field(id="52e9c54c-1880-4920-a322-ca7a7bc3c8c7", department="QUX", courseCode="QUUX"),
+            Field(id="41359222-8d72-4dd7-a697-91bd5146aa58", department="FOO", courseCode="BAR"),
+            Field(id="41359222-8d72-4dd7-a697-91bd5146aa58", department="NOPE", courseCode="BAR"),
+            Field(id="STU404", department="QUX", courseCode="QUUX"),
+        ]
+        results = self._enrollment_service.bulk_enroll(fields)
+        self.assertEqual([x["status"] for x in results], [EnrollmentStatus.ENROLLED, EnrollmentStatus.WAITING_LIST, EnrollmentStatus.REJECTED, EnrollmentStatus.REJECTED, EnrollmentStatus.REJECTED])
+        self.assertEqual([x.get("detail") for x in results[2:]], [Message.ENROLLMENT_FROZEN, Message.CLASS_DOES_NOT_EXISTS, Message.STUDENT_DOES_NOT_EXISTS])
+        current = self._conn.execute("SELECT current_enrollment FROM class WHERE department = 'QUX'").fetchone()[0]
+        self.assertEqual(current, 2)
+        self.assertEqual(self._conn.execute("SELECT COUNT(*) FROM enrollment").fetchone()[0], 2)
+
+
+class TestEnrollmentCounts(TestCase):
+
+    CLASS_ID = "9cfaf63d-77db-4d7e-b72b-2a1d2fd1b57a"
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "counts.db"))
+        create_database(config)
+        self._conn = config.connect()
+        insert_test_data(self._conn)
+        self._enrollment_service = EnrollmentService(self._conn, "enrollment", "class", logging.getLogger())
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def _current_enrollment(self):
+        return self._conn.execute("SELECT current_enrollment FROM class WHERE id = ?", [self.CLASS_ID]).fetchone()[0]
+
+    def test_triggers_follow_enrollment_rows(self):
+        self._conn.execute("INSERT INTO enrollment VALUES ('E1', '6f68124d-4494-4a61-bd52-dc3b313c6ab7', ?, '2024-01-01', false, false)", [self.CLASS_ID])
+        self._conn.execute("INSERT INTO enrollment VALUES ('E2', '52e9c54c-1880-4920-a322-ca7a7bc3c8c7', ?, '2024-01-01', true, false)", [self.CLASS_ID])
+        self.assertEqual(self._current_enrollment(), 1)
+        self._conn.execute("UPDATE enrollment SET dropped = false WHERE id = 'E2'")
+        self.assertEqual(self._current_enrollment(), 2)
+        self._conn.execute("UPDATE enrollment SET waiting_list = true WHERE id = 'E2'")
+        self._conn.execute("DELETE FROM enrollment WHERE id = 'E1'")
+        self.assertEqual(self._current_enrollment(), 1)
+
+    def test_reconcile_enrollment_counts(self):
+        field = Field(id="6f68124d-4494-4a61-bd52-dc3b313c6ab7", department="QUX", courseCode="QUUX")
+        self._enrollment_service.enroll(field)
+        self.assertEqual(self._enrollment_service.reconcile_enrollment_counts(), [])
+        self._conn.execute("UPDATE class SET current_enrollment = 5 WHERE id = ?", [self.CLASS_ID])
+        self._conn.commit()
+        drift = [{"classId": self.CLASS_ID, "stored": 5, "actual": 1}]
+        self.assertEqual(self._enrollment_service.reconcile_enrollment_counts(), drift)
+        self.assertEqual(self._enrollment_service.reconcile_enrollment_counts(repair=True), drift)
+        self.assertEqual(self._current_enrollment(), 1)
+        self.assertEqual(self._enrollment_service.reconcile_enrollment_counts(), [])
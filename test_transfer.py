@@ -0,0 +1,98 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+from transfer import async_export_rows, async_import_records, export_rows, import_records, read_records
+from async_pool import AsyncConnectionPool
+from async_service import AsyncProfileService
+from schema import create_database
+from config import DatabaseConfig
+from cache import class_cache, waiting_list_index
+from util import insert_test_data
+from tempfile import TemporaryDirectory
+from io import StringIO
+from os import path
+import json
+import logging
+
+
+class TestTransfer(TestCase):
+
+    def setUp(self):
+        class_cache.clear()
+        waiting_list_index.clear()
+        self._directory = TemporaryDirectory()
+        config = DatabaseConfig(path.join(self._directory.name, "transfer.db"))
+        create_database(config)
+        self._conn = config.connect()
+        insert_test_data(self._conn)
+        self._log = logging.getLogger()
+
+    def tearDown(self):
+        self._conn.close()
+        self._directory.cleanup()
+
+    def test_import_csv_reports_rejected_rows(self):
+        lines = StringIO("firstName,lastName,age\nGault,Graply,19\n,Waldo,20\nFred,Plugh,abc\nXyzzy,Thud,200\n")
+        report = import_records(self._conn, "student", read_records(lines, "csv"), self._log, chunk_size=2)
+        self.assertEqual(report["imported"], 1)
+        self.assertEqual(report["rejected"], 3)
+        self.assertEqual([x["line"] for x in report["errors"]], [3, 4, 5])
+        self.assertEqual(self._conn.execute("SELECT COUNT(*) FROM student WHERE first_name = 'Gault'").fetchone()[0], 1)
+
+    def test_import_ndjson_classes(self):
+        rows = [
+            {"instructorId": "INS101", "department": "NEW", "courseCode": "C1", "className": "Intro", "maxEnrollment": 30},
+            {"instructorId": "INS404", "department": "NEW", "courseCode": "C2", "className": "Intro"},
+            {"instructorId": "INS101", "department": "FOO", "courseCode": "BAR", "className": "Duplicate"},
+        ]
+        lines = StringIO("\n".join([json.dumps(x) for x in rows]) + "\nnot json\n")
+        report = import_records(self._conn, "class", read_records(lines, "ndjson"), self._log)
+        self.assertEqual(report["imported"], 1)
+        self.assertEqual([x["line"] for x in report["errors"]], [2, 3, 4])
+
+    def test_import_rejects_existing_ids(self):
+        lines = StringIO("id,firstName,lastName,age\n6f68124d-4494-4a61-bd52-dc3b313c6ab7,New,Name,30\nS1,Gault,Graply,19\nS1,Fred,Plugh,20\n")
+        report = import_records(self._conn, "student", read_records(lines, "csv"), self._log)
+        self.assertEqual(report["imported"], 1)
+        self.assertEqual([(x["line"], x["errors"]) for x in report["errors"]], [(2, ["Profile already exists"]), (4, ["Profile already exists"])])
+        self.assertEqual(self._conn.execute("SELECT first_name FROM student WHERE id = '6f68124d-4494-4a61-bd52-dc3b313c6ab7'").fetchone()[0], "Foo")
+
+    def test_export_round_trip(self):
+        exported = "".join(export_rows(self._conn, "student", "csv", self._log, batch_size=1))
+        self._conn.execute("DELETE FROM student")
+        report = import_records(self._conn, "student", read_records(StringIO(exported), "csv"), self._log)
+        self.assertEqual(report["imported"], 3)
+        ndjson = [json.loads(x) for x in "".join(export_rows(self._conn, "student", "ndjson", self._log)).splitlines()]
+        self.assertEqual(sorted([x["firstName"] for x in ndjson]), ["Baz", "Foo", "Quux"])
+
+
+class TestAsyncTransfer(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._directory = TemporaryDirectory()
+        self._config = DatabaseConfig(path.join(self._directory.name, "transfer.db"))
+        create_database(self._config)
+        conn = self._config.connect()
+        insert_test_data(conn)
+        conn.close()
+        self._pool = AsyncConnectionPool(self._config)
+        self._log = logging.getLogger()
+
+    async def asyncTearDown(self):
+        await self._pool.close()
+        self._directory.cleanup()
+
+    async def test_import_on_pool_writer(self):
+        lines = StringIO("id,firstName,lastName,age\n6f68124d-4494-4a61-bd52-dc3b313c6ab7,New,Name,30\n,Gault,Graply,19\n,Fred,Plugh,20\n")
+        report = await self._pool.submit(lambda conn: async_import_records(conn, AsyncProfileService(conn, "student", self._log), "student", read_records(lines, "csv"), self._log, chunk_size=2, commit_size=1))
+        self.assertEqual((report["imported"], report["rejected"]), (2, 1))
+        async with self._pool.reader() as conn:
+            self.assertEqual((await (await conn.execute("SELECT COUNT(*) FROM student")).fetchone())[0], 5)
+
+    async def test_export_on_pool_reader(self):
+        conn = self._config.connect()
+        try:
+            expected = "".join(export_rows(conn, "class", "ndjson", self._log))
+        finally:
+            conn.close()
+        async with self._pool.reader() as conn:
+            self.assertEqual("".join([x async for x in async_export_rows(conn, "class", "ndjson", self._log, batch_size=1)]), expected)
+        self.assertEqual(self._pool.stats()["reader_connections"], 1)
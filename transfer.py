@@ -0,0 +1,219 @@
+#!/bin/python3
+
+import csv
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+from io import StringIO, TextIOWrapper
+from tempfile import SpooledTemporaryFile
+from sqlite3 import Connection
+from logging import Logger
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from repository import BasicRepository
+from async_repository import AsyncBasicRepository
+from service import ClassService, ProfileService
+from config import DatabaseConfig
+from schema import create_database
+from util import prepare_response_dict
+from records import Record
+from serialization import STDLIB_ENCODER
+from constant import Batch
+
+
+IMPORT_TABLES = {
+    "student": lambda conn, log: ProfileService(conn, "student", log),
+    "instructor": lambda conn, log: ProfileService(conn, "instructor", log),
+    "class": lambda conn, log: ClassService(conn, "class", "instructor", log),
+}
+EXPORT_TABLES = ("student", "instructor", "class", "enrollment")
+FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def validate_transfer(table_name: str, format: str, tables):
+    if table_name not in tables:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Table must be one of {', '.join(tables)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Format must be one of {', '.join(FORMATS)}")
+
+
+async def spool_request(request: Request):
+    # The body is buffered in memory up to IMPORT_SPOOL_SIZE and on disk beyond it, then parsed line by line
+    body = SpooledTemporaryFile(max_size=Batch.IMPORT_SPOOL_SIZE)
+    async for chunk in request.stream():
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+def import_spooled(conn: Connection, table_name: str, format: str, body, log: Logger):
+    with TextIOWrapper(body, encoding="utf-8", newline="") as lines:
+        return import_records(conn, table_name, read_records(lines, format), log)
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # Empty cells count as missing so optional columns fall back to their defaults
+        yield reader.line_num, {key: value for key, value in row.items() if value != ""}
+
+
+def read_ndjson(lines):
+    for line_number, line in enumerate(lines, 1):
+        if line.strip() == "":
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError:
+            yield line_number, None
+
+
+def read_records(lines, format: str):
+    return read_csv(lines) if format == "csv" else read_ndjson(lines)
+
+
+def import_records(conn: Connection, table_name: str, records, log: Logger, chunk_size: int = Batch.IMPORT_CHUNK_SIZE, commit_size: int = Batch.IMPORT_COMMIT_SIZE):
+    service = IMPORT_TABLES[table_name](conn, log)
+    report = {"imported": 0, "rejected": 0, "errors": []}
+    uncommitted = 0
+    try:
+        for chunk in chunked(records, chunk_size):
+            uncommitted += add_to_report(report, *service.import_chunk(chunk))
+            if uncommitted >= commit_size:
+                conn.commit()
+                uncommitted = 0
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    log.info("Imported %s rows into %s, rejected %s", report["imported"], table_name, report["rejected"])
+    return report
+
+
+async def async_import_spooled(conn, service, table_name: str, format: str, body, log: Logger):
+    with TextIOWrapper(body, encoding="utf-8", newline="") as lines:
+        return await async_import_records(conn, service, table_name, read_records(lines, format), log)
+
+
+async def async_import_records(conn, service, table_name: str, records, log: Logger, chunk_size: int = Batch.IMPORT_CHUNK_SIZE, commit_size: int = Batch.IMPORT_COMMIT_SIZE):
+    # Each chunk is read and parsed in the thread pool, so a large body does not block the event loop
+    chunks = chunked(records, chunk_size)
+    report = {"imported": 0, "rejected": 0, "errors": []}
+    uncommitted = 0
+    try:
+        while (chunk := await run_in_threadpool(next, chunks, None)) is not None:
+            uncommitted += add_to_report(report, *await service.import_chunk(chunk))
+            if uncommitted >= commit_size:
+                await conn.commit()
+                uncommitted = 0
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+    log.info("Imported %s rows into %s, rejected %s", report["imported"], table_name, report["rejected"])
+    return report
+
+
+def chunked(records, chunk_size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) != 0:
+        yield chunk
+
+
+def add_to_report(report: dict, imported: int, rejected: list):
+    rejected.sort(key=lambda x: x["line"])
+    report["imported"] += imported
+    report["rejected"] += len(rejected)
+    report["errors"].extend(rejected[:Batch.MAX_REPORTED_REJECTIONS - len(report["errors"])])
+    return imported
+
+
+class ExportBuffer:
+    # Formats exported rows and hands them back in chunks of about Batch.EXPORT_BUFFER_SIZE
+
+    def __init__(self, format: str):
+        self._format = format
+        self._buffer = StringIO()
+        self._writer = csv.writer(self._buffer) if format == "csv" else None
+        self._header = format != "csv"
+
+    def add(self, row):
+        # Returns a chunk once the buffer is full, otherwise None
+        row = row.to_response() if isinstance(row, Record) else prepare_response_dict(row)
+        if not self._header:
+            self._writer.writerow(row.keys())
+            self._header = True
+        if self._format == "csv":
+            self._writer.writerow(row.values())
+        else:
+            self._buffer.write(STDLIB_ENCODER.encode(row))
+            self._buffer.write("\n")
+        return self.flush() if self._buffer.tell() >= Batch.EXPORT_BUFFER_SIZE else None
+
+    def flush(self):
+        if self._buffer.tell() == 0:
+            return None
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+
+def export_rows(conn: Connection, table_name: str, format: str, log: Logger, batch_size: int = Batch.FETCH_SIZE):
+    buffer = ExportBuffer(format)
+    for row in BasicRepository(conn, table_name, log).iter_by_attribute(batch_size=batch_size):
+        if (chunk := buffer.add(row)) is not None:
+            yield chunk
+    if (chunk := buffer.flush()) is not None:
+        yield chunk
+
+
+async def async_export_rows(conn, table_name: str, format: str, log: Logger, batch_size: int = Batch.FETCH_SIZE):
+    buffer = ExportBuffer(format)
+    async for row in AsyncBasicRepository(conn, table_name, log).iter_by_attribute(batch_size=batch_size):
+        if (chunk := buffer.add(row)) is not None:
+            yield chunk
+    if (chunk := buffer.flush()) is not None:
+        yield chunk
+
+
+def run():
+    parser = ArgumentParser(description="Bulk import and export of registrar data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("table", choices=list(IMPORT_TABLES.keys()))
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=FORMATS)
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("table", choices=EXPORT_TABLES)
+    export_parser.add_argument("--format", choices=FORMATS, default="csv")
+    arguments = parser.parse_args()
+
+    log = logging.getLogger()
+    logging.basicConfig(level=logging.INFO)
+    config = DatabaseConfig.from_environment()
+    create_database(config)
+    conn = config.connect()
+    try:
+        if arguments.command == "import":
+            format = arguments.format or ("ndjson" if arguments.file.endswith((".ndjson", ".jsonl")) else "csv")
+            with open(arguments.file, newline="", encoding="utf-8") as file:
+                report = import_records(conn, arguments.table, read_records(file, format), log)
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            for chunk in export_rows(conn, arguments.table, arguments.format, log):
+                sys.stdout.write(chunk)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run()
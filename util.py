@@ -1,33 +1,13 @@
-from pydantic import BaseModel
-from constant import DatabaseColumn
-from sqlite3 import connect
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-class Field(BaseModel):
-    instructorId: str = None
-    department: str = None
-    courseCode: str  = None
-    sectionNumber: int = 1
-    className: str = None
-    maxEnrollment: int = 20
-    automaticEnrollmentFrozen: bool = False
-    id: str = None
-    firstName: str = None
-    lastName: str = None
-    age: int= None
-
-def get_find_class_dict(field: Field):
-    return {
-        DatabaseColumn.DEPARTMENT: field.department,
-        DatabaseColumn.COURSE_CODE: field.courseCode,
-        DatabaseColumn.SECTION_NUMBER: field.sectionNumber,
-    }
+if TYPE_CHECKING:
+    from sqlite3 import Connection
 
 def prepare_response_dict(data: dict):
-    converted_data = {}
-    for key in data.keys():
-        converted_data[snake_to_camel(key)] = data[key]
-    return converted_data
+    return {snake_to_camel(key): value for key, value in data.items()}
 
+@lru_cache(maxsize=None)
 def snake_to_camel(key: str):
     converted_str = ""
     to_upper_case = False
@@ -55,8 +35,15 @@ def valid_age(age: int):
         return False
     return True
 
-def insert_test_data(conn: connect):
+def insert_test_data(conn: "Connection"):
     cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO instructor (id, first_name, last_name, age) VALUES
+            ('INS101', 'Garply', 'Waldo', 45),
+            ('INS102', 'Fred', 'Plugh', 50),
+            ('INS103', 'Xyzzy', 'Thud', 38);
+    ''')
+
     cursor.execute('''
         INSERT INTO class ('id', instructor_id, department, course_code, section_number, class_name, current_enrollment, max_enrollment, automatic_enrollment_frozen) VALUES
             ('c25ccf22-4539-4810-b78b-81049b546bf1', 'INS101', 'FOO', 'BAR', 1, 'BAZ', 0, 10, true),
@@ -72,8 +59,10 @@ def insert_test_data(conn: connect):
     ''')
     conn.commit()
 
-def clear_tables(conn: connect):
+def clear_tables(conn: "Connection"):
     cursor = conn.cursor()
+    cursor.execute('DELETE FROM enrollment')
     cursor.execute('DELETE FROM class')
     cursor.execute('DELETE FROM student')
+    cursor.execute('DELETE FROM instructor')
     conn.commit()
\ No newline at end of file